@@ -1,16 +1,37 @@
-import os
 import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import streamlit as st
+from openai import RateLimitError
 
-from rag import get_collection, embed_query, client
+from rag import count_indexed_chunks, embed_queries, get_client, query_index
+from index_metadata import build_where
+from near_duplicates import cluster_candidates
 from database import (
+    PRACTICE_KEYWORDS,
+    get_cached_online_practices,
+    save_cached_online_practices,
     load_practice_candidates,
     save_practice_candidates,
     load_approved_practices,
+    practice_candidate_key,
+    practice_candidate_snippet,
+    practice_text_hash,
 )
 
+# How many nearest passages to pull per keyword when scanning.
+SCAN_N_RESULTS = 25
+
 
-def scan_practice_candidates_from_chroma(kind_filter=None, book_filter=None, extra_keywords=None):
+def scan_practice_candidates_from_chroma(
+    kind_filter=None,
+    book_filter=None,
+    extra_keywords=None,
+    n_results: int = SCAN_N_RESULTS,
+):
     """
     Scan the Chroma collection for possible mantra / meditation practices.
 
@@ -24,124 +45,112 @@ def scan_practice_candidates_from_chroma(kind_filter=None, book_filter=None, ext
 
     extra_keywords:
       - optional list of extra phrases to add to search
+
+    n_results:
+      - nearest passages to fetch per keyword
+
+    All keywords are embedded in one API call and searched with one
+    multi-query Chroma call.
     """
-    col = get_collection()
-    if col.count() == 0:
+    if count_indexed_chunks() == 0:
         return []
 
     existing = load_practice_candidates()
     approved = load_approved_practices()
 
-    if book_filter:
-        book_filter = set(book_filter)
-    else:
-        book_filter = None
+    # Book filtering happens inside the vector query (metadata "book").
+    book_filter = list(book_filter) if book_filter else None
 
     if extra_keywords:
         extra_keywords = [w for w in extra_keywords if w]
     else:
         extra_keywords = []
 
-    approved_texts = set()
+    approved_hashes = set()
     for kind in ("mantra", "meditation"):
         for item in approved.get(kind, []):
             text_val = item.get("text", "")
             if text_val:
-                approved_texts.add(text_val)
+                approved_hashes.add(practice_text_hash(text_val))
 
+    # Keys hash the text as stored (the snippet), so re-scans recognise
+    # candidates whose passage was longer than the snippet.
     seen_keys = set()
     for c in existing:
-        key = (c.get("kind"), c.get("source"), c.get("text"))
-        seen_keys.add(key)
-
-    queries = {
-        "mantra": [
-            "mantra", "japa", "chanting", "holy name", "nama", "stotra", "kirtan",
-        ],
-        "meditation": [
-            "meditation", "dhyana", "concentration", "inner silence",
-            "awareness of breath", "quiet mind", "watching thoughts",
-        ],
-    }
+        seen_keys.add(practice_candidate_key(c.get("kind"), c.get("source"), c.get("text")))
 
     if kind_filter in ("mantra", "meditation"):
-        active_queries = {kind_filter: queries[kind_filter][:]}
+        active_queries = {kind_filter: PRACTICE_KEYWORDS[kind_filter][:]}
     else:
-        active_queries = {k: v[:] for k, v in queries.items()}
+        active_queries = {k: v[:] for k, v in PRACTICE_KEYWORDS.items()}
 
     for k in active_queries:
         active_queries[k].extend(extra_keywords)
 
+    plan = [(kind, word) for kind, words in active_queries.items() for word in words]
+    unique_words = list(dict.fromkeys(word for _, word in plan))
+    try:
+        word_embeddings = dict(zip(unique_words, embed_queries(unique_words)))
+    except Exception as e:
+        st.error(f"Embedding failed: {e}")
+        return existing
+
+    try:
+        res = query_index(
+            [word_embeddings[word] for _, word in plan],
+            n_results=max(1, int(n_results)),
+            where=build_where(books=book_filter),
+        )
+    except Exception as e:
+        st.error(f"Chroma query failed: {e}")
+        return existing
+
+    docs_list = res.get("documents") or []
+    metas_list = res.get("metadatas") or []
+
     new_candidates = list(existing)
 
-    for kind, words in active_queries.items():
-        for word in words:
-            try:
-                emb = embed_query(word)
-                res = col.query(query_embeddings=[emb], n_results=5)
-            except Exception:
+    for (kind, _word), docs, metas in zip(plan, docs_list, metas_list):
+        for doc, meta in zip(docs or [], metas or []):
+            text = (doc or "").strip()
+            if not text:
                 continue
+            source = (meta or {}).get("source", "")
 
-            docs_list = res.get("documents") or []
-            metas_list = res.get("metadatas") or []
-            if not docs_list or not metas_list:
+            snippet = practice_candidate_snippet(text)
+            key = practice_candidate_key(kind, source, snippet)
+            if key in seen_keys:
+                continue
+            if practice_text_hash(text) in approved_hashes or practice_text_hash(snippet) in approved_hashes:
                 continue
 
-            docs = docs_list[0] or []
-            metas = metas_list[0] or []
-
-            for doc, meta in zip(docs, metas):
-                text = (doc or "").strip()
-                if not text:
-                    continue
-                source = (meta or {}).get("source", "")
-
-                if book_filter:
-                    src_base = os.path.basename(source) if source else ""
-                    if src_base not in book_filter:
-                        continue
-
-                key = (kind, source, text)
-                if key in seen_keys:
-                    continue
-                if text in approved_texts:
-                    continue
-
-                snippet = text if len(text) <= 800 else text[:800] + " ..."
-                new_candidates.append(
-                    {
-                        "kind": kind,
-                        "source": source,
-                        "text": snippet,
-                        "approved": False,
-                    }
-                )
-                seen_keys.add(key)
-
+            new_candidates.append(
+                {
+                    "kind": kind,
+                    "source": source,
+                    "text": snippet,
+                    "approved": False,
+                }
+            )
+            seen_keys.add(key)
+
+    cluster_candidates(new_candidates)
     save_practice_candidates(new_candidates)
     return new_candidates
 
 
-def fetch_online_practices(deity_name: str, scope: str, level_label: str):
-    """
-    Use the OpenAI API to suggest safe, traditional mantras or meditation
-    practices for a given deity, grouped by level.
-    """
-    deity = (deity_name or "").strip()
-    if not deity:
-        return []
-
-    scope = scope.lower()
-    if scope == "mantras":
-        scope_desc = "Only mantras (names, japa, stotras) for this deity."
-    elif scope == "meditations":
-        scope_desc = "Only meditation approaches, dhyana, visualisations, gentle breath-awareness for this deity."
-    else:
-        scope_desc = "Both mantras and meditation approaches for this deity."
+# Model and prompt for online suggestions. Bump ONLINE_PROMPT_VERSION
+# whenever the prompt or output format changes so cached answers to the
+# old prompt are not reused.
+ONLINE_PRACTICE_MODEL = "gpt-4o-mini"
+ONLINE_PROMPT_VERSION = 1
 
-    level_label = (level_label or "Beginner").strip()
+# Batch mode defaults: parallel requests and the overall request rate.
+ONLINE_MAX_WORKERS = 4
+ONLINE_REQUESTS_PER_MINUTE = 60
+ONLINE_MAX_ATTEMPTS = 3
 
-    system_msg = """
+ONLINE_SYSTEM_PROMPT = """
 You are a careful Hindu spiritual assistant.
 
 You may suggest:
@@ -157,8 +166,7 @@ STRICT RULES:
 - If you are not sure about the source of a mantra, clearly mark it as "uncertain, please verify".
 - Keep each suggestion short and focused.
 
-You MUST answer in pure JSON. No code fences.
-The JSON format is:
+Answer with a JSON object in this format:
 
 {
   "practices": [
@@ -176,6 +184,93 @@ The JSON format is:
 }
 """
 
+_PRACTICE_TEXT_FIELDS = ("title", "deity", "level", "mantra_text", "instructions", "source_hint")
+
+
+class _RateLimiter:
+    """Spaces calls evenly so all threads together stay under `per_minute`."""
+
+    def __init__(self, per_minute: int):
+        self.interval = 60.0 / max(1, per_minute)
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def _online_request_params(deity_name: str, scope: str, level_label: str):
+    deity = (deity_name or "").strip()
+    scope = (scope or "both").strip().lower()
+    if scope not in ("mantras", "meditations"):
+        scope = "both"
+    level_label = (level_label or "Beginner").strip()
+    return deity, scope, level_label
+
+
+def online_practice_cache_key(deity_name: str, scope: str, level_label: str) -> str:
+    """Cache key for one request: normalised parameters, model and prompt version."""
+    deity, scope, level_label = _online_request_params(deity_name, scope, level_label)
+    payload = {
+        "deity": deity.lower(),
+        "scope": scope,
+        "level": level_label.lower(),
+        "model": ONLINE_PRACTICE_MODEL,
+        "prompt_version": ONLINE_PROMPT_VERSION,
+    }
+    return hashlib.sha1(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _validate_online_practices(data) -> list:
+    """Keep well-formed mantra/meditation entries with string fields."""
+    if not isinstance(data, dict):
+        return []
+    cleaned = []
+    for p in data.get("practices") or []:
+        if not isinstance(p, dict):
+            continue
+        kind = str(p.get("kind") or "").strip().lower()
+        if kind not in ("mantra", "meditation"):
+            continue
+        entry = {"kind": kind}
+        for field in _PRACTICE_TEXT_FIELDS:
+            value = p.get(field)
+            entry[field] = value.strip() if isinstance(value, str) else ""
+        if not (entry["title"] or entry["mantra_text"] or entry["instructions"]):
+            continue
+        cleaned.append(entry)
+    return cleaned
+
+
+def _request_online_practices(deity_name: str, scope: str, level_label: str, use_cache: bool = True, limiter=None):
+    """
+    Fetch (or reuse cached) suggestions for one deity/scope/level.
+
+    Returns (practices, error, cached). Safe to call from worker threads:
+    it never touches Streamlit.
+    """
+    deity, scope, level_label = _online_request_params(deity_name, scope, level_label)
+    if not deity:
+        return [], "No deity name given.", False
+
+    cache_key = online_practice_cache_key(deity, scope, level_label)
+    if use_cache:
+        cached = get_cached_online_practices(cache_key)
+        if cached is not None:
+            return cached, None, True
+
+    if scope == "mantras":
+        scope_desc = "Only mantras (names, japa, stotras) for this deity."
+    elif scope == "meditations":
+        scope_desc = "Only meditation approaches, dhyana, visualisations, gentle breath-awareness for this deity."
+    else:
+        scope_desc = "Both mantras and meditation approaches for this deity."
+
     user_msg = f"""
 Deity or god name: {deity}
 
@@ -186,43 +281,87 @@ Level focus: {level_label}
 Please suggest 3–5 practices in total that are suitable for this deity and level.
 """
 
-    try:
-        resp = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_msg},
-                {"role": "user", "content": user_msg},
-            ],
-        )
-        raw = (resp.choices[0].message.content or "").strip()
-    except Exception as e:
-        st.error(f"Online practice search failed: {e}")
-        return []
+    error = None
+    for attempt in range(ONLINE_MAX_ATTEMPTS):
+        if limiter is not None:
+            limiter.wait()
+        try:
+            resp = get_client().chat.completions.create(
+                model=ONLINE_PRACTICE_MODEL,
+                messages=[
+                    {"role": "system", "content": ONLINE_SYSTEM_PROMPT},
+                    {"role": "user", "content": user_msg},
+                ],
+                response_format={"type": "json_object"},
+            )
+            raw = (resp.choices[0].message.content or "").strip()
+        except RateLimitError as e:
+            error = f"Online practice search failed: {e}"
+            time.sleep(2 ** attempt)
+            continue
+        except Exception as e:
+            return [], f"Online practice search failed: {e}", False
 
-    if raw.startswith("```"):
-        lines = raw.splitlines()
-        cleaned_lines = []
-        for line in lines:
-            if line.strip().startswith("```"):
-                continue
-            if line.strip().lower() == "json":
-                continue
-            cleaned_lines.append(line)
-        raw = "\n".join(cleaned_lines).strip()
+        try:
+            practices = _validate_online_practices(json.loads(raw))
+        except Exception as e:
+            return [], f"Could not parse online suggestions (expected JSON): {e}", False
 
-    try:
-        data = json.loads(raw)
-    except Exception as e:
-        st.error(f"Could not parse online suggestions (expected JSON): {e}")
+        if practices:
+            save_cached_online_practices(cache_key, deity, scope, level_label, ONLINE_PROMPT_VERSION, practices)
+        return practices, None, False
+
+    return [], error, False
+
+
+def fetch_online_practices(deity_name: str, scope: str, level_label: str, use_cache: bool = True):
+    """
+    Use the OpenAI API to suggest safe, traditional mantras or meditation
+    practices for a given deity, grouped by level.
+    """
+    practices, error, _cached = _request_online_practices(deity_name, scope, level_label, use_cache=use_cache)
+    if error:
+        st.error(error)
+    return practices
+
+
+def fetch_online_practices_batch(
+    deity_names,
+    scope: str,
+    level_labels,
+    use_cache: bool = True,
+    max_workers: int = ONLINE_MAX_WORKERS,
+    requests_per_minute: int = ONLINE_REQUESTS_PER_MINUTE,
+):
+    """
+    Fetch suggestions for every (deity, level) pair concurrently.
+
+    Cached pairs are answered without an API call; the rest share one rate
+    limiter. Returns one dict per pair, in input order:
+    {"deity", "level", "practices", "error", "cached"}.
+    """
+    deities = list(dict.fromkeys(d.strip() for d in deity_names or [] if d and d.strip()))
+    levels = list(dict.fromkeys(level_labels or [])) or ["Beginner"]
+    pairs = [(deity, level) for deity in deities for level in levels]
+    if not pairs:
         return []
 
-    practices = data.get("practices", [])
-    cleaned = []
-    for p in practices:
-        if not isinstance(p, dict):
-            continue
-        kind = (p.get("kind") or "").lower()
-        if kind not in ("mantra", "meditation"):
-            continue
-        cleaned.append(p)
-    return cleaned
\ No newline at end of file
+    limiter = _RateLimiter(requests_per_minute)
+    with ThreadPoolExecutor(max_workers=max(1, int(max_workers))) as pool:
+        futures = [
+            pool.submit(_request_online_practices, deity, scope, level, use_cache, limiter)
+            for deity, level in pairs
+        ]
+        results = []
+        for (deity, level), future in zip(pairs, futures):
+            practices, error, cached = future.result()
+            results.append(
+                {
+                    "deity": deity,
+                    "level": level,
+                    "practices": practices,
+                    "error": error,
+                    "cached": cached,
+                }
+            )
+    return results
@@ -0,0 +1,421 @@
+"""
+Headless HTTP API for mobile and other non-Streamlit clients.
+
+An ASGI app (Starlette, served by uvicorn) over the same index, prompts and
+SQLite/JSON stores as the Streamlit app:
+  - the index is opened once per process and re-opened only when
+    shard_manifest.json / active_index.json or the quantized export change,
+  - OpenAI calls go through one AsyncOpenAI client with a pooled HTTP
+    connection limit, so waiting on the model ties up no thread,
+  - index queries, SQLite and JSON file access run in a bounded thread pool.
+
+Log in with a registered app user; the token is a normal app session
+(sessions.json, same SESSION_TTL_MINUTES). Send it on every other call as
+"Authorization: Bearer <token>".
+
+    POST   /v1/session             {"username", "password"} -> {"token", "expires_in"}
+    GET    /v1/retrieve            ?q=...&k=5&book=a.pdf&book=b.pdf&deity=shiva&neighbours=1
+    POST   /v1/answer              {"question", "books", "deity", "neighbours",
+                                    "history", "answer_length", "stream"}
+    GET    /v1/favourites
+    POST   /v1/favourites          {"content", "books_used"}
+    DELETE /v1/favourites/{index}
+    GET    /v1/progress/{deity}
+    POST   /v1/progress/complete   {"mantra_id", "reflection"}
+
+With "stream": true, /v1/answer replies with server-sent events: one
+"passages" event, "delta" events as the story is written, then "done"
+(or "error").
+
+Usage:
+    python api_server.py --port 8000 --workers 2
+    uvicorn api_server:app --host 0.0.0.0 --port 8000
+"""
+
+import argparse
+import asyncio
+import contextlib
+import datetime
+import json
+import os
+import sys
+
+import anyio
+import httpx
+from openai import AsyncOpenAI, OpenAIError
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from database import (
+    SESSIONS_FILE,
+    SESSION_TTL_MINUTES,
+    add_favourite as _add_favourite,
+    add_session,
+    get_level_progress_summary,
+    get_next_uncompleted_mantra,
+    list_book_names,
+    load_favourites,
+    load_sessions,
+    load_user_from_db,
+    mark_mantra_completed,
+    remove_favourite as _remove_favourite,
+)
+from story_engine import (
+    ANSWER_MODEL,
+    CONTEXT_TOKEN_BUDGET,
+    EMBED_MODEL,
+    build_answer_messages,
+    index_stamp,
+    no_passages_message,
+    open_index,
+    search_passages,
+)
+
+# Concurrent requests to the OpenAI API per process; more wait for a slot.
+OPENAI_MAX_CONNECTIONS = 100
+OPENAI_KEEPALIVE_CONNECTIONS = 20
+OPENAI_TIMEOUT_SECONDS = 60
+
+# Threads for index queries and SQLite / JSON file access.
+BLOCKING_THREADS = 32
+
+MAX_K = 20
+MAX_NEIGHBOURS = 2
+
+
+class ApiError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+_blocking = anyio.CapacityLimiter(BLOCKING_THREADS)
+_index = {"stamp": None, "collections": None}
+_index_lock = asyncio.Lock()
+_sessions_cache = {"mtime": None, "data": {}}
+
+
+async def run_blocking(func, *args):
+    return await anyio.to_thread.run_sync(func, *args, limiter=_blocking)
+
+
+# ---------- SHARED RESOURCES ----------
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise RuntimeError("OPENAI_API_KEY is not configured.")
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_KEEPALIVE_CONNECTIONS,
+        ),
+        timeout=httpx.Timeout(OPENAI_TIMEOUT_SECONDS, connect=10),
+    )
+    app.state.openai = AsyncOpenAI(api_key=api_key, http_client=http_client)
+    try:
+        yield
+    finally:
+        await app.state.openai.close()
+
+
+async def get_index():
+    """The open shard collections, re-opened after a reindex or layout change."""
+    stamp = await run_blocking(index_stamp)
+    if _index["stamp"] == stamp:
+        return _index["collections"]
+    async with _index_lock:
+        if _index["stamp"] != stamp:
+            _index["collections"] = await run_blocking(open_index)
+            _index["stamp"] = stamp
+    return _index["collections"]
+
+
+async def embed(request, text: str):
+    try:
+        r = await request.app.state.openai.embeddings.create(model=EMBED_MODEL, input=[text])
+    except OpenAIError as e:
+        raise ApiError(502, f"Embedding request failed: {e}")
+    return r.data[0].embedding
+
+
+# ---------- SESSIONS ----------
+
+def _read_sessions() -> dict:
+    """sessions.json, re-read only when the file changes."""
+    try:
+        mtime = os.path.getmtime(SESSIONS_FILE)
+    except OSError:
+        return {}
+    if _sessions_cache["mtime"] != mtime:
+        _sessions_cache["data"] = load_sessions()
+        _sessions_cache["mtime"] = mtime
+    return _sessions_cache["data"]
+
+
+def _session_expired(sess: dict) -> bool:
+    try:
+        created = datetime.datetime.fromisoformat(sess.get("created_at") or "")
+    except ValueError:
+        return True
+    return datetime.datetime.now() - created > datetime.timedelta(minutes=SESSION_TTL_MINUTES)
+
+
+async def current_user(request) -> str:
+    """Username of the session in the Authorization header; raises ApiError(401)."""
+    header = request.headers.get("authorization", "")
+    token = header[7:].strip() if header.lower().startswith("bearer ") else ""
+    if not token:
+        raise ApiError(401, "Missing bearer token.")
+    sess = (await run_blocking(_read_sessions)).get(token)
+    if not sess or sess.get("role") != "user" or not sess.get("username") or _session_expired(sess):
+        raise ApiError(401, "Session expired or unknown; log in again.")
+    return sess["username"]
+
+
+def _check_login(username: str, password: str) -> bool:
+    from auth import check_password
+
+    profile = load_user_from_db(username)
+    return bool(profile) and check_password(password, profile.get("password", ""))
+
+
+async def create_session(request):
+    body = await _json_body(request)
+    username = str(body.get("username") or "").strip()
+    password = str(body.get("password") or "").strip()
+    if not username or not password or not await run_blocking(_check_login, username, password):
+        raise ApiError(401, "Invalid username or password.")
+    token = await run_blocking(add_session, "user", username)
+    return JSONResponse({"token": token, "expires_in": SESSION_TTL_MINUTES * 60})
+
+
+# ---------- RETRIEVAL / ANSWERS ----------
+
+async def _json_body(request) -> dict:
+    try:
+        body = await request.json()
+    except Exception:
+        raise ApiError(400, "Request body must be JSON.")
+    if not isinstance(body, dict):
+        raise ApiError(400, "Request body must be a JSON object.")
+    return body
+
+
+def _bounded_int(value, default: int, low: int, high: int) -> int:
+    try:
+        value = int(value) if value is not None else default
+    except (TypeError, ValueError):
+        raise ApiError(400, f"Expected an integer, got {value!r}.")
+    return max(low, min(high, value))
+
+
+def _passage_json(doc: str, meta: dict) -> dict:
+    meta = meta or {}
+    return {
+        "text": doc,
+        "book": meta.get("book") or os.path.basename(meta.get("source") or ""),
+        "chunk_id": meta.get("chunk_id"),
+        "metadata": meta,
+    }
+
+
+def _books_used(metas) -> list:
+    return sorted({os.path.basename(m["source"]) for m in metas if m and m.get("source")})
+
+
+async def _retrieve(request, question: str, k: int, books, deity, neighbours: int):
+    collections = await get_index()
+    emb = await embed(request, question)
+    return await run_blocking(
+        search_passages, collections, emb, k, books or None, deity or None, neighbours, CONTEXT_TOKEN_BUDGET
+    )
+
+
+async def retrieve(request):
+    await current_user(request)
+    params = request.query_params
+    question = (params.get("q") or "").strip()
+    if not question:
+        raise ApiError(400, "Parameter q is required.")
+    k = _bounded_int(params.get("k"), 5, 1, MAX_K)
+    neighbours = _bounded_int(params.get("neighbours"), 0, 0, MAX_NEIGHBOURS)
+    docs, metas = await _retrieve(
+        request, question, k, params.getlist("book"), (params.get("deity") or "").lower(), neighbours
+    )
+    return JSONResponse({"passages": [_passage_json(d, m) for d, m in zip(docs, metas)]})
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def answer(request):
+    await current_user(request)
+    body = await _json_body(request)
+    question = str(body.get("question") or "").strip()
+    if not question:
+        raise ApiError(400, "Field question is required.")
+    books = body.get("books") or []
+    if not isinstance(books, list):
+        raise ApiError(400, "Field books must be a list of file names.")
+    history = [
+        {"role": m.get("role"), "content": str(m.get("content") or "")}
+        for m in body.get("history") or []
+        if isinstance(m, dict)
+    ]
+    neighbours = _bounded_int(body.get("neighbours"), 1, 0, MAX_NEIGHBOURS)
+    answer_length = str(body.get("answer_length") or "Medium")
+
+    docs, metas = await _retrieve(request, question, 5, books, str(body.get("deity") or "").lower(), neighbours)
+    book_list = await run_blocking(list_book_names)
+    passages = [_passage_json(d, m) for d, m in zip(docs, metas)]
+    books_used = _books_used(metas)
+    messages = build_answer_messages(question, docs, book_list, history, answer_length) if docs else None
+
+    if not body.get("stream"):
+        if not docs:
+            text = no_passages_message(book_list)
+        else:
+            try:
+                r = await request.app.state.openai.chat.completions.create(model=ANSWER_MODEL, messages=messages)
+            except OpenAIError as e:
+                raise ApiError(502, f"Chat completion failed: {e}")
+            text = r.choices[0].message.content
+        return JSONResponse({"answer": text, "passages": passages, "books_used": books_used})
+
+    async def events():
+        yield _sse("passages", {"passages": passages, "books_used": books_used})
+        if not docs:
+            text = no_passages_message(book_list)
+            yield _sse("delta", {"text": text})
+            yield _sse("done", {"answer": text})
+            return
+        parts = []
+        try:
+            stream = await request.app.state.openai.chat.completions.create(
+                model=ANSWER_MODEL, messages=messages, stream=True
+            )
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    yield _sse("delta", {"text": delta})
+        except Exception as e:
+            yield _sse("error", {"error": f"Chat completion failed: {e}"})
+            return
+        yield _sse("done", {"answer": "".join(parts)})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# ---------- FAVOURITES ----------
+
+async def list_favourites(request):
+    username = await current_user(request)
+    favs_all = await run_blocking(load_favourites)
+    return JSONResponse({"favourites": favs_all.get(username, [])})
+
+
+async def add_favourite(request):
+    username = await current_user(request)
+    body = await _json_body(request)
+    content = str(body.get("content") or "").strip()
+    if not content:
+        raise ApiError(400, "Field content is required.")
+    books_used = [str(b) for b in body.get("books_used") or []]
+    saved = await run_blocking(_add_favourite, username, content, books_used)
+    return JSONResponse({"saved": saved}, status_code=201 if saved else 200)
+
+
+async def delete_favourite(request):
+    username = await current_user(request)
+    removed = await run_blocking(_remove_favourite, username, request.path_params["index"])
+    if not removed:
+        raise ApiError(404, "No favourite at that position.")
+    return JSONResponse({"removed": True})
+
+
+# ---------- MANTRA PROGRESS ----------
+
+def _progress(username: str, deity: str) -> dict:
+    next_mantra, _stats = get_next_uncompleted_mantra(username, deity)
+    levels = get_level_progress_summary(username, deity)
+    return {
+        "deity": deity,
+        "next_mantra": next_mantra,
+        "levels": [
+            {"level": lvl, "completed": done, "total": total}
+            for lvl, (done, total) in sorted(levels.items())
+        ],
+        "completed": sum(done for done, _ in levels.values()),
+        "total": sum(total for _, total in levels.values()),
+    }
+
+
+async def get_progress(request):
+    username = await current_user(request)
+    return JSONResponse(await run_blocking(_progress, username, request.path_params["deity"]))
+
+
+async def complete_mantra(request):
+    username = await current_user(request)
+    body = await _json_body(request)
+    mantra_id = _bounded_int(body.get("mantra_id"), 0, 0, sys.maxsize)
+    if not mantra_id:
+        raise ApiError(400, "Field mantra_id is required.")
+    saved = await run_blocking(mark_mantra_completed, username, mantra_id, str(body.get("reflection") or ""))
+    return JSONResponse({"saved": saved})
+
+
+# ---------- APP ----------
+
+async def health(request):
+    return JSONResponse({"ok": True})
+
+
+async def _api_error(request, exc: ApiError):
+    return JSONResponse({"error": exc.message}, status_code=exc.status)
+
+
+app = Starlette(
+    routes=[
+        Route("/v1/health", health),
+        Route("/v1/session", create_session, methods=["POST"]),
+        Route("/v1/retrieve", retrieve),
+        Route("/v1/answer", answer, methods=["POST"]),
+        Route("/v1/favourites", list_favourites, methods=["GET"]),
+        Route("/v1/favourites", add_favourite, methods=["POST"]),
+        Route("/v1/favourites/{index:int}", delete_favourite, methods=["DELETE"]),
+        Route("/v1/progress/complete", complete_mantra, methods=["POST"]),
+        Route("/v1/progress/{deity}", get_progress),
+    ],
+    exception_handlers={ApiError: _api_error},
+    lifespan=lifespan,
+)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1, help="processes; each has its own pools")
+    args = parser.parse_args()
+
+    import uvicorn
+
+    uvicorn.run("api_server:app", host=args.host, port=args.port, workers=args.workers)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,18 +2,15 @@ import os
 import json
 import datetime
 import subprocess
-import secrets
 import streamlit as st
 
 from ui import apply_global_css, render_answer_html, render_source_html, render_mantra_html
-from rag import retrieve_passages, answer_question, generate_styled_image
 from database import (
     load_sessions,
-    save_sessions,
-    list_book_names,
+    add_session,
+    remove_session,
     load_unreadable,
     load_favourites,
-    save_favourites,
     load_approved_practices,
     save_approved_practices,
     load_practice_candidates,
@@ -29,10 +26,6 @@ from auth import (
     save_users,
     get_admin_credentials,
 )
-from admin_tools import (
-    scan_practice_candidates_from_chroma,
-    fetch_online_practices,
-)
 from helpers import (
     load_feedback,
     save_feedback,
@@ -40,15 +33,17 @@ from helpers import (
     get_daily_focus,
     get_micro_practice,
     get_current_username,
+    cached_book_names,
 )
 from session_state_utils import bootstrap_session_state
 from navigation import get_main_mode
-from app_sections.admin_panel import render_admin_panel
 from app_sections.home import render_home
 from app_sections.meditation import render_meditation_journey
 from app_sections.mantra import render_mantra_journey
 from app_sections.my_journey import render_my_journey
-from app_sections.dharma_chat import render_dharma_chat
+
+# The admin panel and the chat pull in rag, chromadb and openai; they are
+# imported in their branches below so other pages start without them.
 
 # Ensure guidance media directories exist
 os.makedirs(GUIDANCE_AUDIO_DIR, exist_ok=True)
@@ -80,7 +75,7 @@ os.makedirs(BOOKS_DIR, exist_ok=True)
 bootstrap_session_state(
     st,
     load_sessions,
-    save_sessions,
+    remove_session,
     load_users,
     SESSION_TTL_MINUTES,
 )
@@ -119,14 +114,7 @@ if current_role == "guest":
                 st.session_state["age_group"] = None
                 st.session_state["user_profile"] = {}
 
-                sessions = load_sessions()
-                token = secrets.token_urlsafe(16)
-                sessions[token] = {
-                    "role": "admin",
-                    "username": username_input,
-                    "created_at": datetime.datetime.now().isoformat(),
-                }
-                save_sessions(sessions)
+                token = add_session("admin", username_input)
                 st.session_state["session_token"] = token
 
                 st.success("Logged in as admin.")
@@ -174,14 +162,7 @@ if current_role == "guest":
                             st.session_state["age_group"] = age_group
                             st.session_state["user_profile"] = profile
 
-                            sessions = load_sessions()
-                            token = secrets.token_urlsafe(16)
-                            sessions[token] = {
-                                "role": "user",
-                                "username": username_input,
-                                "created_at": datetime.datetime.now().isoformat(),
-                            }
-                            save_sessions(sessions)
+                            token = add_session("user", username_input)
                             st.session_state["session_token"] = token
 
                             st.success(f"Logged in as user ({age_group or 'unknown age'} mode).")
@@ -262,14 +243,7 @@ if current_role == "guest":
                                 st.session_state["age_group"] = age_group
                                 st.session_state["user_profile"] = profile
 
-                                sessions = load_sessions()
-                                token = secrets.token_urlsafe(16)
-                                sessions[token] = {
-                                    "role": "user",
-                                    "username": username.strip(),
-                                    "created_at": datetime.datetime.now().isoformat(),
-                                }
-                                save_sessions(sessions)
+                                token = add_session("user", username.strip())
                                 st.session_state["session_token"] = token
 
                                 st.success(f"Signed up and logged in as user ({age_group} mode).")
@@ -314,9 +288,7 @@ with col_login:
         if st.button("Logout", key="logout_button_admin"):
             token = st.session_state.get("session_token")
             if token:
-                sessions = load_sessions()
-                sessions.pop(token, None)
-                save_sessions(sessions)
+                remove_session(token)
                 st.session_state["session_token"] = None
 
             st.session_state["role"] = "guest"
@@ -341,9 +313,7 @@ with col_login:
         if st.button("Logout", key="logout_button_user"):
             token = st.session_state.get("session_token")
             if token:
-                sessions = load_sessions()
-                sessions.pop(token, None)
-                save_sessions(sessions)
+                remove_session(token)
                 st.session_state["session_token"] = None
 
             st.session_state["role"] = "guest"
@@ -356,6 +326,8 @@ with col_login:
 # ---------- ADMIN PANEL ----------
 role = st.session_state.get("role", "guest")
 if role == "admin":
+    from app_sections.admin_panel import render_admin_panel
+
     render_admin_panel(
         BOOKS_DIR=BOOKS_DIR,
         DAILY_REFLECTION_FILE=DAILY_REFLECTION_FILE,
@@ -401,7 +373,7 @@ st.markdown("---")
 
 # ---------- MAIN CONTENT: HOME / JOURNEYS ----------
 if "book_list" not in locals():
-    book_list = list_book_names()
+    book_list = cached_book_names()
 
 
 # ---------- HOME ----------
@@ -410,6 +382,8 @@ if main_mode == "Home":
 
 # ---------- DHARMA CHAT ----------
 elif main_mode == "Dharma chat":
+    from app_sections.dharma_chat import render_dharma_chat
+
     render_dharma_chat(book_list)
 
 # ---------- MEDITATION JOURNEY ----------
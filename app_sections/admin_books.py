@@ -2,7 +2,15 @@ import os
 import subprocess
 import streamlit as st
 
-from database import list_book_names, load_unreadable
+from database import (
+    find_book_by_sha256,
+    list_book_names,
+    list_duplicate_books,
+    load_unreadable,
+    register_book,
+    sync_book_registry,
+)
+from media_ingest import UploadTooLarge, commit_temp, stream_to_temp
 
 
 def render_admin_books(BOOKS_DIR):
@@ -23,6 +31,9 @@ def render_admin_books(BOOKS_DIR):
     if uploaded_books:
         if st.button("📥 Save uploaded books", key="save_uploaded_books"):
             saved_files = []
+            skipped = []
+            # Books copied into books/ by hand get hashed once here.
+            sync_book_registry()
             for f in uploaded_books:
                 original_name = os.path.basename(f.name)
                 if not original_name:
@@ -32,21 +43,27 @@ def render_admin_books(BOOKS_DIR):
                 if not ext:
                     ext = ".pdf"
 
-                dest_path = os.path.join(BOOKS_DIR, original_name)
-                counter = 1
-                while os.path.exists(dest_path):
-                    dest_path = os.path.join(BOOKS_DIR, f"{base}_{counter}{ext}")
-                    counter += 1
-
-                with open(dest_path, "wb") as out:
-                    out.write(f.getbuffer())
+                try:
+                    tmp_path, sha256, size = stream_to_temp(f, BOOKS_DIR, "book")
+                except (UploadTooLarge, OSError) as e:
+                    st.error(f"Could not save `{original_name}`: {e}")
+                    continue
+                existing = find_book_by_sha256(sha256)
+                if existing:
+                    os.remove(tmp_path)
+                    skipped.append((original_name, existing))
+                    continue
 
+                dest_path = commit_temp(tmp_path, os.path.join(BOOKS_DIR, base + ext))
+                register_book(os.path.basename(dest_path), sha256, size)
                 saved_files.append(os.path.basename(dest_path))
 
+            for name, existing in skipped:
+                st.info(f"`{name}` is identical to `{existing}`, which is already in the library. Not saved again.")
             if saved_files:
                 st.success(f"Saved {len(saved_files)} book(s): " + ", ".join(saved_files))
                 st.info("Now click **'🔄 Reindex books now'** below so the app can read them.")
-            else:
+            elif not skipped:
                 st.warning("No valid files were saved. Please try again.")
 
     st.markdown("---")
@@ -82,6 +99,12 @@ def render_admin_books(BOOKS_DIR):
         for path, reason in unreadable.items():
             st.write(f"- `{os.path.basename(path)}` — {reason}")
 
+    duplicates = list_duplicate_books()
+    if duplicates:
+        st.info("These books have the same text as another book and were not indexed again:")
+        for name, original in duplicates.items():
+            st.write(f"- `{name}` → same as `{original}`")
+
     book_list = list_book_names()
     if book_list:
         with st.expander("Books currently available"):
@@ -1,9 +1,9 @@
-import os
 import datetime
 import streamlit as st
 
-from database import load_approved_practices, save_approved_practices
+from database import add_approved_practice, list_practice_deities, query_approved_practices
 from admin_tools import fetch_online_practices
+from media_ingest import ingest_upload, safe_file_name
 from ui import render_source_html
 
 
@@ -41,18 +41,7 @@ def render_admin_guidance(GUIDANCE_AUDIO_DIR, GUIDANCE_MEDIA_DIR):
         kind_key = "mantra"
         st.markdown("**Mantra targeting (for users):**")
 
-        existing_deities = []
-        try:
-            approved_existing = load_approved_practices()
-            mantra_existing = approved_existing.get("mantra", [])
-            deity_set = set()
-            for item in mantra_existing:
-                dname = (item.get("deity") or "").strip()
-                if dname:
-                    deity_set.add(dname)
-            existing_deities = sorted(deity_set, key=str.lower)
-        except Exception:
-            existing_deities = []
+        existing_deities = list_practice_deities("mantra")
 
         deity_choice_mode = "Type new name"
         selected_existing_deity = None
@@ -149,11 +138,9 @@ def render_admin_guidance(GUIDANCE_AUDIO_DIR, GUIDANCE_MEDIA_DIR):
             try:
                 original_name = uploaded_audio.name
                 ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-                safe_name = original_name.replace(" ", "_")
+                safe_name = safe_file_name(original_name)
                 filename = f"{kind_key}_{ts}_{safe_name}"
-                saved_audio_path = os.path.join(GUIDANCE_AUDIO_DIR, filename)
-                with open(saved_audio_path, "wb") as f:
-                    f.write(uploaded_audio.getbuffer())
+                saved_audio_path = ingest_upload(uploaded_audio, GUIDANCE_AUDIO_DIR, filename, "audio")["path"]
             except Exception as e:
                 st.error(f"Could not save audio file: {e}")
                 saved_audio_path = None
@@ -164,11 +151,9 @@ def render_admin_guidance(GUIDANCE_AUDIO_DIR, GUIDANCE_MEDIA_DIR):
             try:
                 image_original_name = uploaded_image.name
                 ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-                safe_name_img = image_original_name.replace(" ", "_")
+                safe_name_img = safe_file_name(image_original_name)
                 img_filename = f"{kind_key}_img_{ts}_{safe_name_img}"
-                saved_image_path = os.path.join(GUIDANCE_MEDIA_DIR, img_filename)
-                with open(saved_image_path, "wb") as f:
-                    f.write(uploaded_image.getbuffer())
+                saved_image_path = ingest_upload(uploaded_image, GUIDANCE_MEDIA_DIR, img_filename, "image")["path"]
             except Exception as e:
                 st.error(f"Could not save image file: {e}")
                 saved_image_path = None
@@ -179,18 +164,13 @@ def render_admin_guidance(GUIDANCE_AUDIO_DIR, GUIDANCE_MEDIA_DIR):
             try:
                 video_original_name = uploaded_video.name
                 ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-                safe_name_vid = video_original_name.replace(" ", "_")
+                safe_name_vid = safe_file_name(video_original_name)
                 vid_filename = f"{kind_key}_vid_{ts}_{safe_name_vid}"
-                saved_video_path = os.path.join(GUIDANCE_MEDIA_DIR, vid_filename)
-                with open(saved_video_path, "wb") as f:
-                    f.write(uploaded_video.getbuffer())
+                saved_video_path = ingest_upload(uploaded_video, GUIDANCE_MEDIA_DIR, vid_filename, "video")["path"]
             except Exception as e:
                 st.error(f"Could not save video file: {e}")
                 saved_video_path = None
 
-        approved = load_approved_practices()
-        practices_list = approved.get(kind_key) or []
-
         entry = {"source": "manual-guidance"}
 
         if kind_key == "meditation":
@@ -217,9 +197,9 @@ def render_admin_guidance(GUIDANCE_AUDIO_DIR, GUIDANCE_MEDIA_DIR):
             if video_original_name:
                 entry["video_original_name"] = video_original_name
 
-        practices_list.append(entry)
-        approved[kind_key] = practices_list
-        save_approved_practices(approved)
+        if add_approved_practice(kind_key, entry) is None:
+            st.error("Could not save this guidance. Please try again.")
+            st.stop()
 
         st.success("Your guidance has been saved and will appear in the journey levels.")
         st.rerun()
@@ -227,8 +207,7 @@ def render_admin_guidance(GUIDANCE_AUDIO_DIR, GUIDANCE_MEDIA_DIR):
     st.markdown("---")
     st.subheader("Existing mantra deities")
 
-    approved_all = load_approved_practices()
-    mantra_existing_all = approved_all.get("mantra", []) or []
+    mantra_existing_all = query_approved_practices("mantra")
 
     deity_map = {}
     for idx, item in enumerate(mantra_existing_all):
@@ -2,12 +2,27 @@ import streamlit as st
 
 from database import get_top_completed_mantras
 
+STATS_WINDOWS = {
+    "All time": None,
+    "Last 7 days": 7,
+    "Last 30 days": 30,
+}
+
 
 def render_admin_mantra_stats():
     st.subheader("Most listened/completed structured mantras")
-    top_items = get_top_completed_mantras(limit=15)
+    window_label = st.radio(
+        "Time window",
+        list(STATS_WINDOWS.keys()),
+        horizontal=True,
+        key="admin_mantra_stats_window",
+    )
+    top_items = get_top_completed_mantras(limit=15, days=STATS_WINDOWS[window_label])
     if not top_items:
-        st.info("No completion data yet. Users need to finish structured mantras for stats to appear.")
+        if STATS_WINDOWS[window_label]:
+            st.info(f"No structured mantras were completed in the {window_label.lower()}.")
+        else:
+            st.info("No completion data yet. Users need to finish structured mantras for stats to appear.")
         return
     for item in top_items:
         deity = item.get("deity_id") or "Unknown deity"
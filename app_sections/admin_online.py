@@ -1,6 +1,6 @@
 import streamlit as st
 
-from admin_tools import fetch_online_practices
+from admin_tools import fetch_online_practices, fetch_online_practices_batch
 from database import load_practice_candidates, save_practice_candidates
 
 
@@ -11,11 +11,27 @@ def render_admin_online():
         "You remain the final approval before anything reaches the users."
     )
 
-    deity_name = st.text_input(
-        "Deity / God name (e.g. Shiva, Krishna, Devi)",
-        key="online_deity_name",
+    search_mode = st.radio(
+        "Search mode",
+        ["Single deity", "Batch (several deities)"],
+        horizontal=True,
+        key="online_search_mode",
     )
 
+    if search_mode == "Single deity":
+        deity_name = st.text_input(
+            "Deity / God name (e.g. Shiva, Krishna, Devi)",
+            key="online_deity_name",
+        )
+    else:
+        deity_names_str = st.text_area(
+            "Deity / God names (one per line or comma-separated)",
+            key="online_deity_names",
+            height=120,
+        )
+        deity_names = [d.strip() for d in deity_names_str.replace(",", "\n").splitlines() if d.strip()]
+        deity_name = ""
+
     scope_choice = st.radio(
         "What would you like to search for?",
         ["Mantras", "Meditations", "Both"],
@@ -23,14 +39,30 @@ def render_admin_online():
         key="online_scope_choice",
     )
 
-    level_choice = st.selectbox(
-        "Which level are you focusing on?",
-        ["Beginner", "Intermediate", "Deeper"],
-        index=0,
-        key="online_level_choice",
+    if search_mode == "Single deity":
+        level_choice = st.selectbox(
+            "Which level are you focusing on?",
+            ["Beginner", "Intermediate", "Deeper"],
+            index=0,
+            key="online_level_choice",
+        )
+        level_choices = [level_choice]
+    else:
+        level_choices = st.multiselect(
+            "Which levels should be fetched for each deity?",
+            ["Beginner", "Intermediate", "Deeper"],
+            default=["Beginner"],
+            key="online_level_choices",
+        )
+        level_choice = level_choices[0] if level_choices else "Beginner"
+
+    refresh = st.checkbox(
+        "Ignore cached answers and ask the model again",
+        key="online_refresh_cache",
+        help="Identical searches are normally answered from the cache.",
     )
 
-    if st.button("🌐 Search online suggestions", key="online_search_button"):
+    if search_mode == "Single deity" and st.button("🌐 Search online suggestions", key="online_search_button"):
         if not deity_name.strip():
             st.error("Please enter a deity / god name first.")
         else:
@@ -39,6 +71,7 @@ def render_admin_online():
                     deity_name=deity_name,
                     scope=scope_choice,
                     level_label=level_choice,
+                    use_cache=not refresh,
                 )
             st.session_state["online_search_results"] = results
             if results:
@@ -46,6 +79,36 @@ def render_admin_online():
             else:
                 st.warning("No suggestions were returned. Try adjusting scope or deity name.")
 
+    if search_mode != "Single deity" and st.button("🌐 Search all deities", key="online_batch_button"):
+        if not deity_names or not level_choices:
+            st.error("Please enter at least one deity and choose at least one level.")
+        else:
+            with st.spinner(f"Fetching suggestions for {len(deity_names) * len(level_choices)} deity/level pairs..."):
+                batch = fetch_online_practices_batch(
+                    deity_names,
+                    scope=scope_choice,
+                    level_labels=level_choices,
+                    use_cache=not refresh,
+                )
+            results = []
+            for item in batch:
+                for p in item["practices"]:
+                    # Keep the requested deity/level when the model leaves them out.
+                    p = dict(p)
+                    p["deity"] = p.get("deity") or item["deity"]
+                    p["level"] = p.get("level") or item["level"]
+                    results.append(p)
+            st.session_state["online_search_results"] = results
+
+            cached = sum(1 for item in batch if item["cached"])
+            failed = [item for item in batch if item["error"]]
+            st.success(
+                f"Received {len(results)} suggestions for {len(batch)} deity/level pairs "
+                f"({cached} answered from cache)."
+            )
+            for item in failed:
+                st.warning(f"{item['deity']} ({item['level']}): {item['error']}")
+
     results = st.session_state.get("online_search_results") or []
     if results:
         st.markdown("### Suggestions")
@@ -7,6 +7,7 @@ from app_sections.admin_structured_view import render_admin_structured_view
 from app_sections.admin_reflection import render_admin_reflection
 from app_sections.admin_online import render_admin_online
 from app_sections.admin_feedback import render_admin_feedback
+from app_sections.admin_mantra_stats import render_admin_mantra_stats
 
 
 def render_admin_panel(
@@ -25,6 +26,7 @@ def render_admin_panel(
             "Guidance",
             "Daily reflection",
             "Internet search",
+            "Mantra stats",
             "Feedback collection",
         ],
         horizontal=True,
@@ -40,5 +42,7 @@ def render_admin_panel(
         render_admin_online()
     elif admin_view == "Daily reflection":
         render_admin_reflection(DAILY_REFLECTION_FILE, GUIDANCE_MEDIA_DIR)
+    elif admin_view == "Mantra stats":
+        render_admin_mantra_stats()
     elif admin_view == "Feedback collection":
         render_admin_feedback(load_feedback_func, FEEDBACK_FILE)
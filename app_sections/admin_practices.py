@@ -2,13 +2,44 @@ import os
 import streamlit as st
 
 from database import (
-    list_book_names,
-    load_practice_candidates,
-    save_practice_candidates,
-    load_approved_practices,
-    save_approved_practices,
+    approve_practice_candidates,
+    count_approved_practices,
+    delete_approved_practice,
+    list_practice_deities,
+    query_approved_practices,
+    query_practice_candidates,
+    update_approved_practice,
 )
-from admin_tools import scan_practice_candidates_from_chroma
+from admin_tools import SCAN_N_RESULTS, scan_practice_candidates_from_chroma
+from helpers import cached_book_names, rerun_fragment
+from media_derivatives import serving_path
+
+PAGE_SIZES = [10, 25, 50]
+
+# Meditations are banded by position, mantras by level; both inclusive.
+BANDS = {
+    "Beginner": (1, 3),
+    "Intermediate": (4, 7),
+    "Deeper": (8, None),
+}
+
+
+def _band_for(n: int) -> str:
+    if n <= 3:
+        return "Beginner"
+    elif n <= 7:
+        return "Intermediate"
+    else:
+        return "Deeper"
+
+
+def _page_offset(total: int, page_size: int, key: str) -> int:
+    """Render a page picker for `total` rows and return the offset of the chosen page."""
+    pages = max(1, (total + page_size - 1) // page_size)
+    if st.session_state.get(key, 1) > pages:
+        st.session_state[key] = pages
+    page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, step=1, key=key)
+    return (int(page) - 1) * page_size
 
 
 def render_admin_practices():
@@ -17,20 +48,26 @@ def render_admin_practices():
         "Here you can see all meditation and mantra practices that have already been approved "
         "for users, and you can filter, edit, or remove them."
     )
+    # Fragments: paging, filtering and editing rerun only their own section.
+    _render_approved_overview()
+    _render_candidate_review()
+
 
-    approved = load_approved_practices()
-    med_practices = approved.get("meditation", []) or []
-    mantra_practices = approved.get("mantra", []) or []
+@st.fragment
+def _render_approved_overview():
+    med_total = count_approved_practices("meditation")
+    mantra_total = count_approved_practices("mantra")
 
-    if not med_practices and not mantra_practices:
+    if not med_total and not mantra_total:
         st.info("No practices have been approved yet. Use the Practice approval section below to approve some.")
     else:
+        page_size = st.selectbox("Practices per page", PAGE_SIZES, index=0, key="approved_page_size")
         col_m, col_j = st.columns(2)
 
         with col_m:
             st.markdown("### 🧘 Meditation practices")
 
-            if not med_practices:
+            if not med_total:
                 st.write("No meditation practices approved yet.")
             else:
                 level_filter = st.selectbox(
@@ -39,18 +76,24 @@ def render_admin_practices():
                     key="meditation_level_filter",
                 )
 
-                def _med_band_for_index(idx: int) -> str:
-                    if idx <= 3:
-                        return "Beginner"
-                    elif idx <= 7:
-                        return "Intermediate"
-                    else:
-                        return "Deeper"
+                first, last = 1, med_total
+                if level_filter != "All levels":
+                    low, high = BANDS[level_filter]
+                    first = low
+                    last = med_total if high is None else min(high, med_total)
+                in_band = max(0, last - first + 1)
+
+                offset = _page_offset(in_band, page_size, "meditation_page")
+                med_practices = query_approved_practices(
+                    "meditation",
+                    limit=min(page_size, max(0, in_band - offset)),
+                    offset=first - 1 + offset,
+                )
+                if not med_practices:
+                    st.write("No meditation practices at this level yet.")
 
-                for idx, p in enumerate(med_practices, start=1):
-                    band = _med_band_for_index(idx)
-                    if level_filter != "All levels" and band != level_filter:
-                        continue
+                for idx, p in enumerate(med_practices, start=first + offset):
+                    band = _band_for(idx)
 
                     src = p.get("source") or "manual-guidance"
                     text_full = p.get("text", "") or ""
@@ -68,62 +111,47 @@ def render_admin_practices():
                         audio_path = p.get("audio_path")
                         if audio_path and os.path.exists(audio_path):
                             st.markdown("**Audio preview:**")
-                            st.audio(audio_path)
+                            st.audio(serving_path(audio_path))
 
                         image_path = p.get("image_path")
                         if image_path and os.path.exists(image_path):
                             st.markdown("**Image preview:**")
-                            st.image(image_path, use_column_width=True)
+                            st.image(serving_path(image_path), use_column_width=True)
 
                         video_path = p.get("video_path")
                         if video_path and os.path.exists(video_path):
                             st.markdown("**Video preview:**")
-                            st.video(video_path)
+                            st.video(serving_path(video_path))
 
                         st.markdown("---")
 
+                        pid = p["id"]
                         new_text = st.text_area(
                             "Edit meditation text",
                             value=text_full,
-                            key=f"med_edit_text_{idx}",
+                            key=f"med_edit_text_{pid}",
                             height=180,
                         )
 
                         col_save, col_del = st.columns(2)
                         with col_save:
-                            if st.button("Save changes", key=f"med_save_{idx}"):
-                                updated = load_approved_practices()
-                                med_list = updated.get("meditation", []) or []
-                                if 0 <= idx - 1 < len(med_list):
-                                    med_list[idx - 1]["text"] = new_text.strip()
-                                    updated["meditation"] = med_list
-                                    save_approved_practices(updated)
+                            if st.button("Save changes", key=f"med_save_{pid}"):
+                                if update_approved_practice(pid, {"text": new_text.strip()}):
                                     st.success("Meditation updated.")
-                                    st.rerun()
+                                    rerun_fragment()
                         with col_del:
-                            if st.button("Delete this meditation", key=f"med_delete_{idx}"):
-                                updated = load_approved_practices()
-                                med_list = updated.get("meditation", []) or []
-                                if 0 <= idx - 1 < len(med_list):
-                                    med_list.pop(idx - 1)
-                                    updated["meditation"] = med_list
-                                    save_approved_practices(updated)
+                            if st.button("Delete this meditation", key=f"med_delete_{pid}"):
+                                if delete_approved_practice(pid):
                                     st.warning("Meditation deleted.")
-                                    st.rerun()
+                                    rerun_fragment()
 
         with col_j:
             st.markdown("### 📿 Mantra practices")
 
-            if not mantra_practices:
+            if not mantra_total:
                 st.write("No mantra practices approved yet.")
             else:
-                deity_names = set()
-                for p in mantra_practices:
-                    d = (p.get("deity") or "General").strip()
-                    if not d:
-                        d = "General"
-                    deity_names.add(d)
-                deity_list = sorted(deity_names, key=str.lower)
+                deity_list = list_practice_deities("mantra")
 
                 deity_filter = st.selectbox(
                     "Filter by deity",
@@ -137,15 +165,17 @@ def render_admin_practices():
                     key="mantra_level_filter",
                 )
 
-                def _mantra_band_for_level(lvl: int) -> str:
-                    if lvl <= 3:
-                        return "Beginner"
-                    elif lvl <= 7:
-                        return "Intermediate"
-                    else:
-                        return "Deeper"
+                filters = {
+                    "deity": None if deity_filter == "All deities" else deity_filter,
+                    "level_range": None if level_filter == "All levels" else BANDS[level_filter],
+                }
+                filtered_total = count_approved_practices("mantra", **filters)
+                offset = _page_offset(filtered_total, page_size, "mantra_page")
+                mantra_practices = query_approved_practices("mantra", limit=page_size, offset=offset, **filters)
+                if not mantra_practices:
+                    st.write("No mantras match these filters.")
 
-                for idx, p in enumerate(mantra_practices, start=1):
+                for p in mantra_practices:
                     deity = (p.get("deity") or "General").strip()
                     if not deity:
                         deity = "General"
@@ -154,12 +184,7 @@ def render_admin_practices():
                         lvl_val = int(p.get("level", 1))
                     except Exception:
                         lvl_val = 1
-                    band = _mantra_band_for_level(lvl_val)
-
-                    if deity_filter != "All deities" and deity != deity_filter:
-                        continue
-                    if level_filter != "All levels" and band != level_filter:
-                        continue
+                    band = _band_for(lvl_val)
 
                     age_meta = p.get("age_group") or "both"
                     if age_meta == "child":
@@ -191,24 +216,25 @@ def render_admin_practices():
                         audio_path = p.get("audio_path")
                         if audio_path and os.path.exists(audio_path):
                             st.markdown("**Audio preview:**")
-                            st.audio(audio_path)
+                            st.audio(serving_path(audio_path))
 
                         image_path = p.get("image_path")
                         if image_path and os.path.exists(image_path):
                             st.markdown("**Image preview:**")
-                            st.image(image_path, use_column_width=True)
+                            st.image(serving_path(image_path), use_column_width=True)
 
                         video_path = p.get("video_path")
                         if video_path and os.path.exists(video_path):
                             st.markdown("**Video preview:**")
-                            st.video(video_path)
+                            st.video(serving_path(video_path))
 
                         st.markdown("---")
 
+                        pid = p["id"]
                         edit_deity = st.text_input(
                             "Deity / God name",
                             value=deity,
-                            key=f"mantra_deity_{idx}",
+                            key=f"mantra_deity_{pid}",
                         )
 
                         edit_level = st.number_input(
@@ -217,7 +243,7 @@ def render_admin_practices():
                             max_value=20,
                             value=lvl_val,
                             step=1,
-                            key="mantra_level_{idx}",
+                            key=f"mantra_level_{pid}",
                         )
 
                         if age_meta == "child":
@@ -230,7 +256,7 @@ def render_admin_practices():
                             "Who is this mantra suitable for?",
                             ["All ages", "Children", "Adults"],
                             index=age_index,
-                            key=f"mantra_age_{idx}",
+                            key=f"mantra_age_{pid}",
                         )
                         if edit_age_choice == "Children":
                             edit_age_code = "child"
@@ -242,44 +268,38 @@ def render_admin_practices():
                         edit_mantra_text = st.text_area(
                             "Mantra text (exactly as shown to users)",
                             value=p.get("mantra_text") or "",
-                            key=f"mantra_text_edit_{idx}",
+                            key=f"mantra_text_edit_{pid}",
                             height=120,
                         )
                         edit_desc = st.text_area(
                             "Description / meaning / guidance",
                             value=p.get("text") or "",
-                            key=f"mantra_desc_edit_{idx}",
+                            key=f"mantra_desc_edit_{pid}",
                             height=160,
                         )
 
                         col_save, col_del = st.columns(2)
                         with col_save:
-                            if st.button("Save changes", key=f"mantra_save_{idx}"):
-                                updated = load_approved_practices()
-                                man_list = updated.get("mantra", []) or []
-                                if 0 <= idx - 1 < len(man_list):
-                                    entry = man_list[idx - 1]
-                                    entry["deity"] = edit_deity.strip()
-                                    entry["level"] = int(edit_level)
-                                    entry["age_group"] = edit_age_code
-                                    entry["mantra_text"] = edit_mantra_text.rstrip()
-                                    entry["text"] = edit_desc.strip()
-                                    man_list[idx - 1] = entry
-                                    updated["mantra"] = man_list
-                                    save_approved_practices(updated)
+                            if st.button("Save changes", key=f"mantra_save_{pid}"):
+                                fields = {
+                                    "deity": edit_deity.strip(),
+                                    "level": int(edit_level),
+                                    "age_group": edit_age_code,
+                                    "mantra_text": edit_mantra_text.rstrip(),
+                                    "text": edit_desc.strip(),
+                                }
+                                if update_approved_practice(pid, fields):
                                     st.success("Mantra updated.")
-                                    st.rerun()
+                                    rerun_fragment()
                         with col_del:
-                            if st.button("Delete this mantra", key=f"mantra_delete_{idx}"):
-                                updated = load_approved_practices()
-                                man_list = updated.get("mantra", []) or []
-                                if 0 <= idx - 1 < len(man_list):
-                                    man_list.pop(idx - 1)
-                                    updated["mantra"] = man_list
-                                    save_approved_practices(updated)
+                            if st.button("Delete this mantra", key=f"mantra_delete_{pid}"):
+                                if delete_approved_practice(pid):
                                     st.warning("Mantra deleted.")
-                                    st.rerun()
+                                    rerun_fragment()
+
 
+@st.fragment
+def _render_candidate_review():
     st.subheader("Practice approval (mantra / meditation)")
     st.write(
         "From the uploaded dharmic texts, the app can suggest passages that feel "
@@ -301,7 +321,7 @@ def render_admin_practices():
     else:
         kind_filter = None
 
-    available_books = list_book_names()
+    available_books = cached_book_names()
     selected_books = st.multiselect(
         "Limit scan to specific books (optional):",
         options=available_books,
@@ -316,6 +336,16 @@ def render_admin_practices():
         help="Example: 'mudra, pranayama, japa, dharana'",
     )
 
+    scan_depth = st.number_input(
+        "Passages to check per keyword",
+        min_value=5,
+        max_value=200,
+        value=SCAN_N_RESULTS,
+        step=5,
+        key="practice_scan_depth",
+        help="Higher values look further into the library in the same single search.",
+    )
+
     extra_keywords = []
     if extra_keywords_str.strip():
         extra_keywords = [w.strip() for w in extra_keywords_str.split(",") if w.strip()]
@@ -326,88 +356,70 @@ def render_admin_practices():
                 kind_filter=kind_filter,
                 book_filter=selected_books if selected_books else None,
                 extra_keywords=extra_keywords,
+                n_results=int(scan_depth),
             )
         st.success(f"Scan complete. Total candidates stored: {len(candidates)}")
-    else:
-        candidates = load_practice_candidates()
-
-    if selected_books:
-        selected_set = set(selected_books)
-        filtered_candidates = []
-        for c in candidates:
-            src = c.get("source") or ""
-            fname = os.path.basename(src) if src else ""
-            if fname in selected_set:
-                filtered_candidates.append(c)
-        candidates = filtered_candidates
-
-    approved = load_approved_practices()
-
-    if not candidates:
-        st.info(
-            "No possible practice passages have been collected yet. "
-            "Use 'Scan books' to let the app suggest places where the texts "
-            "speak about meditation or mantra remembrance."
-        )
-    else:
-        st.markdown("### Pending candidates")
-        any_pending = False
-        approve_states = []
 
-        for idx, cand in enumerate(candidates):
-            if cand.get("approved"):
-                continue
+    col_search, col_size = st.columns([3, 1])
+    with col_search:
+        search = st.text_input("Search candidate text", key="practice_candidate_search")
+    with col_size:
+        cand_page_size = st.selectbox("Per page", PAGE_SIZES, index=1, key="practice_candidate_page_size")
+
+    filters = {
+        "kind": kind_filter,
+        "source_names": selected_books or None,
+        "search": search,
+    }
+    _, pending_total = query_practice_candidates(limit=0, **filters)
+
+    if not pending_total:
+        _, approved_total = query_practice_candidates(approved=True, limit=0, **filters)
+        if approved_total:
+            st.info("No unapproved candidates at the moment.")
+        else:
+            st.info(
+                "No possible practice passages have been collected yet. "
+                "Use 'Scan books' to let the app suggest places where the texts "
+                "speak about meditation or mantra remembrance."
+            )
+        return
 
-            kind = cand.get("kind", "unknown")
-            if kind_filter == "mantra" and kind != "mantra":
-                continue
-            if kind_filter == "meditation" and kind != "meditation":
-                continue
+    st.markdown(f"### Pending candidates ({pending_total})")
+    st.caption("Near-identical passages are grouped; one representative is shown per group.")
+    offset = _page_offset(pending_total, cand_page_size, "practice_candidate_page")
+    candidates, _ = query_practice_candidates(limit=cand_page_size, offset=offset, **filters)
 
-            any_pending = True
+    # A form so ticking boxes does not rerun the page; approvals are saved
+    # together in one transaction on submit.
+    with st.form("practice_candidate_review"):
+        approve_states = []
+        for cand in candidates:
+            kind = cand.get("kind", "unknown")
             src = cand.get("source") or "unknown"
             text = cand.get("text") or ""
 
             label_kind = "MEDITATION" if kind == "meditation" else "MANTRA" if kind == "mantra" else kind.upper()
-            with st.expander(f"[{label_kind}] from {os.path.basename(src)}", expanded=False):
+            label = f"[{label_kind}] from {os.path.basename(src)}"
+            similar = (cand.get("cluster_size") or 1) - 1
+            if similar > 0:
+                label += f" (+{similar} similar)"
+            with st.expander(label, expanded=False):
                 st.markdown(f"<div class='source-text'>{text}</div>", unsafe_allow_html=True)
                 ck = st.checkbox(
                     "Approve this practice",
-                    key=f"approve_cand_{idx}",
+                    key=f"approve_cand_{cand['id']}",
                 )
-                approve_states.append((idx, ck))
-
-        if not any_pending:
-            st.info("No unapproved candidates at the moment.")
-
-        if approve_states and st.button("💾 Save approvals", key="save_practice_approvals"):
-            candidates = load_practice_candidates()
-            approved = load_approved_practices()
-
-            for idx, is_checked in approve_states:
-                if not is_checked:
-                    continue
-                if idx < 0 or idx >= len(candidates):
-                    continue
-                cand = candidates[idx]
-                if cand.get("approved"):
-                    continue
-
-                kind = cand.get("kind", "unknown")
-                if kind not in ("mantra", "meditation"):
-                    continue
-
-                cand["approved"] = True
-                practices_list = approved.get(kind) or []
-                practices_list.append(
-                    {
-                        "text": cand.get("text", ""),
-                        "source": cand.get("source", ""),
-                    }
-                )
-                approved[kind] = practices_list
-
-            save_practice_candidates(candidates)
-            save_approved_practices(approved)
-            st.success("Selected practices have been approved and saved.")
+                approve_states.append((cand["id"], ck))
+
+        submitted = st.form_submit_button("💾 Save approvals")
+
+    if submitted:
+        chosen = [cand_id for cand_id, is_checked in approve_states if is_checked]
+        if not chosen:
+            st.info("Tick at least one candidate to approve.")
+        else:
+            approved = approve_practice_candidates(chosen)
+            st.success(f"{approved} practice(s) approved and saved.")
+            # Full rerun: the approved overview above changes too.
             st.rerun()
@@ -1,10 +1,10 @@
 import json
-import os
 import time
 import streamlit as st
 
 from admin_tools import fetch_online_practices
-from rag import client as openai_client
+from media_ingest import ingest_upload, safe_file_name
+from rag import get_client
 
 
 def _generate_deity_image(deity_name: str):
@@ -26,7 +26,7 @@ Rules:
 """
 
     try:
-        res = openai_client.images.generate(
+        res = get_client().images.generate(
             model="dall-e-3",
             prompt=prompt,
             size="1792x1024",
@@ -43,15 +43,11 @@ def _save_uploaded_media(uploaded_file, media_dir: str):
     if uploaded_file is None:
         return None
 
-    os.makedirs(media_dir, exist_ok=True)
-    base = uploaded_file.name.replace(" ", "_")
+    base = safe_file_name(uploaded_file.name)
     ts = int(time.time())
     filename = f"reflection_{ts}_{base}"
-    dest_path = os.path.join(media_dir, filename)
     try:
-        with open(dest_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-        return dest_path
+        return ingest_upload(uploaded_file, media_dir, filename, "image")["path"]
     except Exception as e:
         st.error(f"Could not save uploaded file: {e}")
         return None
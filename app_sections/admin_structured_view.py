@@ -5,11 +5,12 @@ from database import (
     add_mantra,
     update_structured_mantra,
     delete_structured_mantra,
-    reorder_mantras_for_level,
     get_next_section_and_sort,
     get_deity_list_for_structured_mantras,
     get_mantras_for_level,
 )
+from media_derivatives import serving_path
+from media_ingest import ingest_upload, safe_file_name
 
 
 def render_admin_structured_view():
@@ -90,33 +91,34 @@ def render_admin_structured_view():
                 if uploaded_audio is not None:
                     original_name = uploaded_audio.name
                     ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-                    safe_name = original_name.replace(" ", "_")
-                    audio_path = os.path.join(GUIDANCE_AUDIO_DIR, f"struct_audio_{ts}_{safe_name}")
-                    with open(audio_path, "wb") as f:
-                        f.write(uploaded_audio.getbuffer())
+                    safe_name = safe_file_name(original_name)
+                    audio_path = ingest_upload(
+                        uploaded_audio, GUIDANCE_AUDIO_DIR, f"struct_audio_{ts}_{safe_name}", "audio"
+                    )["path"]
                     extra_paths["audio_path"] = audio_path
                     extra_paths["audio_original_name"] = original_name
 
                 if uploaded_image is not None:
                     original_name = uploaded_image.name
                     ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-                    safe_name = original_name.replace(" ", "_")
-                    image_path = os.path.join(GUIDANCE_MEDIA_DIR, f"struct_img_{ts}_{safe_name}")
-                    with open(image_path, "wb") as f:
-                        f.write(uploaded_image.getbuffer())
+                    safe_name = safe_file_name(original_name)
+                    image_path = ingest_upload(
+                        uploaded_image, GUIDANCE_MEDIA_DIR, f"struct_img_{ts}_{safe_name}", "image"
+                    )["path"]
                     extra_paths["image_path"] = image_path
                     extra_paths["image_original_name"] = original_name
 
                 if uploaded_video is not None:
                     original_name = uploaded_video.name
                     ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-                    safe_name = original_name.replace(" ", "_")
-                    video_path = os.path.join(GUIDANCE_MEDIA_DIR, f"struct_vid_{ts}_{safe_name}")
-                    with open(video_path, "wb") as f:
-                        f.write(uploaded_video.getbuffer())
+                    safe_name = safe_file_name(original_name)
+                    video_path = ingest_upload(
+                        uploaded_video, GUIDANCE_MEDIA_DIR, f"struct_vid_{ts}_{safe_name}", "video"
+                    )["path"]
                     extra_paths["video_path"] = video_path
                     extra_paths["video_original_name"] = original_name
-            except Exception:
+            except Exception as e:
+                st.warning(f"Media files were not saved: {e}")
                 extra_paths = {}
 
             added = add_mantra(
@@ -212,17 +214,17 @@ def render_admin_structured_view():
                     st.markdown("**Attached media:**")
                     for ap in media["audio"]:
                         if ap and os.path.exists(ap):
-                            st.audio(ap)
+                            st.audio(serving_path(ap))
                         else:
                             st.caption(f"Audio: {ap}")
                     for ip in media["image"]:
                         if ip and os.path.exists(ip):
-                            st.image(ip, use_column_width=True)
+                            st.image(serving_path(ip), use_column_width=True)
                         else:
                             st.caption(f"Image: {ip}")
                     for vp in media["video"]:
                         if vp and os.path.exists(vp):
-                            st.video(vp)
+                            st.video(serving_path(vp))
                         else:
                             st.caption(f"Video: {vp}")
 
@@ -243,10 +245,7 @@ def render_admin_structured_view():
                     st.rerun()
 
                 if st.button("🗑️ Delete this section", key=f"delete_m_{m['id']}"):
+                    # Also renumbers the remaining sections of this level
                     delete_structured_mantra(m["id"])
-                    # Renumber remaining sections in this level
-                    remaining = get_mantras_for_level(view_deity, view_level)
-                    ordered_ids = [x["id"] for x in remaining]
-                    reorder_mantras_for_level(view_deity, view_level, ordered_ids)
                     st.warning("Section deleted.")
                     st.rerun()
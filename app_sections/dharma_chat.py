@@ -1,26 +1,83 @@
-import datetime
 import os
+import uuid
 import streamlit as st
 
 from helpers import get_current_username
 from rag import retrieve_passages, answer_question, generate_styled_image
-from database import load_favourites, save_favourites
-
-
-def render_dharma_chat(book_list):
-    """Full chat experience moved off Home."""
-
-    def run_question_flow(question_text: str):
-        if not question_text:
-            return
-        st.session_state["messages"].append({"role": "user", "content": question_text})
-        passages, metas = retrieve_passages(question_text)
+from database import add_favourite, count_chat_turns, load_chat_turns, save_chat_turn
+from index_metadata import DEITY_NAMES
+from story_engine import summarize_history
+
+# Messages kept in st.session_state["messages"]; older turns stay in the
+# chat_turns table and are loaded CHAT_PAGE_SIZE at a time on request.
+CHAT_WINDOW = 6
+CHAT_PAGE_SIZE = 10
+# Older turns condensed into the answer prompt's history summary.
+SUMMARY_TURNS = 20
+
+
+def _search_filters():
+    """Book / deity filters chosen in the chat's search options."""
+    deity = st.session_state.get("chat_deity_filter") or "Any deity"
+    return {
+        "books": st.session_state.get("chat_book_filter") or None,
+        "deity": None if deity == "Any deity" else deity.lower(),
+        "neighbours": 1 if st.session_state.get("chat_expand_context", True) else 0,
+    }
+
+
+def _conversation_id() -> str:
+    if not st.session_state.get("conversation_id"):
+        st.session_state["conversation_id"] = uuid.uuid4().hex
+    return st.session_state["conversation_id"]
+
+
+def _remember(message: dict):
+    """Store a message and keep only the latest CHAT_WINDOW in the session."""
+    message["id"] = save_chat_turn(_conversation_id(), message, user_id=get_current_username())
+    messages = st.session_state["messages"]
+    messages.append(message)
+    del messages[:-CHAT_WINDOW]
+
+
+def _oldest_shown_id():
+    shown = st.session_state.get("chat_earlier") or st.session_state["messages"]
+    return shown[0].get("id") if shown else None
+
+
+def _load_earlier():
+    before = _oldest_shown_id()
+    if before is None:
+        return
+    older = load_chat_turns(_conversation_id(), before_id=before, limit=CHAT_PAGE_SIZE)
+    st.session_state["chat_earlier"] = older + (st.session_state.get("chat_earlier") or [])
+
+
+def _history_summary() -> str:
+    """Summary of the turns that have left the session window."""
+    messages = st.session_state["messages"]
+    oldest = messages[0].get("id") if messages else None
+    if oldest is None:
+        return ""
+    return summarize_history(load_chat_turns(_conversation_id(), before_id=oldest, limit=SUMMARY_TURNS))
+
+
+def _ask(question_text: str, book_list):
+    """Retrieve passages, answer, and add both turns to the conversation."""
+    if not question_text:
+        return
+    # A new question collapses any earlier turns opened with "show earlier".
+    st.session_state["chat_earlier"] = []
+    _remember({"role": "user", "content": question_text})
+    with st.spinner("Finding passages and writing your story..."):
+        passages, metas = retrieve_passages(question_text, **_search_filters())
         answer = answer_question(
             question_text,
             passages,
             book_list,
             history_messages=st.session_state["messages"],
             answer_length=st.session_state.get("answer_length", "Medium"),
+            history_summary=_history_summary(),
         )
         books_used = set()
         for m in metas:
@@ -34,25 +91,61 @@ def render_dharma_chat(book_list):
             # Use "cartoon" as a nudge toward illustrative output, but the helper defines exact styles
             image_url, style_used = generate_styled_image(question_text, answer)
 
-        st.session_state["messages"].append(
-            {
-                "role": "assistant",
-                "content": answer,
-                "image_url": image_url,
-                "style": style_used,
-                "passages": passages,
-                "metas": metas,
-                "books_used": list(books_used),
-            }
-        )
-        st.rerun()
+    _remember(
+        {
+            "role": "assistant",
+            "content": answer,
+            "image_url": image_url,
+            "style": style_used,
+            "passages": passages,
+            "metas": metas,
+            "books_used": list(books_used),
+        }
+    )
+
 
+def render_dharma_chat(book_list):
+    """Full chat experience moved off Home."""
     st.header("🗣️ Dharma chat")
+
+    # The chat input is pinned to the bottom of the page wherever it is
+    # called; handling it before the conversation is drawn shows the new
+    # answer in this run instead of after a second rerun.
+    user_input = st.chat_input("Ask for a story (e.g. 'Tell me a story about Shiva's compassion')...")
+    if user_input:
+        _ask(user_input, book_list)
+
+    _render_chat_panel(book_list)
+
+
+@st.fragment
+def _render_chat_panel(book_list):
+    """
+    Options, mood buttons and the conversation. A fragment: its buttons and
+    options rerun only this panel, not the whole app.
+    """
     st.checkbox(
         "Generate image (realistic animation style)",
         key="generate_image",
         help="Adds a playful, illustrative image that matches the answer.",
     )
+    with st.expander("🔎 Search options", expanded=False):
+        st.multiselect(
+            "Only search these books",
+            options=book_list or [],
+            key="chat_book_filter",
+        )
+        st.selectbox(
+            "Only passages about",
+            ["Any deity"] + [d.title() for d in DEITY_NAMES],
+            key="chat_deity_filter",
+        )
+        st.checkbox(
+            "Include the text around each passage",
+            value=True,
+            key="chat_expand_context",
+            help="Adds the neighbouring parts of the book so stories are not cut off mid-way.",
+        )
     st.write(
         "Ask for stories, guidance, or use quick mood buttons. All conversations and saves stay the same; "
         "they're just moved here from Home."
@@ -63,125 +156,88 @@ def render_dharma_chat(book_list):
         mcol1, mcol2, mcol3, mcol4 = st.columns(4)
         with mcol1:
             if st.button("😟 I feel anxious", key="mood_anxious"):
-                run_question_flow(
-                    "I feel anxious. Please tell me a gentle dharmic story or guidance to calm my mind from the uploaded books."
+                _ask(
+                    "I feel anxious. Please tell me a gentle dharmic story or guidance to calm my mind from the uploaded books.",
+                    book_list,
                 )
         with mcol2:
             if st.button("😞 Low energy", key="mood_low_energy"):
-                run_question_flow(
-                    "My energy is low. From these books, give me a short story or guidance that brings strength and hope."
+                _ask(
+                    "My energy is low. From these books, give me a short story or guidance that brings strength and hope.",
+                    book_list,
                 )
         with mcol3:
             if st.button("💪 Need courage", key="mood_courage"):
-                run_question_flow(
-                    "I need courage for a challenge. Tell me a story or teaching about courage from these dharmic books."
+                _ask(
+                    "I need courage for a challenge. Tell me a story or teaching about courage from these dharmic books.",
+                    book_list,
                 )
         with mcol4:
             if st.button("❤️ More devotion", key="mood_bhakti"):
-                run_question_flow(
-                    "I want to feel more devotion and love for the Divine. Share a story or guidance about bhakti from these books."
+                _ask(
+                    "I want to feel more devotion and love for the Divine. Share a story or guidance about bhakti from these books.",
+                    book_list,
                 )
 
         st.markdown("---")
 
-    for idx, msg in enumerate(st.session_state["messages"]):
-        role = msg["role"]
-        content = msg["content"]
-
-        if role == "user":
-            with st.chat_message("user"):
-                st.markdown(content)
-        else:
-            with st.chat_message("assistant"):
-                st.markdown(
-                    f"<div class='answer-text'>{content}</div>",
-                    unsafe_allow_html=True,
-                )
-
-                books_used = msg.get("books_used", [])
-                if books_used:
-                    ref_text = ", ".join(sorted(books_used))
-                    st.markdown(f"**References (books used):** _{ref_text}_")
-
-                if msg.get("image_url"):
-                    st.image(
-                        msg["image_url"],
-                        caption=f"Illustration (style: {msg.get('style', '').upper()})",
-                        use_column_width=True,
-                    )
-
-                if msg.get("passages") and msg.get("metas"):
-                    st.markdown("**Passages used from your books:**")
-                    for i, (p, m) in enumerate(zip(msg["passages"], msg["metas"])):
-                        src = m.get("source", "unknown")
-                        fname = os.path.basename(src) if src else "unknown"
-                        with st.expander(f"Passage {i+1} — Source file: {fname}"):
-                            st.markdown(
-                                f"<div class='source-text'>{p}</div>",
-                                unsafe_allow_html=True,
-                            )
-
-                if st.session_state.get("role") == "user":
-                    username = get_current_username()
-                    if username:
-                        fav_button_key = f"save_story_{idx}"
-                        if st.button("⭐ Save this story", key=fav_button_key):
-                            favs_all = load_favourites()
-                            user_favs = favs_all.get(username, [])
-                            if not any(
-                                f.get("content") == msg["content"]
-                                and f.get("books_used") == msg.get("books_used", [])
-                                for f in user_favs
-                            ):
-                                user_favs.append(
-                                    {
-                                        "content": msg["content"],
-                                        "books_used": msg.get("books_used", []),
-                                        "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M"),
-                                    }
-                                )
-                                favs_all[username] = user_favs
-                                save_favourites(favs_all)
-                                st.success("Story saved to your favourites.")
-
-    user_input = st.chat_input("Ask for a story (e.g. 'Tell me a story about Shiva's compassion')...")
-
-    if user_input:
-        st.session_state["messages"].append(
-            {"role": "user", "content": user_input}
-        )
-
-        passages, metas = retrieve_passages(user_input)
-
-        answer = answer_question(
-            user_input,
-            passages,
-            book_list,
-            history_messages=st.session_state["messages"],
-            answer_length=st.session_state.get("answer_length", "Medium"),
+    oldest = _oldest_shown_id()
+    earlier_count = count_chat_turns(_conversation_id(), before_id=oldest) if oldest is not None else 0
+    if earlier_count:
+        st.button(
+            f"⬆️ Show earlier messages ({earlier_count})",
+            key="chat_show_earlier",
+            on_click=_load_earlier,
         )
 
-        books_used = set()
-        for m in metas:
-            src = m.get("source")
-            if src:
-                books_used.add(os.path.basename(src))
-
-        image_url = None
-        style_used = None
-        if st.session_state["generate_image"]:
-            image_url, style_used = generate_styled_image(user_input, answer)
-
-        st.session_state["messages"].append(
-            {
-                "role": "assistant",
-                "content": answer,
-                "image_url": image_url,
-                "style": style_used,
-                "passages": passages,
-                "metas": metas,
-                "books_used": list(books_used),
-            }
-        )
+    shown = (st.session_state.get("chat_earlier") or []) + st.session_state["messages"]
+    for idx, msg in enumerate(shown):
+        _render_message(msg, key_suffix=f"new_{idx}")
+
+
+def _render_message(msg: dict, key_suffix: str):
+    """One chat message; `key_suffix` keys its save button when it has no stored id."""
+    role = msg["role"]
+    content = msg["content"]
+
+    if role == "user":
+        with st.chat_message("user"):
+            st.markdown(content)
+    else:
+        with st.chat_message("assistant"):
+            st.markdown(
+                f"<div class='answer-text'>{content}</div>",
+                unsafe_allow_html=True,
+            )
+
+            books_used = msg.get("books_used", [])
+            if books_used:
+                ref_text = ", ".join(sorted(books_used))
+                st.markdown(f"**References (books used):** _{ref_text}_")
+
+            if msg.get("image_url"):
+                st.image(
+                    msg["image_url"],
+                    caption=f"Illustration (style: {msg.get('style', '').upper()})",
+                    use_column_width=True,
+                )
 
-        st.rerun()
+            if msg.get("passages") and msg.get("metas"):
+                st.markdown("**Passages used from your books:**")
+                for i, (p, m) in enumerate(zip(msg["passages"], msg["metas"])):
+                    src = m.get("source", "unknown")
+                    fname = os.path.basename(src) if src else "unknown"
+                    where = f", page {m['page']}" if m.get("page") else ""
+                    with st.expander(f"Passage {i+1} — Source file: {fname}{where}"):
+                        st.markdown(
+                            f"<div class='source-text'>{p}</div>",
+                            unsafe_allow_html=True,
+                        )
+
+            if st.session_state.get("role") == "user":
+                username = get_current_username()
+                if username:
+                    fav_button_key = f"save_story_{msg.get('id') or key_suffix}"
+                    if st.button("⭐ Save this story", key=fav_button_key):
+                        if add_favourite(username, msg["content"], msg.get("books_used", [])):
+                            st.success("Story saved to your favourites.")
@@ -2,6 +2,7 @@ import os
 import streamlit as st
 
 from helpers import get_daily_reflection
+from media_derivatives import serving_path
 
 
 def render_home(daily_reflection_file: str):
@@ -20,7 +21,7 @@ def render_home(daily_reflection_file: str):
             if image_url.startswith("http://") or image_url.startswith("https://"):
                 st.image(image_url, use_column_width=True, caption=None)
             else:
-                img_path = image_url
+                img_path = serving_path(image_url)
                 if not os.path.isabs(img_path):
                     img_path = os.path.abspath(img_path)
                 if os.path.exists(img_path):
@@ -2,15 +2,19 @@ import os
 import streamlit as st
 import datetime
 from database import (
-    load_approved_practices,
+    count_approved_practices,
+    list_practice_deities,
+    list_practice_levels,
+    query_approved_practices,
     get_deity_list_for_structured_mantras,
     get_next_uncompleted_mantra,
     mark_mantra_completed,
     get_level_progress_summary,
 )
 from auth import save_users, load_users
-from helpers import get_current_username
+from helpers import get_current_username, rerun_fragment
 from ui import render_mantra_html, render_answer_html
+from media_derivatives import serving_path
 
 
 def render_mantra_journey():
@@ -23,14 +27,17 @@ def render_mantra_journey():
         st.info("Mantra levels are available for logged-in users only.")
         return
 
-    approved = load_approved_practices()
-    mantra_practices = approved.get("mantra", []) or []
+    # Each section is a fragment: marking a section done or saving a
+    # mantra reruns only that section, not the whole app.
+    _render_structured_journey()
+    _render_mantra_library()
 
-    profile = st.session_state.get("user_profile") or {}
-    age_group = st.session_state.get("age_group")
+
+@st.fragment
+def _render_structured_journey():
+    """Structured mantra unlock flow (Levels 1-5, sections)."""
     username = get_current_username()
 
-    # Structured mantra unlock flow (Levels 1-5, sections)
     st.markdown("### 🔓 Structured deity levels (1–5)")
     structured_deities = get_deity_list_for_structured_mantras()
     if not structured_deities:
@@ -69,74 +76,47 @@ def render_mantra_journey():
                 saved = mark_mantra_completed(username, next_mantra["id"], reflection or "")
                 if saved:
                     st.success("Saved reflection and unlocked the next section.")
-                    st.rerun()
+                    rerun_fragment()
                 else:
                     st.info("Already completed. Move on to the next available section.")
         st.markdown("---")
 
-    if not mantra_practices:
+
+@st.fragment
+def _render_mantra_library():
+    """Approved mantras by deity and level, with saving to My Journey."""
+    age_group = st.session_state.get("age_group")
+
+    if not count_approved_practices("mantra"):
         st.info(
             "No approved mantra practices are available yet. "
             "Ask the admin to approve some mantra-related passages from the books or Guidance panel."
         )
         return
 
-    def _age_allowed(p):
-        target = (p.get("age_group") or "both").lower()
-        if target not in ("child", "adult", "both"):
-            target = "both"
-        if age_group is None:
-            return True
-        if target == "both":
-            return True
-        return target == age_group
-
-    filtered_all = [p for p in mantra_practices if _age_allowed(p)]
+    # Age filtering happens in SQL: "both" entries are visible to everyone,
+    # and seekers without an age group see every entry.
+    deity_list = list_practice_deities("mantra", age_group=age_group)
 
-    if not filtered_all:
+    if not deity_list:
         st.info(
             "There are mantra practices, but none are currently marked "
             f"for your age group ({age_group or 'unspecified'})."
         )
         return
 
-    deity_names = set()
-    for p in filtered_all:
-        d = (p.get("deity") or "General").strip()
-        if not d:
-            d = "General"
-        deity_names.add(d)
-
-    deity_list = sorted(deity_names, key=str.lower)
-
     selected_deity = st.selectbox(
         "Choose a deity to chant for:",
         deity_list,
         key="mantra_deity_select_user",
     )
 
-    deity_filtered = []
-    for p in filtered_all:
-        d = (p.get("deity") or "General").strip()
-        if not d:
-            d = "General"
-        if d == selected_deity:
-            deity_filtered.append(p)
+    level_values = list_practice_levels("mantra", deity=selected_deity, age_group=age_group)
 
-    if not deity_filtered:
+    if not level_values:
         st.info(f"No mantras found yet for {selected_deity}.")
         return
 
-    level_values = set()
-    for p in deity_filtered:
-        try:
-            lvl = int(p.get("level", 1))
-        except Exception:
-            lvl = 1
-        level_values.add(lvl)
-
-    level_values = sorted(level_values)
-
     def _band_for_level(lvl: int) -> str:
         if lvl <= 3:
             return "Beginner"
@@ -162,14 +142,12 @@ def render_mantra_journey():
 
     selected_level = label_to_level[selected_level_label]
 
-    level_filtered = []
-    for p in deity_filtered:
-        try:
-            lvl_val = int(p.get("level", 1))
-        except Exception:
-            lvl_val = 1
-        if lvl_val == selected_level:
-            level_filtered.append(p)
+    level_filtered = query_approved_practices(
+        "mantra",
+        deity=selected_deity,
+        level=selected_level,
+        age_group=age_group,
+    )
 
     if not level_filtered:
         st.info(
@@ -218,17 +196,17 @@ def render_mantra_journey():
         audio_path = p.get("audio_path")
         if audio_path and os.path.exists(audio_path):
             st.markdown("**Audio:**")
-            st.audio(audio_path)
+            st.audio(serving_path(audio_path))
 
         image_path = p.get("image_path")
         if image_path and os.path.exists(image_path):
             st.markdown("**Image:**")
-            st.image(image_path, use_column_width=True)
+            st.image(serving_path(image_path), use_column_width=True)
 
         video_path = p.get("video_path")
         if video_path and os.path.exists(video_path):
             st.markdown("**Video:**")
-            st.video(video_path)
+            st.video(serving_path(video_path))
 
         username = get_current_username()
         if username:
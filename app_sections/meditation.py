@@ -1,8 +1,9 @@
 import os
 import streamlit as st
 
-from database import load_approved_practices
+from database import count_approved_practices, get_approved_practice_at
 from auth import save_users, load_users
+from media_derivatives import serving_path
 
 
 def render_meditation_journey():
@@ -16,26 +17,28 @@ def render_meditation_journey():
         st.info("Meditation levels are available for logged-in users only.")
         return
 
-    approved = load_approved_practices()
-    med_practices = approved.get("meditation", [])
+    med_count = count_approved_practices("meditation")
 
     profile = st.session_state.get("user_profile") or {}
     med_level = profile.get("meditation_level", 1)
 
-    if not med_practices:
+    if not med_count:
         st.info(
             "No approved meditation practices are available yet. "
             "Ask the admin to approve some meditation passages from the books."
         )
         return
 
-    max_level = min(20, len(med_practices))
+    max_level = min(20, med_count)
     if med_level > max_level:
         st.success("You have completed all available meditation levels.")
         st.write(f"Current meditation level: {med_level}")
         return
 
-    practice = med_practices[med_level - 1]
+    practice = get_approved_practice_at("meditation", med_level)
+    if not practice:
+        st.info("This meditation level is not available right now. Please try again later.")
+        return
     src = practice.get("source") or "unknown"
 
     st.subheader(f"Meditation Level {med_level} of {max_level}")
@@ -49,17 +52,17 @@ def render_meditation_journey():
     audio_path = practice.get("audio_path")
     if audio_path and os.path.exists(audio_path):
         st.markdown("**Listen to this guided meditation:**")
-        st.audio(audio_path)
+        st.audio(serving_path(audio_path))
 
     image_path = practice.get("image_path")
     if image_path and os.path.exists(image_path):
         st.markdown("**Sacred image for this meditation:**")
-        st.image(image_path, use_column_width=True)
+        st.image(serving_path(image_path), use_column_width=True)
 
     video_path = practice.get("video_path")
     if video_path and os.path.exists(video_path):
         st.markdown("**Video guidance for this meditation:**")
-        st.video(video_path)
+        st.video(serving_path(video_path))
 
     reflection = st.text_area(
         "What did you feel or notice in this practice?",
@@ -3,6 +3,7 @@ import streamlit as st
 
 from database import load_favourites
 from ui import render_mantra_html, render_answer_html
+from media_derivatives import serving_path
 
 
 def render_my_journey():
@@ -55,17 +56,17 @@ def render_my_journey():
             audio_path = m.get("audio_path")
             if audio_path and os.path.exists(audio_path):
                 st.markdown("**Audio:**")
-                st.audio(audio_path)
+                st.audio(serving_path(audio_path))
 
             image_path = m.get("image_path")
             if image_path and os.path.exists(image_path):
                 st.markdown("**Image:**")
-                st.image(image_path, use_column_width=True)
+                st.image(serving_path(image_path), use_column_width=True)
 
             video_path = m.get("video_path")
             if video_path and os.path.exists(video_path):
                 st.markdown("**Video:**")
-                st.video(video_path)
+                st.video(serving_path(video_path))
 
             st.markdown("---")
     else:
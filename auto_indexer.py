@@ -2,18 +2,33 @@ import os
 import time
 import json
 import glob
-import pypdf
 import chromadb
 from openai import OpenAI
-from ebooklib import epub, ITEM_DOCUMENT
-from bs4 import BeautifulSoup
-from pdf2image import convert_from_path
-import pytesseract
+
+from database import (
+    book_text_hash,
+    books_to_reindex,
+    mark_book_reindexed,
+    record_book_text_hash,
+    sync_book_registry,
+)
+from index_layout import (
+    CHROMA_PATH,
+    discard_shard,
+    index_lock,
+    load_manifest,
+    publish_shard,
+    shard_for_book,
+    stage_shard,
+)
+from index_gc import reconcile
+from index_metadata import book_where, chunk_metadata
+from prepare_data import extract_segments
+from vector_store import backend_name, rebuild_stores
 
 client = OpenAI()
 
 BOOKS_DIR = "books"
-COLLECTION_NAME = "saint_books"
 INDEX_STATE_FILE = "index_state.json"
 UNREADABLE_FILE = "unreadable_books.json"
 SLEEP_SECONDS = 300  # 5 minutes
@@ -47,86 +62,32 @@ def save_unreadable(data):
     json.dump(data, open(UNREADABLE_FILE, "w"), indent=2)
 
 
-def ocr_pdf(path: str, max_pages: int = 10) -> str:
-    try:
-        pages = convert_from_path(path, dpi=200)
-    except Exception:
-        return ""
-    texts = []
-    for i, page in enumerate(pages):
-        if i >= max_pages:
-            break
-        try:
-            t = pytesseract.image_to_string(page)
-            if t.strip():
-                texts.append(t)
-        except Exception:
-            continue
-    return "\n".join(texts)
-
-
-def extract_text_from_pdf(path: str) -> str:
-    try:
-        reader = pypdf.PdfReader(path)
-    except Exception:
-        return ""
-    text = ""
-    for page in reader.pages:
-        try:
-            t = page.extract_text()
-            if t:
-                text += t + "\n"
-        except Exception:
-            continue
-    if not text.strip():
-        text = ocr_pdf(path)
-    return text
-
-
-def extract_text_from_epub(path: str) -> str:
-    try:
-        book = epub.read_epub(path)
-    except Exception:
-        return ""
-    texts = []
-    for item in book.get_items_of_type(ITEM_DOCUMENT):
-        try:
-            html = item.get_content()
-            soup = BeautifulSoup(html, "lxml")
-            for s in soup(["script", "style"]):
-                s.extract()
-            t = soup.get_text(separator="\n").strip()
-            if t:
-                texts.append(t)
-        except Exception:
-            continue
-    return "\n\n".join(texts)
-
-
-def extract_text(path: str) -> str:
-    ext = os.path.splitext(path)[1].lower()
-    if ext == ".pdf":
-        return extract_text_from_pdf(path)
-    elif ext == ".epub":
-        return extract_text_from_epub(path)
-    return ""
-
-
-def chunk_text(text: str, max_chars: int = 800):
-    paragraphs = text.split("\n\n")
+def chunk_text_with_offsets(text: str, max_chars: int = 800):
+    """
+    Paragraphs packed into chunks of up to max_chars.
+    Returns (start offset in `text`, chunk) pairs.
+    """
     chunks = []
     current = ""
-    for p in paragraphs:
+    current_start = 0
+    pos = 0
+    for p in text.split("\n\n"):
+        start = pos + len(p) - len(p.lstrip())
+        pos += len(p) + 2
         p = p.strip()
         if not p:
             continue
         if len(current) + len(p) <= max_chars:
+            if not current:
+                current_start = start
             current += p + "\n\n"
         else:
-            chunks.append(current.strip())
+            if current.strip():
+                chunks.append((current_start, current.strip()))
             current = p + "\n\n"
+            current_start = start
     if current.strip():
-        chunks.append(current.strip())
+        chunks.append((current_start, current.strip()))
     return chunks
 
 
@@ -151,9 +112,8 @@ def embed_texts(chunks):
     return embeddings
 
 
-def get_collection():
-    chroma_client = chromadb.PersistentClient(path="./chroma_db")
-    return chroma_client.get_or_create_collection(name=COLLECTION_NAME)
+def get_chroma_client():
+    return chromadb.PersistentClient(path=CHROMA_PATH)
 
 
 # ----- core indexing for a single file -----
@@ -162,13 +122,25 @@ def index_book(path: str, collection, unreadable: dict):
     abs_path = os.path.abspath(path)
     print(f"📘 Indexing: {path}")
 
-    text = extract_text(path)
+    # Page/chapter segments as prepare_data extracts them, so chunks get the
+    # same page and chapter metadata whichever indexer wrote them.
+    segments, joiner = extract_segments(path)
+    text = joiner.join(seg["text"] for seg in segments)
     if not text.strip():
         print("   ❌ No text extracted, marking unreadable.")
         unreadable[abs_path] = "no_text_extracted"
         return
 
-    chunks = chunk_text(text)
+    # A re-encoded or renamed copy of a book that is already indexed would
+    # only add the same passages again; skip it before paying for embeddings.
+    duplicate_of = record_book_text_hash(os.path.basename(path), book_text_hash(text))
+    if duplicate_of:
+        print(f"   ⏭ Same text as {duplicate_of}, not indexing this copy.")
+        collection.delete(where=book_where(path))
+        return
+
+    chunks_with_offsets = chunk_text_with_offsets(text)
+    chunks = [chunk for _, chunk in chunks_with_offsets]
     if not chunks:
         print("   ❌ Cannot chunk text, marking unreadable.")
         unreadable[abs_path] = "chunking_failed"
@@ -177,14 +149,15 @@ def index_book(path: str, collection, unreadable: dict):
     if abs_path in unreadable:
         del unreadable[abs_path]
 
-    print("   🗑 Deleting old chunks...")
-    collection.delete(where={"source": abs_path})
-
+    # Embed first: if that fails the book keeps its old chunks.
     print("   🔣 Creating embeddings...")
     embeddings = embed_texts(chunks)
 
+    print("   🗑 Deleting old chunks...")
+    collection.delete(where=book_where(path))
+
     ids = [f"{os.path.basename(path)}_chunk_{i}" for i in range(len(chunks))]
-    metas = [{"source": abs_path} for _ in chunks]
+    metas = chunk_metadata(path, chunks_with_offsets, segments, joiner)
 
     print("   📦 Storing in Chroma...")
     collection.add(ids=ids, documents=chunks, embeddings=embeddings, metadatas=metas)
@@ -195,13 +168,32 @@ def index_book(path: str, collection, unreadable: dict):
 def scan_and_update():
     state = load_state()
     unreadable = load_unreadable()
-    collection = get_collection()
+    chroma_client = get_chroma_client()
+    manifest = load_manifest()
 
     paths = glob.glob(os.path.join(BOOKS_DIR, "*.pdf")) + glob.glob(
         os.path.join(BOOKS_DIR, "*.epub")
     )
 
+    # Books removed or renamed since the last cycle: clear their chunks.
+    present = {os.path.basename(p) for p in paths}
+    if any(os.path.basename(p) not in present for p in state):
+        # Also clears duplicate_of on copies of removed books and queues them.
+        sync_book_registry()
+        try:
+            reports = reconcile(chroma_client)
+        except RuntimeError as e:
+            # books/ empty or unmounted: leave the index and state alone.
+            print(f"   ⚠ Skipping clean-up: {e}")
+        else:
+            removed = sum(r["deleted_chunks"] for r in reports.values())
+            print(f"🧹 Removed {removed} chunks of books no longer in {BOOKS_DIR}/.")
+            state = {p: m for p, m in state.items() if os.path.basename(p) in present}
+
     changed = []
+    pending = {}
+    # Copies that stood in for a book that has since been removed.
+    queued = set(books_to_reindex())
 
     for path in paths:
         try:
@@ -210,13 +202,38 @@ def scan_and_update():
             continue
         abs_path = os.path.abspath(path)
         last = state.get(abs_path)
-        if last is None or mtime > last:
-            index_book(path, collection, unreadable)
-            state[abs_path] = mtime
-            changed.append(path)
+        if last is None or mtime > last or os.path.basename(path) in queued:
+            pending.setdefault(shard_for_book(path, manifest), []).append((path, mtime))
+
+    # Only the shards of changed books are rebuilt, each in a staged copy
+    # that replaces the live version once its books are done.
+    for shard, books in pending.items():
+        with index_lock():
+            name, staged = stage_shard(chroma_client, shard)
+            done = 0
+            for path, mtime in books:
+                try:
+                    index_book(path, staged, unreadable)
+                except Exception as e:
+                    # Retried next cycle; the live version still has the old chunks.
+                    print(f"   ❌ Failed, keeping the previous chunks: {e}")
+                    continue
+                state[os.path.abspath(path)] = mtime
+                if os.path.basename(path) in queued:
+                    mark_book_reindexed(os.path.basename(path))
+                changed.append(path)
+                done += 1
+            if done:
+                publish_shard(chroma_client, shard, name, books=[path for path, _ in books])
+            else:
+                discard_shard(chroma_client, shard, name)
 
     save_state(state)
     save_unreadable(unreadable)
+
+    # Keep the memory-mapped exports in step with the shards that changed.
+    if changed and backend_name() == "quantized":
+        rebuild_stores(chroma_client, shards=sorted({shard_for_book(p, manifest) for p in changed}))
     return changed, unreadable
 
 
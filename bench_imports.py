@@ -0,0 +1,141 @@
+"""
+Cold-start import profile of the Streamlit app.
+
+Runs app.py (or any module) in a fresh interpreter under `python -X
+importtime`, from a scratch directory so nothing is written into the
+repo. Without a Streamlit server the script runs in bare mode and stops at
+the login gate, which is exactly the code every cold start and guest
+rerun executes.
+
+Reports the median over --repeat runs:
+  - total import time and wall time,
+  - the slowest imports by cumulative time (--top),
+and fails (exit 1) on a regression:
+  - any module in LAZY_MODULES imported at start-up (they belong to the
+    admin panel and the chat, which import them on demand),
+  - total import time above --budget-ms, when given.
+
+Usage:
+    python bench_imports.py
+    python bench_imports.py --repeat 5 --top 30 --budget-ms 900
+    python bench_imports.py --target rag          # profile one module
+    python bench_imports.py --json import_profile.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Must not be imported before a page needs them.
+LAZY_MODULES = [
+    "chromadb",
+    "openai",
+    "rag",
+    "admin_tools",
+    "app_sections.admin_panel",
+    "app_sections.dharma_chat",
+]
+
+
+def parse_importtime(stderr: str) -> list:
+    """[(module, self_us, cumulative_us, depth)] from -X importtime output."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3:
+            continue
+        name = parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(parts[0]), int(parts[1]), depth))
+    return rows
+
+
+def profile_once(target: str, workdir: str):
+    """Run `target` once; returns (rows, wall seconds)."""
+    if target.endswith(".py"):
+        cmd = [sys.executable, "-X", "importtime", os.path.join(REPO_DIR, target)]
+    else:
+        cmd = [sys.executable, "-X", "importtime", "-c", f"import {target}"]
+    env = dict(os.environ, PYTHONPATH=REPO_DIR + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    start = time.perf_counter()
+    result = subprocess.run(cmd, cwd=workdir, env=env, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"{' '.join(cmd)} failed:\n{result.stderr[-2000:]}")
+    return parse_importtime(result.stderr), wall
+
+
+def interpreter_modules(workdir: str) -> set:
+    """Modules the bare interpreter imports anyway (site, encodings, ...)."""
+    cmd = [sys.executable, "-X", "importtime", "-c", "pass"]
+    result = subprocess.run(cmd, cwd=workdir, capture_output=True, text=True)
+    return {name for name, _s, _c, _d in parse_importtime(result.stderr)}
+
+
+def profile(target: str, repeat: int) -> dict:
+    with tempfile.TemporaryDirectory(prefix="bench_imports_") as workdir:
+        startup = interpreter_modules(workdir)
+        runs = [profile_once(target, workdir) for _ in range(repeat)]
+
+    totals, cumulative = [], {}
+    for rows, _wall in runs:
+        top_level = [(name, cum) for name, _s, cum, depth in rows if depth == 0 and name not in startup]
+        totals.append(sum(cum for _, cum in top_level))
+        for name, _s, cum, _d in rows:
+            if name not in startup:
+                cumulative.setdefault(name, []).append(cum)
+    imported = set(cumulative)
+    return {
+        "target": target,
+        "repeat": repeat,
+        "import_ms": statistics.median(totals) / 1e3,
+        "wall_ms": statistics.median(w for _, w in runs) * 1e3,
+        "modules": len(imported),
+        "cumulative_ms": {name: statistics.median(v) / 1e3 for name, v in cumulative.items()},
+        "lazy_modules_imported": [m for m in LAZY_MODULES if m in imported],
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", default="app.py", help="script (*.py) or module to import")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=20, help="slowest imports to list")
+    parser.add_argument("--budget-ms", type=float, default=None, help="fail above this total import time")
+    parser.add_argument("--json", default=None, help="also write the report here")
+    args = parser.parse_args()
+
+    report = profile(args.target, max(1, args.repeat))
+    print(f"⏱ {report['target']}: {report['import_ms']:.0f} ms importing {report['modules']} modules, "
+          f"{report['wall_ms']:.0f} ms wall (median of {report['repeat']})\n")
+    slowest = sorted(report["cumulative_ms"].items(), key=lambda kv: kv[1], reverse=True)[:args.top]
+    for name, ms in slowest:
+        print(f"{ms:9.1f} ms  {name}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    failed = False
+    if args.target == "app.py" and report["lazy_modules_imported"]:
+        print(f"\n❌ Imported at start-up but should load on demand: {', '.join(report['lazy_modules_imported'])}")
+        failed = True
+    if args.budget_ms is not None and report["import_ms"] > args.budget_ms:
+        print(f"\n❌ Import time {report['import_ms']:.0f} ms is over the {args.budget_ms:.0f} ms budget.")
+        failed = True
+    if not failed:
+        print("\n✅ No import regressions.")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,212 @@
+"""
+Benchmark the structured mantra progress queries.
+
+Builds two throwaway SQLite databases with the same synthetic data:
+- "legacy": the original schema (no user_progress indexes) queried with the
+  original two GROUP BY queries per summary,
+- "current": the schema produced by database.init_db() (all migrations)
+  queried through database.get_level_progress_summary() and
+  database.get_next_uncompleted_mantra().
+
+Usage:
+    python bench_mantra_progress.py                 # 100k users x 500 mantras
+    python bench_mantra_progress.py --users 5000    # quicker run
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+import database
+
+
+LEGACY_SCHEMA = [
+    """
+    CREATE TABLE mantras (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        deity_id TEXT NOT NULL,
+        level_number INTEGER NOT NULL,
+        section_number INTEGER NOT NULL,
+        sort_order INTEGER NOT NULL,
+        title TEXT,
+        content TEXT,
+        UNIQUE(deity_id, level_number, section_number)
+    )
+    """,
+    """
+    CREATE TABLE user_progress (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        mantra_id INTEGER NOT NULL,
+        reflection_text TEXT,
+        completed_at TEXT
+    )
+    """,
+]
+
+LEGACY_TOTALS = """
+    SELECT level_number, COUNT(*) FROM mantras
+    WHERE deity_id = ?
+    GROUP BY level_number
+"""
+
+LEGACY_COMPLETED = """
+    SELECT m.level_number, COUNT(*) FROM user_progress up
+    JOIN mantras m ON m.id = up.mantra_id
+    WHERE up.user_id = ? AND m.deity_id = ?
+    GROUP BY m.level_number
+"""
+
+LEGACY_NEXT = """
+    SELECT m.id, m.deity_id, m.level_number, m.section_number, m.sort_order, m.title, m.content
+    FROM mantras m
+    LEFT JOIN user_progress up
+      ON up.mantra_id = m.id AND up.user_id = ?
+    WHERE m.deity_id = ? AND up.id IS NULL
+    ORDER BY m.level_number ASC, m.sort_order ASC
+    LIMIT 1
+"""
+
+
+def _mantra_rows(n_mantras: int, n_deities: int, n_levels: int = 5):
+    per_level = max(1, n_mantras // (n_deities * n_levels))
+    rows = []
+    for d in range(n_deities):
+        for lvl in range(1, n_levels + 1):
+            for sec in range(1, per_level + 1):
+                rows.append((f"deity_{d}", lvl, sec, sec, f"Section {sec}", "Om ..."))
+    return rows[:n_mantras]
+
+
+def _progress_rows(n_users: int, mantra_rows, avg_completed: int, seed: int):
+    """Each user completes a prefix of one deity's journey, like the real flow."""
+    rng = random.Random(seed)
+    by_deity = {}
+    for mantra_id, row in enumerate(mantra_rows, start=1):
+        by_deity.setdefault(row[0], []).append(mantra_id)
+    deities = sorted(by_deity)
+    now = "2024-01-01T00:00:00"
+    for u in range(n_users):
+        ids = by_deity[rng.choice(deities)]
+        done = min(len(ids), int(rng.expovariate(1.0 / max(1, avg_completed))))
+        for mantra_id in ids[:done]:
+            yield (f"user_{u}", mantra_id, "", now)
+
+
+def _populate(db_path: str, mantra_rows, args):
+    conn = sqlite3.connect(db_path)
+    cur = conn.cursor()
+    cur.executemany(
+        """
+        INSERT INTO mantras (deity_id, level_number, section_number, sort_order, title, content)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        mantra_rows,
+    )
+    cur.executemany(
+        """
+        INSERT INTO user_progress (user_id, mantra_id, reflection_text, completed_at)
+        VALUES (?, ?, ?, ?)
+        """,
+        _progress_rows(args.users, mantra_rows, args.avg_completed, args.seed),
+    )
+    conn.commit()
+    cur.execute("ANALYZE")
+    cur.execute("SELECT COUNT(*) FROM user_progress")
+    count = cur.fetchone()[0]
+    conn.close()
+    return count
+
+
+def _legacy_page(db_path: str, user_id: str, deity_id: str):
+    """What one Mantra journey render cost before: next + stats + summary."""
+    conn = sqlite3.connect(db_path)
+    cur = conn.cursor()
+    for _ in range(2):
+        cur.execute(LEGACY_TOTALS, (deity_id,))
+        cur.fetchall()
+        cur.execute(LEGACY_COMPLETED, (user_id, deity_id))
+        cur.fetchall()
+    cur.execute(LEGACY_NEXT, (user_id, deity_id))
+    cur.fetchone()
+    conn.close()
+
+
+def _current_page(user_id: str, deity_id: str):
+    database.get_next_uncompleted_mantra(user_id, deity_id)
+    database.get_level_progress_summary(user_id, deity_id)
+
+
+def _time_calls(fn, samples):
+    timings = []
+    for args in samples:
+        start = time.perf_counter()
+        fn(*args)
+        timings.append((time.perf_counter() - start) * 1000.0)
+    timings.sort()
+    return {
+        "p50": statistics.median(timings),
+        "p95": timings[int(len(timings) * 0.95) - 1],
+        "mean": statistics.fmean(timings),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--mantras", type=int, default=500)
+    parser.add_argument("--deities", type=int, default=5)
+    parser.add_argument("--avg-completed", type=int, default=20, help="mean completions per user")
+    parser.add_argument("--queries", type=int, default=200, help="page renders to time per schema")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    mantra_rows = _mantra_rows(args.mantras, args.deities)
+    rng = random.Random(args.seed + 1)
+    samples = [
+        (f"user_{rng.randrange(args.users)}", f"deity_{rng.randrange(args.deities)}")
+        for _ in range(args.queries)
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_db = os.path.join(tmp, "legacy.db")
+        conn = sqlite3.connect(legacy_db)
+        for ddl in LEGACY_SCHEMA:
+            conn.execute(ddl)
+        conn.commit()
+        conn.close()
+
+        current_db = os.path.join(tmp, "current.db")
+        database.DB_FILE = current_db
+        # Create the base tables only, load data, then migrate: the same
+        # path an existing deployment takes on its first start.
+        conn = sqlite3.connect(current_db)
+        for ddl in LEGACY_SCHEMA:
+            conn.execute(ddl)
+        conn.commit()
+        conn.close()
+
+        print(f"Populating {args.users:,} users x {len(mantra_rows):,} mantras ...")
+        n_progress = _populate(legacy_db, mantra_rows, args)
+        _populate(current_db, mantra_rows, args)
+        start = time.perf_counter()
+        database.init_db()
+        migrate_s = time.perf_counter() - start
+        print(f"user_progress rows: {n_progress:,} (migration took {migrate_s:.2f}s)\n")
+
+        legacy = _time_calls(lambda u, d: _legacy_page(legacy_db, u, d), samples)
+        current = _time_calls(_current_page, samples)
+
+    print(f"{'schema':<10}{'p50 ms':>10}{'p95 ms':>10}{'mean ms':>10}")
+    for name, res in (("legacy", legacy), ("current", current)):
+        print(f"{name:<10}{res['p50']:>10.2f}{res['p95']:>10.2f}{res['mean']:>10.2f}")
+    if current["mean"] > 0:
+        print(f"\nspeed-up (mean): {legacy['mean'] / current['mean']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+"""
+Retrieval quality and latency benchmark over the prepared_*.jsonl records.
+
+Builds a throwaway index from the id/text/source records (optionally
+re-chunked with prepare_data's chunker), then runs a query set through the
+same steps as rag.retrieve_passages: one vector query for 10 hits, then
+select_diverse_passages down to k (and neighbour expansion with
+--neighbours).
+
+Queries are word windows cut from records of --query-split, with a share
+of the words dropped so they are not verbatim copies. A hit is relevant
+when its chunk contains the original window.
+
+Reported:
+- recall@k and MRR of the final passages (and recall of the raw 10 hits),
+- source diversity: distinct books per answer / passages returned,
+- latency p50 / p95 / p99 of embed + search and of search alone,
+- throughput of the search step with --workers concurrent queries.
+
+Embedders are pluggable: "hash" (deterministic, offline, no API key),
+"openai" (text-embedding-3-small via prepare_data.embed_texts) or any
+"module:function" taking a list of texts and returning vectors.
+
+Usage:
+    python bench_retrieval.py                              # hash embedder, Chroma
+    python bench_retrieval.py --backend quantized          # vector_store.py backend
+    python bench_retrieval.py --chunk-size 1000 --overlap 150
+    python bench_retrieval.py --embedder openai --queries 100
+    python bench_retrieval.py --json results.json          # save the numbers
+"""
+
+import argparse
+import glob
+import hashlib
+import importlib
+import json
+import os
+import random
+import re
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from retrieval_utils import chunk_id, expand_with_neighbours, fan_out_query, fetch_by_ids, select_diverse_passages
+
+PREPARED_GLOB = "prepared_*.jsonl"
+# rag.retrieve_passages asks the index for this many hits before selection.
+POOL_SIZE = 10
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+# ---------- EMBEDDERS ----------
+
+def hash_embed(texts, dim: int = 1024):
+    """
+    Deterministic bag-of-words embedding: word unigrams and bigrams hashed
+    into `dim` signed buckets, L2-normalised. Needs no network, so runs are
+    repeatable and free.
+    """
+    out = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        words = _WORD_RE.findall((text or "").lower())
+        for feature in words + [a + " " + b for a, b in zip(words, words[1:])]:
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            out[row, value % dim] += 1.0 if (value >> 63) else -1.0
+    norms = np.linalg.norm(out, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return out / norms
+
+
+def openai_embed(texts):
+    from prepare_data import embed_texts
+
+    return np.asarray(embed_texts(list(texts)), dtype=np.float32)
+
+
+EMBEDDERS = {"hash": hash_embed, "openai": openai_embed}
+
+
+def load_embedder(spec: str):
+    if spec in EMBEDDERS:
+        return EMBEDDERS[spec]
+    module, _, attr = spec.partition(":")
+    if not attr:
+        raise SystemExit(f"Unknown embedder '{spec}': use {', '.join(EMBEDDERS)} or module:function")
+    return getattr(importlib.import_module(module), attr)
+
+
+# ---------- CORPUS ----------
+
+def load_records(paths):
+    """[(split, record)] from prepared_*.jsonl files, in file order."""
+    records = []
+    for path in paths:
+        split = os.path.basename(path)[len("prepared_"):].rsplit(".", 1)[0]
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    records.append((split, json.loads(line)))
+    return records
+
+
+def build_chunks(records, chunk_size=None, overlap=None):
+    """
+    Chunks as (id, text, meta) with indexer-style ids ("<book>_chunk_<n>").
+    Without chunk_size every record is one chunk; otherwise each source's
+    records are joined and re-chunked with prepare_data's chunker.
+    """
+    by_book = {}
+    for _split, rec in records:
+        book = os.path.basename(rec.get("source") or "unknown")
+        by_book.setdefault(book, []).append(rec.get("text") or "")
+
+    if chunk_size:
+        from prepare_data import chunk_text
+
+    chunks = []
+    for book, texts in by_book.items():
+        pieces = chunk_text("\n".join(texts), chunk_size, overlap) if chunk_size else texts
+        for i, text in enumerate(pieces):
+            meta = {"source": os.path.abspath(os.path.join("books", book)), "book": book, "chunk_index": i}
+            chunks.append((chunk_id(book, i), text, meta))
+    return chunks
+
+
+def _normalize_space(text: str) -> str:
+    return " ".join((text or "").split())
+
+
+def make_queries(records, split: str, n: int, window: int, drop: float, seed: int):
+    """[(query text, exact window)] cut from records of `split`."""
+    rng = random.Random(seed)
+    pool = [rec for s, rec in records if s == split and len((rec.get("text") or "").split()) > window]
+    queries = []
+    for rec in rng.sample(pool, min(n, len(pool))):
+        words = rec["text"].split()
+        start = rng.randrange(len(words) - window)
+        span = words[start:start + window]
+        kept = [w for w in span if rng.random() >= drop] or span
+        queries.append((" ".join(kept), " ".join(span)))
+    return queries
+
+
+def relevant_ids(queries, chunks):
+    """For each query, the ids of chunks containing its window."""
+    normalized = [(cid, _normalize_space(text)) for cid, text, _meta in chunks]
+    return [{cid for cid, text in normalized if span in text} for _q, span in queries]
+
+
+# ---------- INDEX ----------
+
+def build_index(backend: str, chunks, vectors, workdir: str):
+    ids = [c[0] for c in chunks]
+    docs = [c[1] for c in chunks]
+    metas = [c[2] for c in chunks]
+    if backend == "quantized":
+        from vector_store import build_from_arrays, open_stores
+
+        build_from_arrays(os.path.join(workdir, "store", "bench"), ids, vectors, docs, metas)
+        return open_stores(["bench"], root=os.path.join(workdir, "store"))
+
+    import chromadb
+
+    chroma_client = chromadb.PersistentClient(path=os.path.join(workdir, "chroma"))
+    col = chroma_client.get_or_create_collection("bench", metadata={"hnsw:space": "cosine"})
+    for start in range(0, len(ids), 1000):
+        end = start + 1000
+        col.add(ids=ids[start:end], embeddings=np.asarray(vectors[start:end]).tolist(),
+                documents=docs[start:end], metadatas=metas[start:end])
+    return [col]
+
+
+def retrieve(collections, emb, k: int, neighbours: int):
+    """The retrieval steps of rag.retrieve_passages, minus Streamlit."""
+    res = fan_out_query(collections, [list(map(float, emb))], n_results=POOL_SIZE)
+    ids = list(res["ids"][0])
+    metas_all = [dict(m or {}, chunk_id=cid) for m, cid in zip(res["metadatas"][0], ids)]
+    docs, metas = select_diverse_passages(res["documents"][0], metas_all, k)
+    if neighbours > 0:
+        hits = [(m.get("chunk_id"), d, m) for d, m in zip(docs, metas)]
+        docs, metas = expand_with_neighbours(
+            hits, lambda wanted: fetch_by_ids(collections, wanted), radius=neighbours
+        )
+    return ids, docs, metas
+
+
+# ---------- METRICS ----------
+
+def percentile(sorted_values, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, max(0, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[idx]
+
+
+def _latency_summary(ms):
+    ms = sorted(ms)
+    return {"p50": statistics.median(ms), "p95": percentile(ms, 95), "p99": percentile(ms, 99)}
+
+
+def _final_ids(metas):
+    """Chunk ids covered by the final passages (whole windows after expansion)."""
+    out = []
+    for m in metas:
+        cid = m.get("chunk_id")
+        span = m.get("chunk_range")
+        if cid and span:
+            book = cid.rsplit("_chunk_", 1)[0]
+            lo, hi = (int(x) for x in span.split("-"))
+            out.append({chunk_id(book, i) for i in range(lo, hi + 1)})
+        else:
+            out.append({cid})
+    return out
+
+
+def evaluate(collections, embed, queries, relevant, k: int, neighbours: int, workers: int) -> dict:
+    texts = [q for q, _span in queries]
+    embed_start = time.perf_counter()
+    query_vectors = np.asarray(embed(texts), dtype=np.float32)
+    embed_ms_each = (time.perf_counter() - embed_start) * 1000.0 / max(1, len(texts))
+
+    search_ms, pool_hits, final_hits, reciprocal, diversity = [], 0, 0, 0.0, []
+    for emb, rel in zip(query_vectors, relevant):
+        start = time.perf_counter()
+        pool_ids, _docs, metas = retrieve(collections, emb, k, neighbours)
+        search_ms.append((time.perf_counter() - start) * 1000.0)
+
+        pool_hits += bool(rel & set(pool_ids))
+        ranked = _final_ids(metas)
+        rank = next((i + 1 for i, ids in enumerate(ranked) if rel & ids), None)
+        if rank is not None:
+            final_hits += 1
+            reciprocal += 1.0 / rank
+        if metas:
+            diversity.append(len({m.get("book") for m in metas}) / float(len(metas)))
+
+    # Throughput: the same searches issued from `workers` threads at once.
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        list(pool.map(lambda emb: retrieve(collections, emb, k, neighbours), query_vectors))
+    wall = time.perf_counter() - start
+
+    n = float(len(queries))
+    return {
+        "queries": len(queries),
+        f"recall@{POOL_SIZE}_raw": pool_hits / n,
+        f"recall@{k}": final_hits / n,
+        "mrr": reciprocal / n,
+        "source_diversity": statistics.fmean(diversity) if diversity else 0.0,
+        "search_ms": _latency_summary(search_ms),
+        "total_ms": _latency_summary([ms + embed_ms_each for ms in search_ms]),
+        "throughput_qps": len(queries) / wall if wall else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", nargs="*", help=f"record files (default: {PREPARED_GLOB})")
+    parser.add_argument("--embedder", default="hash", help="hash, openai or module:function")
+    parser.add_argument("--backend", choices=["chroma", "quantized"], default="chroma")
+    parser.add_argument("--chunk-size", type=int, help="re-chunk each source with this many characters")
+    parser.add_argument("--overlap", type=int, default=200, help="overlap when re-chunking")
+    parser.add_argument("--query-split", default="test", help="split the queries are cut from")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--window", type=int, default=12, help="words per query window")
+    parser.add_argument("--drop", type=float, default=0.25, help="share of window words dropped")
+    parser.add_argument("--k", type=int, default=5, help="passages returned, as in retrieve_passages")
+    parser.add_argument("--neighbours", type=int, default=0, help="adjacent chunks added per passage")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent queries for throughput")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", dest="json_path", help="also write the results to this file")
+    args = parser.parse_args()
+
+    paths = args.files or sorted(glob.glob(PREPARED_GLOB))
+    records = load_records(paths)
+    chunks = build_chunks(records, args.chunk_size, args.overlap)
+    queries = make_queries(records, args.query_split, args.queries, args.window, args.drop, args.seed)
+    relevant = relevant_ids(queries, chunks)
+    pairs = [(q, r) for q, r in zip(queries, relevant) if r]
+    queries, relevant = [q for q, _ in pairs], [r for _, r in pairs]
+    if not queries:
+        raise SystemExit("No queries could be matched to an indexed chunk.")
+
+    embed = load_embedder(args.embedder)
+    print(f"Embedding {len(chunks):,} chunks from {len(paths)} file(s) with '{args.embedder}' ...")
+    start = time.perf_counter()
+    vectors = np.asarray(embed([c[1] for c in chunks]), dtype=np.float32)
+    embed_s = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        collections = build_index(args.backend, chunks, vectors, tmp)
+        build_s = time.perf_counter() - start
+        results = evaluate(collections, embed, queries, relevant, args.k, args.neighbours, args.workers)
+
+    results.update(
+        {
+            "embedder": args.embedder,
+            "backend": args.backend,
+            "chunks": len(chunks),
+            "chunk_size": args.chunk_size,
+            "overlap": args.overlap if args.chunk_size else None,
+            "k": args.k,
+            "neighbours": args.neighbours,
+            "embed_corpus_s": embed_s,
+            "build_index_s": build_s,
+        }
+    )
+
+    print(f"index: {len(chunks):,} chunks ({args.backend}), embed {embed_s:.1f}s, build {build_s:.1f}s")
+    print(f"queries: {results['queries']}\n")
+    rows = [
+        (f"recall@{POOL_SIZE} (raw hits)", results[f"recall@{POOL_SIZE}_raw"]),
+        (f"recall@{args.k} (passages)", results[f"recall@{args.k}"]),
+        ("MRR", results["mrr"]),
+        ("source diversity", results["source_diversity"]),
+    ]
+    for label, value in rows:
+        print(f"{label:<24}{value:>8.3f}")
+    print()
+    print(f"{'latency':<16}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name in ("search_ms", "total_ms"):
+        lat = results[name]
+        print(f"{name[:-3]:<16}{lat['p50']:>10.2f}{lat['p95']:>10.2f}{lat['p99']:>10.2f}")
+    print(f"\nthroughput: {results['throughput_qps']:.1f} queries/s with {args.workers} workers")
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
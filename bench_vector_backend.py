@@ -0,0 +1,151 @@
+"""
+Benchmark the quantized memory-mapped store against the Chroma path.
+
+For the same vectors and queries it reports, per backend:
+- recall@k against exact (float32 brute-force) cosine search,
+- query latency p50 / p95 / mean,
+- bytes scanned per query (int8 store) or held by the index.
+
+By default the data is synthetic (clustered random vectors) and both
+indexes are built in a temporary directory. With --live the real Chroma
+shards and their vector_store.py exports are used; queries are stored
+chunk embeddings with a little noise added.
+
+Usage:
+    python bench_vector_backend.py                      # 20k x 1536 synthetic
+    python bench_vector_backend.py --vectors 5000       # quicker run
+    python bench_vector_backend.py --live               # the app's own index
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+import chromadb
+import numpy as np
+
+from retrieval_utils import fan_out_query
+from vector_store import VECTOR_INDEX_DIR, build_from_arrays, open_stores
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _synthetic(n: int, dim: int, n_queries: int, seed: int):
+    """Vectors around a few hundred centres, like topical book chunks."""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((max(8, n // 100), dim)).astype(np.float32)
+    labels = rng.integers(0, len(centres), size=n)
+    vectors = _normalize_rows(centres[labels] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32))
+    picks = rng.integers(0, n, size=n_queries)
+    queries = _normalize_rows(vectors[picks] + 0.3 * rng.standard_normal((n_queries, dim)).astype(np.float32))
+    return vectors, queries
+
+
+def _exact_top_k(vectors: np.ndarray, ids, queries: np.ndarray, k: int):
+    scores = _normalize_rows(queries) @ vectors.T
+    top = np.argsort(-scores, axis=1)[:, :k]
+    return [[ids[i] for i in row] for row in top]
+
+
+def _run(query_fn, queries, truth, k: int):
+    timings, hits = [], 0
+    for q, expected in zip(queries, truth):
+        start = time.perf_counter()
+        res = query_fn(q)
+        timings.append((time.perf_counter() - start) * 1000.0)
+        hits += len(set(res["ids"][0][:k]) & set(expected))
+    timings.sort()
+    return {
+        "recall": hits / float(len(queries) * k),
+        "p50": statistics.median(timings),
+        "p95": timings[max(0, int(len(timings) * 0.95) - 1)],
+        "mean": statistics.fmean(timings),
+    }
+
+
+def _report(results: dict, k: int, stores) -> None:
+    print(f"{'backend':<12}{'recall@' + str(k):>10}{'p50 ms':>10}{'p95 ms':>10}{'mean ms':>10}")
+    for name, res in results.items():
+        print(f"{name:<12}{res['recall']:>10.3f}{res['p50']:>10.2f}{res['p95']:>10.2f}{res['mean']:>10.2f}")
+    scanned = sum(s.q.nbytes for s in stores)
+    full = sum(s.full.nbytes for s in stores)
+    print(f"\nint8 bytes scanned per query: {scanned / 1e6:.1f} MB (float32 copy on disk: {full / 1e6:.1f} MB)")
+
+
+def _bench_synthetic(args) -> None:
+    vectors, queries = _synthetic(args.vectors, args.dim, args.queries, args.seed)
+    ids = [f"bench_chunk_{i}" for i in range(len(vectors))]
+    docs = [f"passage {i}" for i in range(len(vectors))]
+    metas = [{"book": f"book_{i % 20}.pdf", "chunk_index": i} for i in range(len(vectors))]
+    truth = _exact_top_k(vectors, ids, queries, args.k)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"Building Chroma and quantized indexes for {len(vectors):,} x {args.dim} vectors ...")
+        chroma_client = chromadb.PersistentClient(path=os.path.join(tmp, "chroma"))
+        col = chroma_client.get_or_create_collection("bench", metadata={"hnsw:space": "cosine"})
+        for start in range(0, len(ids), 5000):
+            end = start + 5000
+            col.add(ids=ids[start:end], embeddings=vectors[start:end].tolist(),
+                    documents=docs[start:end], metadatas=metas[start:end])
+        build_from_arrays(os.path.join(tmp, "store", "bench"), ids, vectors, docs, metas)
+        stores = open_stores(["bench"], root=os.path.join(tmp, "store"))
+
+        results = {
+            "chroma": _run(lambda q: col.query(query_embeddings=[q.tolist()], n_results=args.k), queries, truth, args.k),
+            "quantized": _run(lambda q: stores[0].query([q], n_results=args.k), queries, truth, args.k),
+        }
+        print()
+        _report(results, args.k, stores)
+
+
+def _bench_live(args) -> None:
+    from index_layout import CHROMA_PATH, open_collections
+
+    chroma_client = chromadb.PersistentClient(path=CHROMA_PATH)
+    collections = list(open_collections(chroma_client).values())
+    stores = open_stores([col.name for col in collections], root=VECTOR_INDEX_DIR)
+    if not stores:
+        print("No exported stores found. Run: python vector_store.py build")
+        return
+
+    # Exact ground truth over the full-precision copy of every store.
+    vectors = np.vstack([np.asarray(s.full) for s in stores])
+    ids = [i for s in stores for i in s.get(include=[])["ids"]]
+    rng = np.random.default_rng(args.seed)
+    picks = rng.integers(0, len(vectors), size=args.queries)
+    noise = 0.3 * rng.standard_normal((args.queries, vectors.shape[1])).astype(np.float32) / np.sqrt(vectors.shape[1])
+    queries = _normalize_rows(vectors[picks] + noise)
+    truth = _exact_top_k(vectors, ids, queries, args.k)
+
+    results = {
+        "chroma": _run(lambda q: fan_out_query(collections, [q.tolist()], args.k), queries, truth, args.k),
+        "quantized": _run(lambda q: fan_out_query(stores, [q], args.k), queries, truth, args.k),
+    }
+    print(f"{len(vectors):,} vectors in {len(stores)} shard(s)\n")
+    _report(results, args.k, stores)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=20_000)
+    parser.add_argument("--dim", type=int, default=1536, help="text-embedding-3-small size")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--live", action="store_true", help="use the app's Chroma shards and exported stores")
+    args = parser.parse_args()
+
+    if args.live:
+        _bench_live(args)
+    else:
+        _bench_synthetic(args)
+
+
+if __name__ == "__main__":
+    main()
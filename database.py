@@ -1,7 +1,16 @@
 import os
 import json
 import sqlite3
+import hashlib
 import datetime
+import logging
+import secrets
+import contextlib
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock for the JSON stores.
+    fcntl = None
 
 # Directories & files
 # Directories & files
@@ -32,15 +41,21 @@ SESSION_TTL_MINUTES = 40
 # SQLite DB for users
 DB_FILE = "dharma_app.db"
 
+# How long a write that needs the database lock waits for other writers
+# (parallel admin edits, completions) before giving up.
+DB_WRITE_TIMEOUT_SECONDS = 30
+
 os.makedirs(GUIDANCE_AUDIO_DIR, exist_ok=True)
 
+logger = logging.getLogger(__name__)
+
 
 # ---------- SQLITE USER DB ----------
 
 def init_db():
     """Initialise the SQLite database for user storage."""
     try:
-        conn = sqlite3.connect(DB_FILE)
+        conn = sqlite3.connect(DB_FILE, timeout=DB_WRITE_TIMEOUT_SECONDS)
         cur = conn.cursor()
         cur.execute(
             """
@@ -85,13 +100,326 @@ def init_db():
             """
         )
         conn.commit()
+        _apply_migrations(conn)
     except Exception:
-        pass
+        logger.exception("Could not initialise or migrate %s", DB_FILE)
     finally:
         try:
             conn.close()
         except Exception:
             pass
+    prune_chat_turns(CHAT_RETENTION_DAYS)
+
+
+# ---------- SCHEMA MIGRATIONS ----------
+# Each migration takes a cursor and upgrades the schema by one step.
+# PRAGMA user_version records the last step applied, so init_db() only
+# runs the steps a database has not seen yet. Append new steps; never
+# renumber or edit ones that have shipped.
+
+def _migrate_progress_indexes(cur):
+    """Index user_progress and make (user_id, mantra_id) unique."""
+    # The old SELECT-then-INSERT in mark_mantra_completed could race and
+    # store the same completion twice; keep the earliest row.
+    cur.execute(
+        """
+        DELETE FROM user_progress
+        WHERE id NOT IN (
+            SELECT MIN(id) FROM user_progress GROUP BY user_id, mantra_id
+        )
+        """
+    )
+    cur.execute(
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_user_progress_user_mantra
+        ON user_progress (user_id, mantra_id)
+        """
+    )
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_user_progress_mantra
+        ON user_progress (mantra_id)
+        """
+    )
+    # Lets "next uncompleted mantra" walk mantras in level/sort order
+    # without a temp B-tree sort.
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_mantras_deity_level_sort
+        ON mantras (deity_id, level_number, sort_order)
+        """
+    )
+
+
+def _migrate_level_counters(cur):
+    """Create the materialized per-level totals and per-user counters."""
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS mantra_level_totals (
+            deity_id TEXT NOT NULL,
+            level_number INTEGER NOT NULL,
+            total INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (deity_id, level_number)
+        )
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS user_level_progress (
+            user_id TEXT NOT NULL,
+            deity_id TEXT NOT NULL,
+            level_number INTEGER NOT NULL,
+            completed_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, deity_id, level_number)
+        )
+        """
+    )
+    _fill_level_counters(cur)
+
+
+def _migrate_completion_stats(cur):
+    """Create the per-mantra completion counters and the daily rollup."""
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS mantra_completion_counts (
+            mantra_id INTEGER PRIMARY KEY,
+            completed_count INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_mantra_completion_counts_count
+        ON mantra_completion_counts (completed_count DESC)
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS mantra_completion_daily (
+            day TEXT NOT NULL,
+            mantra_id INTEGER NOT NULL,
+            completed_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, mantra_id)
+        )
+        """
+    )
+    _fill_completion_stats(cur)
+
+
+def _migrate_approved_practices(cur):
+    """Move approved practices from approved_practices.json into SQLite."""
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS store_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS approved_practices (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            deity TEXT NOT NULL DEFAULT 'General',
+            level INTEGER,
+            age_group TEXT NOT NULL DEFAULT 'both',
+            position INTEGER NOT NULL,
+            data TEXT NOT NULL
+        )
+        """
+    )
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_approved_practices_kind_position
+        ON approved_practices (kind, position)
+        """
+    )
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_approved_practices_kind_deity_level
+        ON approved_practices (kind, deity, level)
+        """
+    )
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_approved_practices_kind_age
+        ON approved_practices (kind, age_group)
+        """
+    )
+    legacy = _read_approved_practices_file()
+    for kind in ("mantra", "meditation"):
+        for entry in legacy.get(kind) or []:
+            if isinstance(entry, dict):
+                _insert_practice(cur, kind, entry)
+    _bump_store_version(cur, "approved_practices")
+
+
+def _migrate_practice_candidates(cur):
+    """Move practice candidates from practice_candidates.json into SQLite."""
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS practice_candidates (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            cand_key TEXT NOT NULL UNIQUE,
+            kind TEXT NOT NULL,
+            source TEXT NOT NULL DEFAULT '',
+            source_name TEXT NOT NULL DEFAULT '',
+            text TEXT NOT NULL DEFAULT '',
+            approved INTEGER NOT NULL DEFAULT 0,
+            cluster TEXT,
+            representative INTEGER NOT NULL DEFAULT 1,
+            cluster_size INTEGER NOT NULL DEFAULT 1,
+            score REAL,
+            data TEXT
+        )
+        """
+    )
+    # The review page lists pending representatives per kind, newest scan
+    # order, optionally limited to some books.
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_practice_candidates_review
+        ON practice_candidates (approved, representative, kind, id)
+        """
+    )
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_practice_candidates_source
+        ON practice_candidates (source_name, approved)
+        """
+    )
+    _write_candidates(cur, _read_practice_candidates_file())
+
+
+def _migrate_online_practice_cache(cur):
+    """Cache of validated online practice suggestions."""
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS online_practice_cache (
+            cache_key TEXT PRIMARY KEY,
+            deity TEXT NOT NULL,
+            scope TEXT NOT NULL,
+            level TEXT NOT NULL,
+            prompt_version INTEGER NOT NULL,
+            practices TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+        """
+    )
+
+
+def _migrate_book_registry(cur):
+    """Content hashes of the files in books/, for duplicate detection."""
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS book_registry (
+            file_name TEXT PRIMARY KEY,
+            sha256 TEXT,
+            size INTEGER,
+            mtime REAL,
+            text_hash TEXT,
+            duplicate_of TEXT,
+            added_at TEXT NOT NULL
+        )
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_book_registry_sha256 ON book_registry (sha256)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_book_registry_text_hash ON book_registry (text_hash)")
+
+
+def _migrate_media_derivatives(cur):
+    """Web-optimised copies of uploaded guidance media."""
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS media_derivatives (
+            original_path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime REAL NOT NULL,
+            sha256 TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            derivative_path TEXT,
+            status TEXT NOT NULL,
+            error TEXT,
+            updated_at TEXT NOT NULL
+        )
+        """
+    )
+
+
+def _migrate_chat_turns(cur):
+    """Dharma chat turns, so sessions keep only the latest few in memory."""
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS chat_turns (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            conversation_id TEXT NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            books_used TEXT,
+            passages TEXT,
+            metas TEXT,
+            image_url TEXT,
+            style TEXT,
+            created_at TEXT NOT NULL
+        )
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_chat_turns_conversation ON chat_turns (conversation_id, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_chat_turns_created ON chat_turns (created_at)")
+
+
+def _migrate_book_reindex(cur):
+    """Flag copies of a removed book so the indexers pick them up again."""
+    cur.execute("ALTER TABLE book_registry ADD COLUMN reindex INTEGER NOT NULL DEFAULT 0")
+
+
+def _migrate_chat_turn_owner(cur):
+    """Record who wrote each chat turn and encrypt the text already stored."""
+    cur.execute("ALTER TABLE chat_turns ADD COLUMN user_id TEXT")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_chat_turns_user ON chat_turns (user_id)")
+    rows = cur.execute("SELECT id, content FROM chat_turns").fetchall()
+    cur.executemany(
+        "UPDATE chat_turns SET content = ? WHERE id = ?",
+        [(_encrypt_chat_content(content), turn_id) for turn_id, content in rows],
+    )
+
+
+SCHEMA_MIGRATIONS = [
+    (1, _migrate_progress_indexes),
+    (2, _migrate_level_counters),
+    (3, _migrate_completion_stats),
+    (4, _migrate_approved_practices),
+    (5, _migrate_practice_candidates),
+    (6, _migrate_online_practice_cache),
+    (7, _migrate_book_registry),
+    (8, _migrate_media_derivatives),
+    (9, _migrate_chat_turns),
+    (10, _migrate_book_reindex),
+    (11, _migrate_chat_turn_owner),
+]
+
+
+def _apply_migrations(conn):
+    """
+    Run any pending SCHEMA_MIGRATIONS, each step and its user_version bump
+    in its own write transaction, so a failing step keeps the ones before
+    it and is retried on the next start. Raises on the first failure.
+    """
+    cur = conn.cursor()
+    for version, migrate in SCHEMA_MIGRATIONS:
+        # Take the write lock before reading the version so two processes
+        # starting together cannot both apply the same step.
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            cur.execute("PRAGMA user_version")
+            if version > (cur.fetchone()[0] or 0):
+                migrate(cur)
+                cur.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise RuntimeError(f"schema migration {version} ({migrate.__name__}) failed: {e}") from e
 
 
 def save_user_to_db(profile: dict):
@@ -208,10 +536,6 @@ def load_all_users_from_db() -> dict:
     return users
 
 
-# Ensure DB exists
-init_db()
-
-
 # ---------- STRUCTURED MANTRAS (DEITY LEVELS) ----------
 
 def _fetchall_dict(cur):
@@ -228,8 +552,12 @@ def add_structured_mantra(deity_id: str, level_number: int, title: str, content:
     if not deity_id or not level_number:
         return None
     try:
-        conn = sqlite3.connect(DB_FILE)
+        conn = sqlite3.connect(DB_FILE, timeout=DB_WRITE_TIMEOUT_SECONDS)
         cur = conn.cursor()
+        # Hold the write lock from reading MAX(section_number) until the
+        # INSERT commits, so parallel adds and reorders cannot hand out
+        # the same section number.
+        cur.execute("BEGIN IMMEDIATE")
         cur.execute(
             "SELECT COALESCE(MAX(section_number), 0) FROM mantras WHERE deity_id = ? AND level_number = ?",
             (deity_id, level_number),
@@ -243,8 +571,9 @@ def add_structured_mantra(deity_id: str, level_number: int, title: str, content:
             """,
             (deity_id, level_number, next_section, next_section, title, content),
         )
-        conn.commit()
         mantra_id = cur.lastrowid
+        _bump_level_total(cur, deity_id, level_number, 1)
+        conn.commit()
         cur.execute(
             """
             SELECT id, deity_id, level_number, section_number, sort_order, title, content
@@ -353,25 +682,81 @@ def get_mantras_for_level(deity_id: str, level_number: int):
     return results
 
 
+def _renumber_level(cur, deity_id: str, level_number: int, ordered_ids=()):
+    """
+    Renumber a deity+level to sections 1..n inside the caller's transaction.
+
+    ordered_ids come first (ids from other levels are ignored); the rest
+    of the level keeps its current relative order after them.
+    """
+    cur.execute(
+        """
+        SELECT id FROM mantras
+        WHERE deity_id = ? AND level_number = ?
+        ORDER BY sort_order ASC, id ASC
+        """,
+        (deity_id, level_number),
+    )
+    current_ids = [r[0] for r in cur.fetchall()]
+    in_level = set(current_ids)
+    final_ids = []
+    seen = set()
+    for mantra_id in ordered_ids:
+        try:
+            mantra_id = int(mantra_id)
+        except (TypeError, ValueError):
+            continue
+        if mantra_id in in_level and mantra_id not in seen:
+            final_ids.append(mantra_id)
+            seen.add(mantra_id)
+    final_ids.extend(i for i in current_ids if i not in seen)
+
+    # UNIQUE(deity_id, level_number, section_number) is checked row by
+    # row, so first park every section on its negative (which cannot
+    # clash with a real one), then write the final numbers.
+    cur.execute(
+        """
+        UPDATE mantras
+        SET section_number = -section_number
+        WHERE deity_id = ? AND level_number = ?
+        """,
+        (deity_id, level_number),
+    )
+    cur.executemany(
+        """
+        UPDATE mantras
+        SET sort_order = ?, section_number = ?
+        WHERE id = ?
+        """,
+        [(idx, idx, mantra_id) for idx, mantra_id in enumerate(final_ids, start=1)],
+    )
+
+
 def reorder_mantras_for_level(deity_id: str, level_number: int, ordered_ids):
-    """Reassign sort_order and section_number according to provided ordered_ids."""
+    """
+    Reassign sort_order and section_number according to provided ordered_ids.
+
+    The whole level is renumbered 1..n in one transaction (see
+    _renumber_level). Returns True on success.
+
+    Mantras stay within their deity+level, so the level counters
+    (mantra_level_totals / user_level_progress) need no update here.
+    """
     if not ordered_ids:
-        return
+        return False
     try:
-        conn = sqlite3.connect(DB_FILE)
+        conn = sqlite3.connect(DB_FILE, timeout=DB_WRITE_TIMEOUT_SECONDS)
         cur = conn.cursor()
-        for idx, mantra_id in enumerate(ordered_ids, start=1):
-            cur.execute(
-                """
-                UPDATE mantras
-                SET sort_order = ?, section_number = ?
-                WHERE id = ? AND deity_id = ? AND level_number = ?
-                """,
-                (idx, idx, mantra_id, deity_id, level_number),
-            )
+        cur.execute("BEGIN IMMEDIATE")
+        _renumber_level(cur, deity_id, level_number, ordered_ids)
         conn.commit()
+        return True
     except Exception:
-        pass
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        return False
     finally:
         try:
             conn.close()
@@ -379,56 +764,186 @@ def reorder_mantras_for_level(deity_id: str, level_number: int, ordered_ids):
             pass
 
 
-def get_next_uncompleted_mantra(user_id: str, deity_id: str):
+# ---------- MATERIALIZED LEVEL COUNTERS ----------
+# mantra_level_totals holds how many mantras each deity+level has, and
+# user_level_progress how many of them each user completed. They are kept
+# in step by add/delete of mantras and by mark_mantra_completed, in the
+# same transaction as the change itself, so a Mantra journey render reads
+# one row per level instead of aggregating user_progress.
+# rebuild_level_progress() recomputes both from the source tables.
+
+def _bump_level_total(cur, deity_id: str, level_number: int, delta: int):
+    cur.execute(
+        """
+        INSERT INTO mantra_level_totals (deity_id, level_number, total)
+        VALUES (?, ?, MAX(?, 0))
+        ON CONFLICT(deity_id, level_number)
+        DO UPDATE SET total = MAX(total + ?, 0)
+        """,
+        (deity_id, level_number, delta, delta),
+    )
+
+
+def _fill_level_counters(cur):
+    """Recompute both counter tables from mantras and user_progress."""
+    cur.execute("DELETE FROM mantra_level_totals")
+    cur.execute("DELETE FROM user_level_progress")
+    cur.execute(
+        """
+        INSERT INTO mantra_level_totals (deity_id, level_number, total)
+        SELECT deity_id, level_number, COUNT(*)
+        FROM mantras
+        GROUP BY deity_id, level_number
+        """
+    )
+    cur.execute(
+        """
+        INSERT INTO user_level_progress (user_id, deity_id, level_number, completed_count)
+        SELECT up.user_id, m.deity_id, m.level_number, COUNT(*)
+        FROM user_progress up
+        JOIN mantras m ON m.id = up.mantra_id
+        GROUP BY up.user_id, m.deity_id, m.level_number
+        """
+    )
+
+
+def rebuild_level_progress(check_only: bool = False) -> dict:
     """
-    Return (next_mantra_dict, stats_dict)
-    stats: total, completed, per-level totals/completed.
+    Compare the level counters with user_progress/mantras and rebuild them.
+
+    Returns {"level_totals": n, "user_levels": n, "rebuilt": bool, "error": str}
+    where the counts are rows that disagreed with the source tables and
+    "error" is None unless the check itself failed. With check_only=True
+    nothing is written.
     """
-    if not deity_id:
-        return None, {}
+    result = {"level_totals": 0, "user_levels": 0, "rebuilt": False, "error": None}
     try:
-        conn = sqlite3.connect(DB_FILE)
+        conn = sqlite3.connect(DB_FILE, timeout=DB_WRITE_TIMEOUT_SECONDS)
         cur = conn.cursor()
-        # Build stats
+        cur.execute("BEGIN IMMEDIATE")
         cur.execute(
             """
-            SELECT level_number, COUNT(*) as total
-            FROM mantras
-            WHERE deity_id = ?
-            GROUP BY level_number
-            """,
-            (deity_id,),
+            SELECT COUNT(*) FROM (
+                SELECT deity_id, level_number, total
+                FROM mantra_level_totals WHERE total > 0
+                EXCEPT
+                SELECT deity_id, level_number, COUNT(*)
+                FROM mantras GROUP BY deity_id, level_number
+            )
+            """
         )
-        totals = {row[0]: row[1] for row in cur.fetchall()}
+        stale = cur.fetchone()[0]
         cur.execute(
             """
-            SELECT m.level_number, COUNT(*) as completed_count
-            FROM user_progress up
-            JOIN mantras m ON m.id = up.mantra_id
-            WHERE up.user_id = ? AND m.deity_id = ?
-            GROUP BY m.level_number
-            """,
-            (user_id or "", deity_id),
+            SELECT COUNT(*) FROM (
+                SELECT deity_id, level_number, COUNT(*)
+                FROM mantras GROUP BY deity_id, level_number
+                EXCEPT
+                SELECT deity_id, level_number, total
+                FROM mantra_level_totals WHERE total > 0
+            )
+            """
         )
-        completed_map = {row[0]: row[1] for row in cur.fetchall()}
-        stats = {
-            "totals": totals,
-            "completed": completed_map,
-        }
-        # Next uncompleted mantra ordered by level then sort_order
+        result["level_totals"] = stale + cur.fetchone()[0]
         cur.execute(
             """
-            SELECT m.id, m.deity_id, m.level_number, m.section_number, m.sort_order, m.title, m.content
-            FROM mantras m
-            LEFT JOIN user_progress up
-              ON up.mantra_id = m.id AND up.user_id = ?
-            WHERE m.deity_id = ? AND up.id IS NULL
-            ORDER BY m.level_number ASC, m.sort_order ASC
-            LIMIT 1
-            """,
-            (user_id or "", deity_id),
+            SELECT COUNT(*) FROM (
+                SELECT user_id, deity_id, level_number, completed_count
+                FROM user_level_progress WHERE completed_count > 0
+                EXCEPT
+                SELECT up.user_id, m.deity_id, m.level_number, COUNT(*)
+                FROM user_progress up JOIN mantras m ON m.id = up.mantra_id
+                GROUP BY up.user_id, m.deity_id, m.level_number
+            )
+            """
         )
-        row = cur.fetchone()
+        stale = cur.fetchone()[0]
+        cur.execute(
+            """
+            SELECT COUNT(*) FROM (
+                SELECT up.user_id, m.deity_id, m.level_number, COUNT(*)
+                FROM user_progress up JOIN mantras m ON m.id = up.mantra_id
+                GROUP BY up.user_id, m.deity_id, m.level_number
+                EXCEPT
+                SELECT user_id, deity_id, level_number, completed_count
+                FROM user_level_progress WHERE completed_count > 0
+            )
+            """
+        )
+        result["user_levels"] = stale + cur.fetchone()[0]
+        if check_only:
+            conn.rollback()
+        else:
+            _fill_level_counters(cur)
+            conn.commit()
+            result["rebuilt"] = True
+    except Exception as e:
+        result["error"] = str(e) or e.__class__.__name__
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+    return result
+
+
+def _level_progress(cur, user_id: str, deity_id: str):
+    """Return {level: (completed, total)} for a user and deity from the counters."""
+    cur.execute(
+        """
+        SELECT t.level_number, COALESCE(p.completed_count, 0), t.total
+        FROM mantra_level_totals t
+        LEFT JOIN user_level_progress p
+          ON p.user_id = ? AND p.deity_id = t.deity_id AND p.level_number = t.level_number
+        WHERE t.deity_id = ? AND t.total > 0
+        ORDER BY t.level_number ASC
+        """,
+        (user_id or "", deity_id),
+    )
+    return {row[0]: (row[1], row[2]) for row in cur.fetchall()}
+
+
+def get_next_uncompleted_mantra(user_id: str, deity_id: str):
+    """
+    Return (next_mantra_dict, stats_dict)
+    stats: total, completed, per-level totals/completed.
+    """
+    if not deity_id:
+        return None, {}
+    row = None
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        cur = conn.cursor()
+        # Build stats
+        progress = _level_progress(cur, user_id, deity_id)
+        stats = {
+            "totals": {lvl: total for lvl, (_, total) in progress.items()},
+            "completed": {lvl: done for lvl, (done, _) in progress.items() if done},
+        }
+        # Next uncompleted mantra: only levels the counters say are open
+        # need to be looked at, one level at a time in order.
+        for lvl, (done, total) in progress.items():
+            if done >= total:
+                continue
+            cur.execute(
+                """
+                SELECT m.id, m.deity_id, m.level_number, m.section_number, m.sort_order, m.title, m.content
+                FROM mantras m
+                LEFT JOIN user_progress up
+                  ON up.mantra_id = m.id AND up.user_id = ?
+                WHERE m.deity_id = ? AND m.level_number = ? AND up.id IS NULL
+                ORDER BY m.sort_order ASC
+                LIMIT 1
+                """,
+                (user_id or "", deity_id, lvl),
+            )
+            row = cur.fetchone()
+            if row:
+                break
     except Exception:
         row = None
         stats = {}
@@ -465,25 +980,33 @@ def mark_mantra_completed(user_id: str, mantra_id: int, reflection_text: str) ->
             enc_reflection = encrypt_field(enc_reflection)
         except Exception:
             enc_reflection = reflection_text.strip()
+    now = datetime.datetime.now()
     try:
-        conn = sqlite3.connect(DB_FILE)
+        conn = sqlite3.connect(DB_FILE, timeout=DB_WRITE_TIMEOUT_SECONDS)
         cur = conn.cursor()
-        # Prevent duplicate completion for same user/mantra
-        cur.execute(
-            "SELECT id FROM user_progress WHERE user_id = ? AND mantra_id = ? LIMIT 1",
-            (user_id, mantra_id),
-        )
-        if cur.fetchone():
-            return False
+        # UNIQUE(user_id, mantra_id) makes a repeat completion a no-op,
+        # even when two requests race.
         cur.execute(
             """
-            INSERT INTO user_progress (user_id, mantra_id, reflection_text, completed_at)
+            INSERT OR IGNORE INTO user_progress (user_id, mantra_id, reflection_text, completed_at)
             VALUES (?, ?, ?, ?)
             """,
-            (user_id, mantra_id, enc_reflection, datetime.datetime.now().isoformat()),
+            (user_id, mantra_id, enc_reflection, now.isoformat()),
         )
+        saved = cur.rowcount == 1
+        if saved:
+            _record_completion(cur, mantra_id, now)
+            cur.execute(
+                """
+                INSERT INTO user_level_progress (user_id, deity_id, level_number, completed_count)
+                SELECT ?, deity_id, level_number, 1 FROM mantras WHERE id = ?
+                ON CONFLICT(user_id, deity_id, level_number)
+                DO UPDATE SET completed_count = completed_count + 1
+                """,
+                (user_id, mantra_id),
+            )
         conn.commit()
-        return True
+        return saved
     except Exception:
         return False
     finally:
@@ -498,63 +1021,136 @@ def get_level_progress_summary(user_id: str, deity_id: str):
     try:
         conn = sqlite3.connect(DB_FILE)
         cur = conn.cursor()
-        cur.execute(
-            """
-            SELECT level_number, COUNT(*) FROM mantras
-            WHERE deity_id = ?
-            GROUP BY level_number
-            """,
-            (deity_id,),
-        )
-        totals = {row[0]: row[1] for row in cur.fetchall()}
-        cur.execute(
-            """
-            SELECT m.level_number, COUNT(*) FROM user_progress up
-            JOIN mantras m ON m.id = up.mantra_id
-            WHERE up.user_id = ? AND m.deity_id = ?
-            GROUP BY m.level_number
-            """,
-            (user_id or "", deity_id),
-        )
-        completed = {row[0]: row[1] for row in cur.fetchall()}
+        out = _level_progress(cur, user_id, deity_id)
     except Exception:
-        totals = {}
-        completed = {}
+        out = {}
     finally:
         try:
             conn.close()
         except Exception:
             pass
-    out = {}
-    for lvl, tot in totals.items():
-        out[lvl] = (completed.get(lvl, 0), tot)
     return out
 
 
-def get_top_completed_mantras(limit: int = 10):
+# ---------- COMPLETION LEADERBOARD ----------
+# mantra_completion_counts keeps an all-time count per mantra (indexed for
+# top-N) and mantra_completion_daily a per-day rollup, so the admin stats
+# never aggregate user_progress itself. Both are updated by
+# mark_mantra_completed and pruned by delete_structured_mantra.
+
+def _record_completion(cur, mantra_id: int, when: datetime.datetime):
+    cur.execute(
+        """
+        INSERT INTO mantra_completion_counts (mantra_id, completed_count)
+        VALUES (?, 1)
+        ON CONFLICT(mantra_id) DO UPDATE SET completed_count = completed_count + 1
+        """,
+        (mantra_id,),
+    )
+    cur.execute(
+        """
+        INSERT INTO mantra_completion_daily (day, mantra_id, completed_count)
+        VALUES (?, ?, 1)
+        ON CONFLICT(day, mantra_id) DO UPDATE SET completed_count = completed_count + 1
+        """,
+        (when.date().isoformat(), mantra_id),
+    )
+
+
+def _fill_completion_stats(cur):
+    """Recompute the leaderboard tables from user_progress."""
+    cur.execute("DELETE FROM mantra_completion_counts")
+    cur.execute("DELETE FROM mantra_completion_daily")
+    cur.execute(
+        """
+        INSERT INTO mantra_completion_counts (mantra_id, completed_count)
+        SELECT up.mantra_id, COUNT(*)
+        FROM user_progress up
+        JOIN mantras m ON m.id = up.mantra_id
+        GROUP BY up.mantra_id
+        """
+    )
+    cur.execute(
+        """
+        INSERT INTO mantra_completion_daily (day, mantra_id, completed_count)
+        SELECT substr(up.completed_at, 1, 10), up.mantra_id, COUNT(*)
+        FROM user_progress up
+        JOIN mantras m ON m.id = up.mantra_id
+        WHERE up.completed_at IS NOT NULL
+        GROUP BY substr(up.completed_at, 1, 10), up.mantra_id
+        """
+    )
+
+
+def rebuild_completion_stats() -> bool:
+    """Recompute the completion leaderboard tables. Returns True on success."""
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        _fill_completion_stats(cur)
+        conn.commit()
+        return True
+    except Exception:
+        return False
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def get_top_completed_mantras(limit: int = 10, days: int = None):
     """
     Return a list of most completed structured mantras with counts.
+
+    days: only count completions from the last `days` days (today included);
+    None means all time.
     """
     try:
         conn = sqlite3.connect(DB_FILE)
         cur = conn.cursor()
-        cur.execute(
-            """
-            SELECT
-                m.id,
-                m.deity_id,
-                m.level_number,
-                m.section_number,
-                m.title,
-                COUNT(up.id) AS completed_count
-            FROM mantras m
-            JOIN user_progress up ON up.mantra_id = m.id
-            GROUP BY m.id, m.deity_id, m.level_number, m.section_number, m.title
-            ORDER BY completed_count DESC, m.deity_id ASC, m.level_number ASC, m.section_number ASC
-            LIMIT ?
-            """,
-            (limit,),
-        )
+        if days:
+            since = (datetime.date.today() - datetime.timedelta(days=int(days) - 1)).isoformat()
+            cur.execute(
+                """
+                SELECT
+                    m.id,
+                    m.deity_id,
+                    m.level_number,
+                    m.section_number,
+                    m.title,
+                    w.completed_count
+                FROM (
+                    SELECT mantra_id, SUM(completed_count) AS completed_count
+                    FROM mantra_completion_daily
+                    WHERE day >= ?
+                    GROUP BY mantra_id
+                ) w
+                JOIN mantras m ON m.id = w.mantra_id
+                ORDER BY w.completed_count DESC, m.deity_id ASC, m.level_number ASC, m.section_number ASC
+                LIMIT ?
+                """,
+                (since, limit),
+            )
+        else:
+            cur.execute(
+                """
+                SELECT
+                    m.id,
+                    m.deity_id,
+                    m.level_number,
+                    m.section_number,
+                    m.title,
+                    c.completed_count
+                FROM mantra_completion_counts c
+                JOIN mantras m ON m.id = c.mantra_id
+                WHERE c.completed_count > 0
+                ORDER BY c.completed_count DESC, m.deity_id ASC, m.level_number ASC, m.section_number ASC
+                LIMIT ?
+                """,
+                (limit,),
+            )
         rows = cur.fetchall()
     except Exception:
         rows = []
@@ -604,13 +1200,32 @@ def update_structured_mantra(mantra_id: int, title: str, content: str):
 
 
 def delete_structured_mantra(mantra_id: int):
-    """Delete a structured mantra by id."""
+    """Delete a structured mantra by id and close the gap in its level's sections."""
     if not mantra_id:
         return
     try:
-        conn = sqlite3.connect(DB_FILE)
+        conn = sqlite3.connect(DB_FILE, timeout=DB_WRITE_TIMEOUT_SECONDS)
         cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute("SELECT deity_id, level_number FROM mantras WHERE id = ?", (mantra_id,))
+        row = cur.fetchone()
+        if not row:
+            return
+        deity_id, level_number = row
+        cur.execute(
+            """
+            UPDATE user_level_progress
+            SET completed_count = MAX(completed_count - 1, 0)
+            WHERE deity_id = ? AND level_number = ?
+              AND user_id IN (SELECT user_id FROM user_progress WHERE mantra_id = ?)
+            """,
+            (deity_id, level_number, mantra_id),
+        )
         cur.execute("DELETE FROM mantras WHERE id = ?", (mantra_id,))
+        cur.execute("DELETE FROM mantra_completion_counts WHERE mantra_id = ?", (mantra_id,))
+        cur.execute("DELETE FROM mantra_completion_daily WHERE mantra_id = ?", (mantra_id,))
+        _bump_level_total(cur, deity_id, level_number, -1)
+        _renumber_level(cur, deity_id, level_number)
         conn.commit()
     except Exception:
         pass
@@ -622,6 +1237,30 @@ def delete_structured_mantra(mantra_id: int):
 
 
 # ---------- SESSIONS (JSON) ----------
+# sessions.json and favourites.json are shared by every Streamlit worker
+# and the API server. Changes go through the helpers below, which hold an
+# fcntl lock on <file>.lock for the whole read-modify-write and replace
+# the file atomically, so concurrent logins and saves do not lose updates.
+
+@contextlib.contextmanager
+def _json_file_lock(path: str):
+    if fcntl is None:
+        yield
+        return
+    with open(path + ".lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _write_json_file(path: str, data):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, path)
+
 
 def load_sessions():
     """Load persistent login sessions from disk."""
@@ -638,10 +1277,38 @@ def load_sessions():
 
 
 def save_sessions(sessions: dict):
-    """Persist login sessions to disk."""
+    """Persist login sessions to disk (replaces every session; prefer add_session/remove_session)."""
+    try:
+        with _json_file_lock(SESSIONS_FILE):
+            _write_json_file(SESSIONS_FILE, sessions)
+    except Exception:
+        pass
+
+
+def add_session(role: str, username: str) -> str:
+    """Store a new login session and return its token."""
+    token = secrets.token_urlsafe(16)
+    try:
+        with _json_file_lock(SESSIONS_FILE):
+            sessions = load_sessions()
+            sessions[token] = {
+                "role": role,
+                "username": username,
+                "created_at": datetime.datetime.now().isoformat(),
+            }
+            _write_json_file(SESSIONS_FILE, sessions)
+    except Exception:
+        pass
+    return token
+
+
+def remove_session(token: str):
+    """Forget a login session (logout or expiry)."""
     try:
-        with open(SESSIONS_FILE, "w", encoding="utf-8") as f:
-            json.dump(sessions, f, indent=2, ensure_ascii=False)
+        with _json_file_lock(SESSIONS_FILE):
+            sessions = load_sessions()
+            if sessions.pop(token, None) is not None:
+                _write_json_file(SESSIONS_FILE, sessions)
     except Exception:
         pass
 
@@ -670,78 +1337,1206 @@ def load_unreadable():
         return {}
 
 
-# ---------- FAVOURITES ----------
+# ---------- BOOK REGISTRY ----------
+# sha256 of every file in books/ (byte-identical uploads are refused) and a
+# hash of its extracted text (a re-encoded copy of an indexed book is
+# skipped by the indexers before any embedding is paid for).
 
-def load_favourites():
-    if not os.path.exists(FAVOURITES_FILE):
-        return {}
-    try:
-        with open(FAVOURITES_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            if isinstance(data, dict):
-                return data
-            return {}
-    except json.JSONDecodeError:
-        return {}
-    except Exception:
-        return {}
+HASH_CHUNK_BYTES = 1024 * 1024
 
 
-def save_favourites(favs: dict):
-    try:
-        with open(FAVOURITES_FILE, "w", encoding="utf-8") as f:
-            json.dump(favs, f, indent=2, ensure_ascii=False)
-    except Exception:
-        pass
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+            digest.update(block)
+    return digest.hexdigest()
 
 
-# ---------- PRACTICE CANDIDATES / APPROVED PRACTICES ----------
+def book_text_hash(text: str) -> str:
+    """Hash of the extracted text, ignoring case and whitespace layout."""
+    return hashlib.sha256(" ".join((text or "").lower().split()).encode("utf-8")).hexdigest()
 
-def load_approved_practices():
-    if not os.path.exists(APPROVED_PRACTICES_FILE):
-        return {"mantra": [], "meditation": []}
-    try:
-        with open(APPROVED_PRACTICES_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            if isinstance(data, dict):
-                data.setdefault("mantra", [])
-                data.setdefault("meditation", [])
-                return data
-            return {"mantra": [], "meditation": []}
-    except json.JSONDecodeError:
-        return {"mantra": [], "meditation": []}
-    except Exception:
-        return {"mantra": [], "meditation": []}
 
+def _now_iso() -> str:
+    return datetime.datetime.now().isoformat(timespec="seconds")
 
-def save_approved_practices(data: dict):
+
+def register_book(file_name: str, sha256: str, size: int) -> bool:
+    """Record the content hash of a file in books/."""
     try:
-        with open(APPROVED_PRACTICES_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+        conn = sqlite3.connect(DB_FILE, timeout=DB_WRITE_TIMEOUT_SECONDS)
+        cur = conn.cursor()
+        path = os.path.join(BOOKS_DIR, file_name)
+        mtime = os.path.getmtime(path) if os.path.exists(path) else None
+        cur.execute(
+            """
+            INSERT INTO book_registry (file_name, sha256, size, mtime, added_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(file_name) DO UPDATE SET
+                sha256 = excluded.sha256,
+                size = excluded.size,
+                mtime = excluded.mtime,
+                text_hash = CASE WHEN book_registry.sha256 = excluded.sha256
+                                 THEN book_registry.text_hash END,
+                duplicate_of = CASE WHEN book_registry.sha256 = excluded.sha256
+                                    THEN book_registry.duplicate_of END
+            """,
+            (file_name, sha256, int(size), mtime, _now_iso()),
+        )
+        conn.commit()
+        return True
     except Exception:
-        pass
+        return False
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
 
 
-def load_practice_candidates():
-    if not os.path.exists(PRACTICE_CANDIDATES_FILE):
-        return []
+def sync_book_registry() -> dict:
+    """
+    Hash books added to books/ outside the uploader and forget removed ones.
+
+    Copies of a removed book lose their duplicate_of and are flagged for
+    the indexers (books_to_reindex()), since the removed book's chunks no
+    longer stand in for them. Files whose size and mtime match their row
+    are not re-read. Returns file_name -> sha256 for every book on disk.
+    """
+    on_disk = {}
+    for name in list_book_names():
+        path = os.path.join(BOOKS_DIR, name)
+        try:
+            on_disk[name] = (os.path.getsize(path), os.path.getmtime(path))
+        except OSError:
+            continue
+
+    known = {}
     try:
-        with open(PRACTICE_CANDIDATES_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            if isinstance(data, list):
-                return data
-            if isinstance(data, dict) and isinstance(data.get("candidates"), list):
-                return data["candidates"]
-            return []
-    except json.JSONDecodeError:
-        return []
+        conn = sqlite3.connect(DB_FILE, timeout=DB_WRITE_TIMEOUT_SECONDS)
+        cur = conn.cursor()
+        cur.execute("SELECT file_name, sha256, size, mtime FROM book_registry")
+        known = {row[0]: row[1:] for row in cur.fetchall()}
+        gone = [(name,) for name in known if name not in on_disk]
+        if gone:
+            cur.executemany("DELETE FROM book_registry WHERE file_name = ?", gone)
+            cur.executemany(
+                "UPDATE book_registry SET duplicate_of = NULL, reindex = 1 WHERE duplicate_of = ?",
+                gone,
+            )
+            conn.commit()
     except Exception:
-        return []
+        pass
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
 
+    hashes = {}
+    for name, (size, mtime) in on_disk.items():
+        row = known.get(name)
+        if row and row[0] and row[1] == size and row[2] == mtime:
+            hashes[name] = row[0]
+            continue
+        try:
+            sha = file_sha256(os.path.join(BOOKS_DIR, name))
+        except OSError:
+            continue
+        register_book(name, sha, size)
+        hashes[name] = sha
+    return hashes
 
-def save_practice_candidates(candidates: list):
+
+def find_book_by_sha256(sha256: str):
+    """File name of a book in books/ with this content hash, or None."""
     try:
-        with open(PRACTICE_CANDIDATES_FILE, "w", encoding="utf-8") as f:
-            json.dump(candidates, f, indent=2, ensure_ascii=False)
+        conn = sqlite3.connect(DB_FILE)
+        cur = conn.cursor()
+        cur.execute("SELECT file_name FROM book_registry WHERE sha256 = ? ORDER BY added_at", (sha256,))
+        for (name,) in cur.fetchall():
+            if os.path.exists(os.path.join(BOOKS_DIR, name)):
+                return name
+        return None
     except Exception:
-        pass
+        return None
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def record_book_text_hash(file_name: str, text_hash: str):
+    """
+    Store the extracted-text hash of a book.
+
+    Returns the name of an earlier book in books/ with the same text (the
+    book is then a duplicate and should not be indexed), else None.
+    """
+    try:
+        conn = sqlite3.connect(DB_FILE, timeout=DB_WRITE_TIMEOUT_SECONDS)
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute(
+            """
+            SELECT file_name FROM book_registry
+            WHERE text_hash = ? AND file_name != ? AND duplicate_of IS NULL
+            ORDER BY added_at, file_name
+            """,
+            (text_hash, file_name),
+        )
+        original = None
+        for (name,) in cur.fetchall():
+            if os.path.exists(os.path.join(BOOKS_DIR, name)):
+                original = name
+                break
+        cur.execute(
+            """
+            INSERT INTO book_registry (file_name, text_hash, duplicate_of, added_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(file_name) DO UPDATE SET
+                text_hash = excluded.text_hash,
+                duplicate_of = excluded.duplicate_of
+            """,
+            (file_name, text_hash, original, _now_iso()),
+        )
+        conn.commit()
+        return original
+    except Exception:
+        return None
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def books_to_reindex() -> list:
+    """Books flagged by sync_book_registry() that the indexers should index again."""
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        cur = conn.cursor()
+        cur.execute("SELECT file_name FROM book_registry WHERE reindex = 1 ORDER BY file_name")
+        return [row[0] for row in cur.fetchall()]
+    except Exception:
+        return []
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def mark_book_reindexed(file_name: str) -> bool:
+    """Clear the reindex flag once a book has been indexed again."""
+    try:
+        conn = sqlite3.connect(DB_FILE, timeout=DB_WRITE_TIMEOUT_SECONDS)
+        cur = conn.cursor()
+        cur.execute("UPDATE book_registry SET reindex = 0 WHERE file_name = ?", (file_name,))
+        conn.commit()
+        return True
+    except Exception:
+        return False
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def list_duplicate_books() -> dict:
+    """file_name -> the book it duplicates, for books skipped by the indexers."""
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT file_name, duplicate_of FROM book_registry WHERE duplicate_of IS NOT NULL ORDER BY file_name"
+        )
+        return {name: original for name, original in cur.fetchall()}
+    except Exception:
+        return {}
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+# ---------- FAVOURITES ----------
+
+def load_favourites():
+    if not os.path.exists(FAVOURITES_FILE):
+        return {}
+    try:
+        with open(FAVOURITES_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+            if isinstance(data, dict):
+                return data
+            return {}
+    except json.JSONDecodeError:
+        return {}
+    except Exception:
+        return {}
+
+
+def save_favourites(favs: dict):
+    try:
+        with _json_file_lock(FAVOURITES_FILE):
+            _write_json_file(FAVOURITES_FILE, favs)
+    except Exception:
+        pass
+
+
+def add_favourite(username: str, content: str, books_used: list) -> bool:
+    """Save a story to a user's favourites. False if it is already there or the write failed."""
+    try:
+        with _json_file_lock(FAVOURITES_FILE):
+            favs_all = load_favourites()
+            user_favs = favs_all.get(username, [])
+            if any(f.get("content") == content and f.get("books_used") == books_used for f in user_favs):
+                return False
+            user_favs.append(
+                {
+                    "content": content,
+                    "books_used": books_used,
+                    "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M"),
+                }
+            )
+            favs_all[username] = user_favs
+            _write_json_file(FAVOURITES_FILE, favs_all)
+            return True
+    except Exception:
+        return False
+
+
+def remove_favourite(username: str, index: int) -> bool:
+    """Remove the favourite at `index` in the user's list. False if there is none."""
+    try:
+        with _json_file_lock(FAVOURITES_FILE):
+            favs_all = load_favourites()
+            user_favs = favs_all.get(username, [])
+            if not 0 <= index < len(user_favs):
+                return False
+            del user_favs[index]
+            favs_all[username] = user_favs
+            _write_json_file(FAVOURITES_FILE, favs_all)
+            return True
+    except Exception:
+        return False
+
+
+# ---------- PRACTICE CANDIDATES / APPROVED PRACTICES ----------
+
+# Approved practices live in the approved_practices table (one row per
+# practice, full entry kept as JSON in `data`). The filter columns are
+# normalised the way the journey pages read them: deity "General" when
+# blank, level as int (mantras only), age_group one of child/adult/both.
+# Every write bumps store_versions so load_approved_practices() can keep
+# an in-process copy and only re-read after something changed.
+
+_PRACTICE_KINDS = ("mantra", "meditation")
+_approved_practices_cache = {"version": None, "data": None}
+
+
+def _read_approved_practices_file():
+    """Legacy approved_practices.json contents (used once by the migration)."""
+    if not os.path.exists(APPROVED_PRACTICES_FILE):
+        return {"mantra": [], "meditation": []}
+    try:
+        with open(APPROVED_PRACTICES_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+            if isinstance(data, dict):
+                data.setdefault("mantra", [])
+                data.setdefault("meditation", [])
+                return data
+            return {"mantra": [], "meditation": []}
+    except json.JSONDecodeError:
+        return {"mantra": [], "meditation": []}
+    except Exception:
+        return {"mantra": [], "meditation": []}
+
+
+def _bump_store_version(cur, name: str):
+    cur.execute(
+        """
+        INSERT INTO store_versions (name, version) VALUES (?, 1)
+        ON CONFLICT(name) DO UPDATE SET version = version + 1
+        """,
+        (name,),
+    )
+
+
+def _store_version(cur, name: str) -> int:
+    cur.execute("SELECT version FROM store_versions WHERE name = ?", (name,))
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+
+def _practice_columns(kind: str, entry: dict):
+    deity = (entry.get("deity") or "General").strip() or "General"
+    level = None
+    if kind == "mantra":
+        try:
+            level = int(entry.get("level", 1))
+        except Exception:
+            level = 1
+    age_group = (entry.get("age_group") or "both").lower()
+    if age_group not in ("child", "adult", "both"):
+        age_group = "both"
+    return deity, level, age_group
+
+
+def _insert_practice(cur, kind: str, entry: dict) -> int:
+    data = {k: v for k, v in entry.items() if k != "id"}
+    deity, level, age_group = _practice_columns(kind, data)
+    cur.execute(
+        """
+        INSERT INTO approved_practices (kind, deity, level, age_group, position, data)
+        VALUES (?, ?, ?, ?,
+                (SELECT COALESCE(MAX(position), 0) + 1 FROM approved_practices WHERE kind = ?),
+                ?)
+        """,
+        (kind, deity, level, age_group, kind, json.dumps(data, ensure_ascii=False)),
+    )
+    return cur.lastrowid
+
+
+def _practice_from_row(row) -> dict:
+    practice_id, data_json = row
+    try:
+        entry = json.loads(data_json) if data_json else {}
+    except Exception:
+        entry = {}
+    entry["id"] = practice_id
+    return entry
+
+
+def _practice_filters(kind: str, deity=None, level=None, age_group=None, level_range=None):
+    clauses = ["kind = ?"]
+    params = [kind]
+    if deity is not None:
+        clauses.append("deity = ?")
+        params.append(deity)
+    if level is not None:
+        clauses.append("level = ?")
+        params.append(int(level))
+    if level_range is not None:
+        # Inclusive (low, high); either end may be None.
+        low, high = level_range
+        if low is not None:
+            clauses.append("level >= ?")
+            params.append(int(low))
+        if high is not None:
+            clauses.append("level <= ?")
+            params.append(int(high))
+    if age_group in ("child", "adult"):
+        # Same rule as the journey pages: "both" is visible to everyone.
+        clauses.append("age_group IN ('both', ?)")
+        params.append(age_group)
+    return " AND ".join(clauses), params
+
+
+def load_approved_practices():
+    """
+    Return {"mantra": [...], "meditation": [...]} with every approved practice.
+
+    Each entry carries its row "id". The parsed rows are cached in-process
+    and re-read only when the store version changes.
+    """
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        cur = conn.cursor()
+        version = _store_version(cur, "approved_practices")
+        cached = _approved_practices_cache
+        if cached["version"] != version or cached["data"] is None:
+            data = {kind: [] for kind in _PRACTICE_KINDS}
+            cur.execute(
+                """
+                SELECT kind, id, data FROM approved_practices
+                ORDER BY kind, position ASC, id ASC
+                """
+            )
+            for kind, practice_id, data_json in cur.fetchall():
+                data.setdefault(kind, []).append(_practice_from_row((practice_id, data_json)))
+            cached["data"] = data
+            cached["version"] = version
+        data = cached["data"]
+    except Exception:
+        data = {kind: [] for kind in _PRACTICE_KINDS}
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+    # Hand out copies so callers editing an entry cannot touch the cache.
+    return {kind: [dict(e) for e in items] for kind, items in data.items()}
+
+
+def save_approved_practices(data: dict):
+    """Replace all approved practices with `data` (bulk import / legacy callers)."""
+    try:
+        conn = sqlite3.connect(DB_FILE, timeout=DB_WRITE_TIMEOUT_SECONDS)
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute("DELETE FROM approved_practices")
+        for kind in _PRACTICE_KINDS:
+            for entry in (data or {}).get(kind) or []:
+                if isinstance(entry, dict):
+                    _insert_practice(cur, kind, entry)
+        _bump_store_version(cur, "approved_practices")
+        conn.commit()
+    except Exception:
+        pass
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def query_approved_practices(
+    kind: str, deity=None, level=None, age_group=None, limit=None, offset: int = 0, level_range=None
+):
+    """Approved practices of one kind filtered in SQL, in display order."""
+    where, params = _practice_filters(kind, deity, level, age_group, level_range)
+    sql = f"SELECT id, data FROM approved_practices WHERE {where} ORDER BY position ASC, id ASC"
+    if limit is not None:
+        sql += " LIMIT ? OFFSET ?"
+        params += [int(limit), int(offset)]
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        rows = cur.fetchall()
+    except Exception:
+        rows = []
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+    return [_practice_from_row(r) for r in rows]
+
+
+def count_approved_practices(kind: str, deity=None, level=None, age_group=None, level_range=None) -> int:
+    where, params = _practice_filters(kind, deity, level, age_group, level_range)
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        cur = conn.cursor()
+        cur.execute(f"SELECT COUNT(*) FROM approved_practices WHERE {where}", params)
+        count = cur.fetchone()[0]
+    except Exception:
+        count = 0
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+    return count
+
+
+def get_approved_practice_at(kind: str, position: int):
+    """Return the practice at 1-based display position (meditation levels), or None."""
+    if not position or position < 1:
+        return None
+    items = query_approved_practices(kind, limit=1, offset=position - 1)
+    return items[0] if items else None
+
+
+def list_practice_deities(kind: str = "mantra", age_group=None):
+    """Distinct deity names for a kind, case-insensitively sorted."""
+    where, params = _practice_filters(kind, age_group=age_group)
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        cur = conn.cursor()
+        cur.execute(
+            f"SELECT DISTINCT deity FROM approved_practices WHERE {where} ORDER BY deity COLLATE NOCASE ASC",
+            params,
+        )
+        rows = cur.fetchall()
+    except Exception:
+        rows = []
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+    return [r[0] for r in rows if r and r[0]]
+
+
+def list_practice_levels(kind: str, deity=None, age_group=None):
+    """Distinct levels (ascending) for a kind/deity."""
+    where, params = _practice_filters(kind, deity=deity, age_group=age_group)
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        cur = conn.cursor()
+        cur.execute(
+            f"SELECT DISTINCT level FROM approved_practices WHERE {where} AND level IS NOT NULL ORDER BY level ASC",
+            params,
+        )
+        rows = cur.fetchall()
+    except Exception:
+        rows = []
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+    return [r[0] for r in rows]
+
+
+def add_approved_practice(kind: str, entry: dict):
+    """Append one practice of `kind`. Returns the new id or None on error."""
+    if kind not in _PRACTICE_KINDS or not isinstance(entry, dict):
+        return None
+    try:
+        conn = sqlite3.connect(DB_FILE, timeout=DB_WRITE_TIMEOUT_SECONDS)
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        practice_id = _insert_practice(cur, kind, entry)
+        _bump_store_version(cur, "approved_practices")
+        conn.commit()
+    except Exception:
+        practice_id = None
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+    return practice_id
+
+
+def update_approved_practice(practice_id: int, fields: dict) -> bool:
+    """Merge `fields` into one practice and refresh its filter columns."""
+    if not practice_id or not fields:
+        return False
+    try:
+        conn = sqlite3.connect(DB_FILE, timeout=DB_WRITE_TIMEOUT_SECONDS)
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute("SELECT kind, data FROM approved_practices WHERE id = ?", (practice_id,))
+        row = cur.fetchone()
+        if not row:
+            return False
+        kind = row[0]
+        entry = _practice_from_row((practice_id, row[1]))
+        entry.pop("id", None)
+        entry.update({k: v for k, v in fields.items() if k != "id"})
+        deity, level, age_group = _practice_columns(kind, entry)
+        cur.execute(
+            """
+            UPDATE approved_practices
+            SET deity = ?, level = ?, age_group = ?, data = ?
+            WHERE id = ?
+            """,
+            (deity, level, age_group, json.dumps(entry, ensure_ascii=False), practice_id),
+        )
+        _bump_store_version(cur, "approved_practices")
+        conn.commit()
+        return True
+    except Exception:
+        return False
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def delete_approved_practice(practice_id: int) -> bool:
+    if not practice_id:
+        return False
+    try:
+        conn = sqlite3.connect(DB_FILE, timeout=DB_WRITE_TIMEOUT_SECONDS)
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute("DELETE FROM approved_practices WHERE id = ?", (practice_id,))
+        deleted = cur.rowcount == 1
+        _bump_store_version(cur, "approved_practices")
+        conn.commit()
+        return deleted
+    except Exception:
+        return False
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+# Search phrases that describe each practice kind. The interactive scan
+# queries with them; the offline miner averages them into prototype vectors.
+PRACTICE_KEYWORDS = {
+    "mantra": [
+        "mantra", "japa", "chanting", "holy name", "nama", "stotra", "kirtan",
+    ],
+    "meditation": [
+        "meditation", "dhyana", "concentration", "inner silence",
+        "awareness of breath", "quiet mind", "watching thoughts",
+    ],
+}
+
+# Stored candidate text is cut to this many characters.
+CANDIDATE_SNIPPET_CHARS = 800
+
+
+def practice_candidate_snippet(text: str) -> str:
+    """The form in which a passage is stored as a practice candidate."""
+    text = (text or "").strip()
+    if len(text) <= CANDIDATE_SNIPPET_CHARS:
+        return text
+    return text[:CANDIDATE_SNIPPET_CHARS] + " ..."
+
+
+def practice_text_hash(text: str) -> str:
+    """Hash of a practice text, for matching candidates against approved practices."""
+    return hashlib.sha1((text or "").encode("utf-8")).hexdigest()
+
+
+def practice_candidate_key(kind: str, source: str, text: str) -> str:
+    """Short stable hash identifying a candidate by kind, source and stored text."""
+    h = hashlib.sha1()
+    for part in (kind, source, text):
+        h.update((part or "").encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+# Candidates live in the practice_candidates table, keyed by
+# practice_candidate_key(). Clustering fields come from near_duplicates;
+# cluster_size is stored so a page of representatives can say how many
+# similar passages each one stands for without loading the rest.
+
+_CANDIDATE_COLUMNS = ("id", "kind", "source", "text", "approved", "cluster", "representative", "score")
+
+
+def _read_practice_candidates_file():
+    """Legacy practice_candidates.json contents (used once by the migration)."""
+    if not os.path.exists(PRACTICE_CANDIDATES_FILE):
+        return []
+    try:
+        with open(PRACTICE_CANDIDATES_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+            if isinstance(data, list):
+                return data
+            if isinstance(data, dict) and isinstance(data.get("candidates"), list):
+                return data["candidates"]
+            return []
+    except json.JSONDecodeError:
+        return []
+    except Exception:
+        return []
+
+
+def _write_candidates(cur, candidates):
+    """Insert new `candidates` by key; existing rows only get their cluster fields."""
+    merged = {}
+    for c in candidates or []:
+        if not isinstance(c, dict):
+            continue
+        kind = c.get("kind") or "unknown"
+        source = c.get("source") or ""
+        text = c.get("text") or ""
+        key = practice_candidate_key(kind, source, text)
+        extra = {k: v for k, v in c.items() if k not in _CANDIDATE_COLUMNS and k != "cluster_size"}
+        row = merged.get(key)
+        if row is None:
+            merged[key] = {
+                "kind": kind,
+                "source": source,
+                "text": text,
+                "approved": bool(c.get("approved")),
+                "cluster": c.get("cluster"),
+                "representative": c.get("representative") is not False,
+                "score": c.get("score"),
+                "extra": extra,
+            }
+        else:
+            # Exact repeats of one passage: keep the strongest flags.
+            row["approved"] = row["approved"] or bool(c.get("approved"))
+            row["representative"] = row["representative"] or c.get("representative") is not False
+            row["cluster"] = row["cluster"] or c.get("cluster")
+
+    sizes = {}
+    for row in merged.values():
+        if row["cluster"]:
+            sizes[row["cluster"]] = sizes.get(row["cluster"], 0) + 1
+
+    rows = {
+        key: (
+            key,
+            row["kind"],
+            row["source"],
+            os.path.basename(row["source"]),
+            row["text"],
+            1 if row["approved"] else 0,
+            row["cluster"],
+            1 if row["representative"] else 0,
+            sizes.get(row["cluster"], 1),
+            row["score"],
+            json.dumps(row["extra"], ensure_ascii=False) if row["extra"] else None,
+        )
+        for key, row in merged.items()
+    }
+
+    # Existing rows only take the cluster fields: approval and score belong
+    # to whoever wrote them, so a scan that overlaps an approval (or loaded
+    # the list before it) cannot undo it, and rows it did not list survive.
+    cur.executemany(
+        """
+        INSERT INTO practice_candidates
+            (cand_key, kind, source, source_name, text, approved,
+             cluster, representative, cluster_size, score, data)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(cand_key) DO UPDATE SET
+            cluster = excluded.cluster,
+            representative = excluded.representative,
+            cluster_size = excluded.cluster_size
+        """,
+        list(rows.values()),
+    )
+
+
+def _candidate_from_row(row) -> dict:
+    cand_id, kind, source, text, approved, cluster, representative, cluster_size, score, data_json = row
+    try:
+        cand = json.loads(data_json) if data_json else {}
+    except Exception:
+        cand = {}
+    cand.update(
+        {
+            "id": cand_id,
+            "kind": kind,
+            "source": source,
+            "text": text,
+            "approved": bool(approved),
+            "cluster": cluster,
+            "representative": bool(representative),
+            "cluster_size": cluster_size,
+        }
+    )
+    if score is not None:
+        cand["score"] = score
+    return cand
+
+
+_CANDIDATE_SELECT = """
+    SELECT id, kind, source, text, approved, cluster, representative, cluster_size, score, data
+    FROM practice_candidates
+"""
+
+
+def load_practice_candidates():
+    """Every stored candidate, in the order they were collected."""
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        cur = conn.cursor()
+        cur.execute(_CANDIDATE_SELECT + " ORDER BY id ASC")
+        rows = cur.fetchall()
+    except Exception:
+        rows = []
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+    return [_candidate_from_row(r) for r in rows]
+
+
+def save_practice_candidates(candidates: list):
+    """
+    Store `candidates` (matched by key, so ids survive): new ones are added,
+    stored ones only take the cluster fields. Nothing is deleted or
+    un-approved; approvals go through approve_practice_candidates().
+    """
+    try:
+        conn = sqlite3.connect(DB_FILE, timeout=DB_WRITE_TIMEOUT_SECONDS)
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        _write_candidates(cur, candidates)
+        conn.commit()
+    except Exception:
+        pass
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def query_practice_candidates(
+    kind=None,
+    approved: bool = False,
+    source_names=None,
+    search=None,
+    representatives_only: bool = True,
+    limit: int = 25,
+    offset: int = 0,
+):
+    """
+    One page of candidates filtered in SQL.
+
+    source_names: optional list of book file names (basename of source).
+    search: optional case-insensitive substring of the text.
+    Returns (rows, total) where total counts every match, not just the page.
+    """
+    clauses = ["approved = ?"]
+    params = [1 if approved else 0]
+    if representatives_only:
+        clauses.append("representative = 1")
+    if kind:
+        clauses.append("kind = ?")
+        params.append(kind)
+    if source_names:
+        names = list(source_names)
+        clauses.append(f"source_name IN ({', '.join('?' for _ in names)})")
+        params.extend(names)
+    if search and search.strip():
+        clauses.append("text LIKE ? ESCAPE '\\'")
+        term = search.strip().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        params.append(f"%{term}%")
+    where = " AND ".join(clauses)
+
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        cur = conn.cursor()
+        cur.execute(f"SELECT COUNT(*) FROM practice_candidates WHERE {where}", params)
+        total = cur.fetchone()[0]
+        cur.execute(
+            _CANDIDATE_SELECT + f" WHERE {where} ORDER BY id ASC LIMIT ? OFFSET ?",
+            params + [int(limit), int(offset)],
+        )
+        rows = cur.fetchall()
+    except Exception:
+        rows, total = [], 0
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+    return [_candidate_from_row(r) for r in rows], total
+
+
+def approve_practice_candidates(candidate_ids) -> int:
+    """
+    Approve several candidates in one transaction.
+
+    Each pending mantra/meditation candidate becomes an approved practice
+    and is marked approved. Returns how many were approved.
+    """
+    ids = [int(i) for i in candidate_ids or []]
+    if not ids:
+        return 0
+    approved = 0
+    try:
+        conn = sqlite3.connect(DB_FILE, timeout=DB_WRITE_TIMEOUT_SECONDS)
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute(
+            f"""
+            SELECT id, kind, source, text FROM practice_candidates
+            WHERE approved = 0 AND id IN ({', '.join('?' for _ in ids)})
+            ORDER BY id ASC
+            """,
+            ids,
+        )
+        for cand_id, kind, source, text in cur.fetchall():
+            if kind not in _PRACTICE_KINDS:
+                continue
+            _insert_practice(cur, kind, {"text": text or "", "source": source or ""})
+            cur.execute("UPDATE practice_candidates SET approved = 1 WHERE id = ?", (cand_id,))
+            approved += 1
+        if approved:
+            _bump_store_version(cur, "approved_practices")
+        conn.commit()
+    except Exception:
+        approved = 0
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+    return approved
+
+
+# ---------- ONLINE PRACTICE CACHE ----------
+
+def get_cached_online_practices(cache_key: str):
+    """Cached practice list for a request key, or None if never fetched."""
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        cur = conn.cursor()
+        cur.execute("SELECT practices FROM online_practice_cache WHERE cache_key = ?", (cache_key,))
+        row = cur.fetchone()
+        return json.loads(row[0]) if row else None
+    except Exception:
+        return None
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def save_cached_online_practices(
+    cache_key: str, deity: str, scope: str, level: str, prompt_version: int, practices: list
+) -> bool:
+    try:
+        conn = sqlite3.connect(DB_FILE, timeout=DB_WRITE_TIMEOUT_SECONDS)
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO online_practice_cache
+                (cache_key, deity, scope, level, prompt_version, practices, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(cache_key) DO UPDATE SET
+                practices = excluded.practices,
+                created_at = excluded.created_at
+            """,
+            (
+                cache_key,
+                deity,
+                scope,
+                level,
+                int(prompt_version),
+                json.dumps(practices, ensure_ascii=False),
+                datetime.datetime.now().isoformat(timespec="seconds"),
+            ),
+        )
+        conn.commit()
+        return True
+    except Exception:
+        return False
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+# ---------- MEDIA DERIVATIVES ----------
+
+def get_media_derivative(original_path: str):
+    """Row for an uploaded media file, or None if the worker has not seen it."""
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        cur = conn.cursor()
+        cur.execute("SELECT * FROM media_derivatives WHERE original_path = ?", (original_path,))
+        rows = _fetchall_dict(cur)
+        return rows[0] if rows else None
+    except Exception:
+        return None
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def save_media_derivative(
+    original_path: str,
+    size: int,
+    mtime: float,
+    sha256: str,
+    kind: str,
+    derivative_path=None,
+    status: str = "ok",
+    error=None,
+) -> bool:
+    try:
+        conn = sqlite3.connect(DB_FILE, timeout=DB_WRITE_TIMEOUT_SECONDS)
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO media_derivatives
+                (original_path, size, mtime, sha256, kind, derivative_path, status, error, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(original_path) DO UPDATE SET
+                size = excluded.size,
+                mtime = excluded.mtime,
+                sha256 = excluded.sha256,
+                kind = excluded.kind,
+                derivative_path = excluded.derivative_path,
+                status = excluded.status,
+                error = excluded.error,
+                updated_at = excluded.updated_at
+            """,
+            (original_path, int(size), float(mtime), sha256, kind, derivative_path, status, error, _now_iso()),
+        )
+        conn.commit()
+        return True
+    except Exception:
+        return False
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def list_media_derivatives():
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        cur = conn.cursor()
+        cur.execute("SELECT * FROM media_derivatives ORDER BY original_path")
+        return _fetchall_dict(cur)
+    except Exception:
+        return []
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+# ---------- CHAT TURNS ----------
+# Every dharma chat message, keyed by a per-session conversation id. The
+# session keeps only the latest few; older ones are paged back in from
+# here on request and summarised for the answer prompt. Message text is
+# encrypted like reflections, and turns older than CHAT_RETENTION_DAYS are
+# pruned at startup and then at most once per CHAT_PRUNE_INTERVAL_SECONDS.
+
+CHAT_RETENTION_DAYS = 30
+CHAT_PRUNE_INTERVAL_SECONDS = 3600
+_CHAT_JSON_FIELDS = ("books_used", "passages", "metas")
+_last_chat_prune = {"at": None}
+
+
+def _encrypt_chat_content(content: str) -> str:
+    try:
+        from security_utils import encrypt_field
+
+        return encrypt_field(content)
+    except Exception:
+        return content
+
+
+def _decrypt_chat_content(content: str) -> str:
+    try:
+        from security_utils import decrypt_field
+
+        return decrypt_field(content)
+    except Exception:
+        return content
+
+
+def _chat_turn_from_row(row: dict) -> dict:
+    turn = dict(row)
+    turn["content"] = _decrypt_chat_content(turn.get("content") or "")
+    for field in _CHAT_JSON_FIELDS:
+        try:
+            turn[field] = json.loads(turn[field]) if turn[field] else []
+        except (TypeError, ValueError):
+            turn[field] = []
+    return turn
+
+
+def save_chat_turn(conversation_id: str, message: dict, user_id: str = None):
+    """Store one chat message (role, content, passages, ...). Returns its id, or None on error."""
+    _maybe_prune_chat_turns()
+    try:
+        conn = sqlite3.connect(DB_FILE, timeout=DB_WRITE_TIMEOUT_SECONDS)
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO chat_turns
+                (conversation_id, user_id, role, content, books_used, passages, metas, image_url, style, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                conversation_id,
+                user_id,
+                message.get("role") or "user",
+                _encrypt_chat_content(message.get("content") or ""),
+                json.dumps(message.get("books_used") or [], ensure_ascii=False),
+                json.dumps(message.get("passages") or [], ensure_ascii=False),
+                json.dumps(message.get("metas") or [], ensure_ascii=False),
+                message.get("image_url"),
+                message.get("style"),
+                _now_iso(),
+            ),
+        )
+        conn.commit()
+        return cur.lastrowid
+    except Exception:
+        return None
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def load_chat_turns(conversation_id: str, before_id: int = None, limit: int = 10) -> list:
+    """The `limit` turns just before `before_id` (or the latest ones), oldest first."""
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT * FROM chat_turns
+            WHERE conversation_id = ? AND id < ?
+            ORDER BY id DESC
+            LIMIT ?
+            """,
+            (conversation_id, before_id if before_id is not None else 2**63 - 1, int(limit)),
+        )
+        return [_chat_turn_from_row(r) for r in reversed(_fetchall_dict(cur))]
+    except Exception:
+        return []
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def count_chat_turns(conversation_id: str, before_id: int = None) -> int:
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT COUNT(*) FROM chat_turns WHERE conversation_id = ? AND id < ?",
+            (conversation_id, before_id if before_id is not None else 2**63 - 1),
+        )
+        return cur.fetchone()[0]
+    except Exception:
+        return 0
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def prune_chat_turns(days: int = CHAT_RETENTION_DAYS) -> int:
+    """Delete turns older than `days`. Returns the number removed (-1 on error)."""
+    cutoff = (datetime.datetime.now() - datetime.timedelta(days=days)).isoformat()
+    try:
+        conn = sqlite3.connect(DB_FILE, timeout=DB_WRITE_TIMEOUT_SECONDS)
+        cur = conn.cursor()
+        cur.execute("DELETE FROM chat_turns WHERE created_at < ?", (cutoff,))
+        conn.commit()
+        _last_chat_prune["at"] = datetime.datetime.now()
+        return cur.rowcount
+    except Exception:
+        return -1
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def _maybe_prune_chat_turns():
+    """Prune expired turns if the last prune in this process is over an interval old."""
+    last = _last_chat_prune["at"]
+    if last and datetime.datetime.now() - last < datetime.timedelta(seconds=CHAT_PRUNE_INTERVAL_SECONDS):
+        return
+    prune_chat_turns(CHAT_RETENTION_DAYS)
+
+
+# Ensure DB exists. Runs last so every helper the migrations use is defined.
+init_db()
@@ -0,0 +1,90 @@
+"""
+Maintenance commands for dharma_app.db.
+
+Usage:
+    python db_maintenance.py check-progress     # report counter drift only
+    python db_maintenance.py rebuild-progress   # recompute level counters
+    python db_maintenance.py rebuild-stats      # recompute completion leaderboard
+    python db_maintenance.py cluster-candidates # group near-duplicate practice candidates
+    python db_maintenance.py prune-chats        # drop chat turns older than CHAT_RETENTION_DAYS
+"""
+
+import argparse
+import sys
+
+import database
+
+
+def cmd_progress(check_only: bool) -> int:
+    result = database.rebuild_level_progress(check_only=check_only)
+    if result["error"]:
+        print(f"❌ Could not read the level counters: {result['error']}")
+        return 2
+    print(f"Level totals out of date:   {result['level_totals']}")
+    print(f"User level rows out of date: {result['user_levels']}")
+    if result["rebuilt"]:
+        print("✅ Level counters rebuilt from user_progress and mantras.")
+        return 0
+    drift = result["level_totals"] + result["user_levels"]
+    if check_only:
+        return 1 if drift else 0
+    print("❌ Rebuild failed.")
+    return 2
+
+
+def cmd_stats() -> int:
+    if database.rebuild_completion_stats():
+        print("✅ Completion leaderboard and daily rollup rebuilt.")
+        return 0
+    print("❌ Rebuild failed.")
+    return 2
+
+
+def cmd_cluster_candidates() -> int:
+    from near_duplicates import cluster_candidates, cluster_sizes
+
+    candidates = database.load_practice_candidates()
+    cluster_candidates(candidates)
+    database.save_practice_candidates(candidates)
+    sizes = cluster_sizes(candidates)
+    merged = sum(1 for n in sizes.values() if n > 1)
+    print(f"Candidates: {len(candidates)}")
+    print(f"Clusters:   {len(sizes)} ({merged} with near-duplicates)")
+    return 0
+
+
+def cmd_prune_chats(days: int) -> int:
+    removed = database.prune_chat_turns(days)
+    if removed < 0:
+        print("❌ Pruning failed.")
+        return 2
+    print(f"✅ Removed {removed} chat turns older than {days} days.")
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("check-progress", help="compare level counters with user_progress")
+    sub.add_parser("rebuild-progress", help="recompute level counters from user_progress")
+    sub.add_parser("rebuild-stats", help="recompute completion counts and daily rollup")
+    sub.add_parser("cluster-candidates", help="group near-duplicate practice candidates")
+    prune = sub.add_parser("prune-chats", help="delete old dharma chat turns")
+    prune.add_argument("--days", type=int, default=database.CHAT_RETENTION_DAYS)
+    args = parser.parse_args()
+
+    if args.command == "check-progress":
+        return cmd_progress(check_only=True)
+    if args.command == "rebuild-progress":
+        return cmd_progress(check_only=False)
+    if args.command == "rebuild-stats":
+        return cmd_stats()
+    if args.command == "cluster-candidates":
+        return cmd_cluster_candidates()
+    if args.command == "prune-chats":
+        return cmd_prune_chats(args.days)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
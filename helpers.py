@@ -2,6 +2,7 @@ import datetime
 import json
 import os
 import streamlit as st
+from database import BOOKS_DIR, list_book_names
 from security_utils import encrypt_field, decrypt_field
 
 
@@ -143,3 +144,30 @@ def get_micro_practice(age_group):
 def get_current_username():
     profile = st.session_state.get("user_profile") or {}
     return profile.get("username") or st.session_state.get("user_name")
+
+
+def rerun_fragment():
+    """
+    Rerun only the fragment being drawn. Outside a fragment rerun (a full
+    app run, or AppTest, which has no fragment reruns) rerun the app.
+    """
+    from streamlit.errors import StreamlitAPIException
+
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
+
+
+@st.cache_data(show_spinner=False)
+def _book_names(books_dir_mtime: float):
+    return list_book_names()
+
+
+def cached_book_names():
+    """list_book_names(), listed again only when a file is added to or removed from books/."""
+    try:
+        mtime = os.stat(BOOKS_DIR).st_mtime
+    except OSError:
+        mtime = 0.0
+    return _book_names(mtime)
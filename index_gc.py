@@ -0,0 +1,237 @@
+"""
+Reconcile the Chroma index with the books actually on disk.
+
+The indexers only ever add or replace a book's chunks, so chunks of books
+that were deleted or renamed stay in the index, as do chunks of a book
+left in a shard it was moved out of. This pass, which changes shards
+through a staged version like the indexers do:
+  - lists the distinct sources in every active shard collection,
+  - deletes, in batches, the chunks of books no longer in books/ or not
+    assigned to that shard (orphans),
+  - rewrites absolute "source" paths from older runs to the stable
+    "books/<file name>" key,
+  - drops index_state.json / unreadable_books.json entries for missing files,
+and reports how much was reclaimed.
+
+Usage:
+    python index_gc.py               # reconcile and report
+    python index_gc.py --dry-run     # report what would be removed
+    python index_gc.py --force       # also when books/ is empty (removes everything)
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+
+from index_layout import (
+    CHROMA_PATH,
+    index_lock,
+    load_manifest,
+    open_collections,
+    publish_shard,
+    shard_for_book,
+    stage_shard,
+)
+from index_metadata import BOOKS_DIR, source_key
+from vector_store import backend_name, rebuild_stores
+
+INDEX_STATE_FILE = "index_state.json"
+UNREADABLE_FILE = "unreadable_books.json"
+
+DEFAULT_BATCH_SIZE = 500
+
+
+def books_on_disk(books_dir: str = BOOKS_DIR) -> set:
+    """File names of the books the indexers would index."""
+    paths = glob.glob(os.path.join(books_dir, "*.pdf")) + glob.glob(os.path.join(books_dir, "*.epub"))
+    return {os.path.basename(p) for p in paths}
+
+
+def scan_sources(col, page_size: int = DEFAULT_BATCH_SIZE) -> dict:
+    """source -> chunk ids, from metadata only (no documents or embeddings)."""
+    sources = {}
+    offset = 0
+    total = col.count()
+    while offset < total:
+        page = col.get(limit=page_size, offset=offset, include=["metadatas"])
+        ids = page.get("ids") or []
+        if not ids:
+            break
+        for cid, meta in zip(ids, page.get("metadatas") or [{}] * len(ids)):
+            sources.setdefault((meta or {}).get("source", ""), []).append(cid)
+        offset += len(ids)
+    return sources
+
+
+def _chunk_bytes(page: dict) -> int:
+    """Approximate stored size of the chunks in a col.get page."""
+    size = 0
+    for doc in page.get("documents") or []:
+        size += len((doc or "").encode("utf-8"))
+    for meta in page.get("metadatas") or []:
+        size += len(json.dumps(meta or {}))
+    embeddings = page.get("embeddings")
+    if embeddings is not None:
+        size += sum(len(e) * 4 for e in embeddings)
+    return size
+
+
+def reconcile_collection(col, shard: str, present: set, manifest: dict, batch_size: int, dry_run: bool) -> dict:
+    """
+    Delete orphans and rekey sources in `col`. The report's "books" lists
+    every book touched, or is None when some chunk could not be matched by
+    book (no source, or an absolute path from another deployment).
+    """
+    report = {"orphan_books": [], "deleted_chunks": 0, "deleted_bytes": 0, "rekeyed_chunks": 0, "books": []}
+    for source, ids in sorted(scan_sources(col, batch_size).items()):
+        book = os.path.basename(source) if source else ""
+        touched = book not in present or shard_for_book(book, manifest) != shard or source != source_key(book)
+        if touched and report["books"] is not None:
+            # A reused staged version is synced by book_where(), which only
+            # knows the file name and this deployment's absolute path.
+            if not book or source not in (source_key(book), os.path.abspath(os.path.join(BOOKS_DIR, book))):
+                report["books"] = None
+            elif book not in report["books"]:
+                report["books"].append(book)
+        if book not in present or shard_for_book(book, manifest) != shard:
+            if (book or "(no source)") not in report["orphan_books"]:
+                report["orphan_books"].append(book or "(no source)")
+            for start in range(0, len(ids), batch_size):
+                batch = ids[start:start + batch_size]
+                page = col.get(ids=batch, include=["documents", "metadatas", "embeddings"])
+                report["deleted_bytes"] += _chunk_bytes(page)
+                report["deleted_chunks"] += len(batch)
+                if not dry_run:
+                    col.delete(ids=batch)
+            continue
+
+        key = source_key(book)
+        if source != key:
+            for start in range(0, len(ids), batch_size):
+                batch = ids[start:start + batch_size]
+                if not dry_run:
+                    page = col.get(ids=batch, include=["metadatas"])
+                    metas = [dict(m or {}, source=key, book=book) for m in page.get("metadatas") or []]
+                    col.update(ids=page.get("ids"), metadatas=metas)
+                report["rekeyed_chunks"] += len(batch)
+    return report
+
+
+def prune_state_file(path: str, present: set, dry_run: bool) -> int:
+    """Drop entries (keyed by book path) for files that no longer exist."""
+    if not os.path.exists(path):
+        return 0
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception:
+        return 0
+    stale = [k for k in data if os.path.basename(k) not in present]
+    if stale and not dry_run:
+        for k in stale:
+            del data[k]
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp, path)
+    return len(stale)
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def reconcile(
+    chroma_client,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    dry_run: bool = False,
+    books_dir: str = BOOKS_DIR,
+    force: bool = False,
+):
+    """
+    Reconcile every active shard. Returns {shard: report}.
+
+    Shards with something to remove or rekey are changed in a staged
+    version and published like a reindex (the quantized exports are
+    rebuilt too). Raises RuntimeError when books_dir is missing or has no
+    books, since every chunk would look orphaned, unless force=True.
+    """
+    present = books_on_disk(books_dir)
+    if not present and not force:
+        raise RuntimeError(
+            f"No books found in {books_dir}/ (missing, empty or not mounted); "
+            "refusing to remove every chunk. Use --force if the library really is empty."
+        )
+    manifest = load_manifest()
+    reports = {}
+    changed = []
+    for shard, col in open_collections(chroma_client, manifest).items():
+        # Look first (metadata only) so clean shards are not staged at all.
+        report = reconcile_collection(col, shard, present, manifest, batch_size, dry_run=True)
+        if dry_run or not (report["deleted_chunks"] or report["rekeyed_chunks"]):
+            reports[shard] = report
+            continue
+        with index_lock():
+            name, staged = stage_shard(chroma_client, shard)
+            report = reconcile_collection(staged, shard, present, manifest, batch_size, dry_run=False)
+            publish_shard(chroma_client, shard, name, books=report["books"])
+        reports[shard] = report
+        changed.append(shard)
+
+    if changed and backend_name() == "quantized":
+        rebuild_stores(chroma_client, shards=changed)
+    return reports
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="chunks per get/delete call")
+    parser.add_argument("--dry-run", action="store_true", help="report only, change nothing")
+    parser.add_argument("--force", action="store_true", help=f"run even when {BOOKS_DIR}/ is missing or empty")
+    args = parser.parse_args()
+
+    import chromadb
+
+    before = _dir_size(CHROMA_PATH)
+    chroma_client = chromadb.PersistentClient(path=CHROMA_PATH)
+    try:
+        reports = reconcile(chroma_client, args.batch_size, args.dry_run, force=args.force)
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        return 1
+
+    deleted = sum(r["deleted_chunks"] for r in reports.values())
+    deleted_bytes = sum(r["deleted_bytes"] for r in reports.values())
+    for shard, r in reports.items():
+        print(f"{shard}: {r['deleted_chunks']:,} orphan chunks, {r['rekeyed_chunks']:,} source keys rewritten")
+        for book in r["orphan_books"]:
+            print(f"   - {book}")
+
+    present = books_on_disk()
+    for path in (INDEX_STATE_FILE, UNREADABLE_FILE):
+        n = prune_state_file(path, present, args.dry_run)
+        if n:
+            print(f"{path}: {n} entries for missing books")
+
+    verb = "Would remove" if args.dry_run else "Removed"
+    print(f"\n{verb} {deleted:,} chunks (~{deleted_bytes / 1e6:.1f} MB of text, metadata and vectors).")
+    if not args.dry_run:
+        after = _dir_size(CHROMA_PATH)
+        print(f"{CHROMA_PATH}: {before / 1e6:.1f} MB -> {after / 1e6:.1f} MB on disk.")
+        if deleted and after >= before:
+            # SQLite reuses freed pages instead of shrinking the file.
+            print("Freed pages are reused by later inserts; run `chroma utils vacuum` to shrink the files now.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
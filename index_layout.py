@@ -0,0 +1,489 @@
+"""
+Layout of the Chroma index: which collection (shard) holds which book.
+
+By default everything lives in the one `saint_books` collection (the
+"main" shard). Books can be assigned to other shards, e.g. by language,
+tradition or book group, in shard_manifest.json:
+
+    {
+      "default_shard": "main",
+      "books": {"Shakti and Shakta.epub": "tantra", "Gita_hi.pdf": "hindi"}
+    }
+
+Each shard is its own collection (`saint_books__<shard>`; "main" keeps the
+original name), so reindexing a book deletes and re-adds chunks in that
+shard only, and retrieval queries all shards in parallel and merges.
+
+Reindexing never edits the collection queries are served from. The
+indexers stage a copy of the shard in a versioned collection
+(`<shard collection>__v<n>`), rebuild books there, and then flip the
+shard's entry in active_index.json (written with os.replace). Readers only
+ever see a complete version; the previous versions are kept for rollback:
+
+    {"shards": {"main": {"active": "saint_books__v4",
+                         "previous": ["saint_books__v3", "saint_books"],
+                         "changes": {"saint_books__v4": ["Gita.pdf"],
+                                     "saint_books__v3": ["Upanishads.epub"]},
+                         "next_version": 5}}}
+
+"changes" records the books each version rebuilt, so the next stage can
+reuse the oldest kept version and copy only those books into it instead
+of copying the whole shard. Staging, publishing and rollback run under
+index_lock() (a lock file), so concurrent indexers take turns.
+
+Shards without an entry are served from their unversioned collection.
+
+Usage:
+    python index_layout.py show                     # shards, collections and books
+    python index_layout.py assign <book> <shard>    # move a book (reindex it afterwards)
+    python index_layout.py versions                 # active and kept versions per shard
+    python index_layout.py rollback <shard>         # serve the previous version again
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import re
+import sys
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: indexers are not run concurrently there.
+    fcntl = None
+
+CHROMA_PATH = "./chroma_db"
+COLLECTION_NAME = "saint_books"
+SHARD_MANIFEST_FILE = "shard_manifest.json"
+ACTIVE_INDEX_FILE = "active_index.json"
+INDEX_LOCK_FILE = "active_index.lock"
+MAIN_SHARD = "main"
+# Superseded versions kept per shard for rollback.
+KEEP_PREVIOUS_VERSIONS = 2
+
+
+def _empty_manifest() -> dict:
+    return {"default_shard": MAIN_SHARD, "books": {}}
+
+
+def load_manifest(path: str = SHARD_MANIFEST_FILE) -> dict:
+    if not os.path.exists(path):
+        return _empty_manifest()
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception:
+        return _empty_manifest()
+    if not isinstance(data, dict):
+        return _empty_manifest()
+    data.setdefault("default_shard", MAIN_SHARD)
+    if not isinstance(data.get("books"), dict):
+        data["books"] = {}
+    return data
+
+
+def save_manifest(manifest: dict, path: str = SHARD_MANIFEST_FILE) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def manifest_mtime(path: str = SHARD_MANIFEST_FILE) -> float:
+    """Changes whenever the manifest is rewritten (0 when there is none)."""
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0.0
+
+
+def layout_version() -> float:
+    """Changes whenever the manifest or the active-index pointer is rewritten."""
+    return max(manifest_mtime(SHARD_MANIFEST_FILE), manifest_mtime(ACTIVE_INDEX_FILE))
+
+
+def normalize_shard(name: str) -> str:
+    """Lowercase and keep only characters Chroma allows in collection names."""
+    shard = re.sub(r"[^a-z0-9_-]+", "-", (name or "").strip().lower()).strip("-_")
+    return shard or MAIN_SHARD
+
+
+def collection_name_for_shard(shard: str) -> str:
+    shard = normalize_shard(shard)
+    if shard == MAIN_SHARD:
+        return COLLECTION_NAME
+    return f"{COLLECTION_NAME}__{shard}"[:63]
+
+
+def shard_for_book(book: str, manifest: dict = None) -> str:
+    """Shard of a book, given its path or file name."""
+    manifest = manifest or load_manifest()
+    name = os.path.basename(book or "")
+    shard = manifest["books"].get(name) or manifest.get("default_shard") or MAIN_SHARD
+    return normalize_shard(shard)
+
+
+def list_shards(manifest: dict = None):
+    """Every shard that has (or will get) books, main shard first."""
+    manifest = manifest or load_manifest()
+    shards = {normalize_shard(manifest.get("default_shard") or MAIN_SHARD), MAIN_SHARD}
+    shards.update(normalize_shard(s) for s in manifest["books"].values())
+    return sorted(shards, key=lambda s: (s != MAIN_SHARD, s))
+
+
+# ---------- ACTIVE VERSIONS ----------
+
+def load_active_index(path: str = ACTIVE_INDEX_FILE) -> dict:
+    if not os.path.exists(path):
+        return {"shards": {}}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception:
+        return {"shards": {}}
+    if not isinstance(data, dict) or not isinstance(data.get("shards"), dict):
+        return {"shards": {}}
+    return data
+
+
+def save_active_index(pointer: dict, path: str = ACTIVE_INDEX_FILE) -> None:
+    # Same write-then-rename as the manifest: readers see the old or the
+    # new pointer, never a partial file.
+    save_manifest(pointer, path)
+
+
+def active_collection_name(shard: str, pointer: dict = None) -> str:
+    """Collection queries for `shard` are served from."""
+    shard = normalize_shard(shard)
+    pointer = pointer or load_active_index()
+    entry = pointer["shards"].get(shard) or {}
+    return entry.get("active") or collection_name_for_shard(shard)
+
+
+def versioned_collection_name(shard: str, version: int) -> str:
+    suffix = f"__v{version}"
+    return collection_name_for_shard(shard)[: 63 - len(suffix)] + suffix
+
+
+def open_collections(chroma_client, manifest: dict = None) -> dict:
+    """shard -> active Chroma collection for every shard in the manifest."""
+    manifest = manifest or load_manifest()
+    pointer = load_active_index()
+    return {
+        shard: chroma_client.get_or_create_collection(active_collection_name(shard, pointer))
+        for shard in list_shards(manifest)
+    }
+
+
+def collection_for_book(chroma_client, book: str, manifest: dict = None):
+    """The active collection holding a book's chunks."""
+    return chroma_client.get_or_create_collection(active_collection_name(shard_for_book(book, manifest)))
+
+
+def copy_collection(source, target, page_size: int = 1000, where=None) -> int:
+    """Copy every chunk (with its embedding) matching `where` from one collection to another."""
+    copied = 0
+    while True:
+        page = source.get(
+            where=where, limit=page_size, offset=copied, include=["documents", "metadatas", "embeddings"]
+        )
+        ids = page.get("ids") or []
+        if not ids:
+            break
+        # upsert: a synced book may keep chunk ids whose metadata changed.
+        target.upsert(
+            ids=ids,
+            documents=page.get("documents"),
+            metadatas=page.get("metadatas"),
+            embeddings=page.get("embeddings"),
+        )
+        copied += len(ids)
+        if len(ids) < page_size:
+            break
+    return copied
+
+
+def sync_books(source, target, books, page_size: int = 1000) -> int:
+    """Make `target` hold exactly the chunks `source` has for each of `books`."""
+    from index_metadata import BOOKS_DIR, book_where
+
+    copied = 0
+    for book in books:
+        where = book_where(os.path.join(BOOKS_DIR, book))
+        target.delete(where=where)
+        copied += copy_collection(source, target, page_size, where=where)
+    return copied
+
+
+# ---------- LOCKING ----------
+
+_lock_guard = threading.RLock()
+_lock_depth = 0
+_lock_file = None
+
+
+@contextlib.contextmanager
+def index_lock(path: str = INDEX_LOCK_FILE):
+    """
+    Exclusive lock on the active-index pointer across processes (fcntl),
+    re-entrant within one process. Indexers hold it from stage_shard() to
+    publish_shard(), so two of them never build the same shard from the
+    same base or lose each other's pointer flip. Queries never take it.
+    """
+    global _lock_depth, _lock_file
+    with _lock_guard:
+        if _lock_depth == 0 and fcntl is not None:
+            _lock_file = open(path, "a")
+            fcntl.flock(_lock_file, fcntl.LOCK_EX)
+        _lock_depth += 1
+        try:
+            yield
+        finally:
+            _lock_depth -= 1
+            if _lock_depth == 0 and _lock_file is not None:
+                fcntl.flock(_lock_file, fcntl.LOCK_UN)
+                _lock_file.close()
+                _lock_file = None
+
+
+# ---------- STAGE / PUBLISH ----------
+
+def _drop_collections(chroma_client, names) -> None:
+    for name in names:
+        try:
+            chroma_client.delete_collection(name)
+        except Exception:
+            pass
+
+
+def _reusable_version(chroma_client, entry: dict, keep: int = KEEP_PREVIOUS_VERSIONS):
+    """
+    (name, books) of the kept version that expires at the next publish and
+    the books to sync into it to match the active one, or (None, None) when
+    some version in between has no recorded changes.
+    """
+    previous = list(entry.get("previous") or [])
+    if keep < 1 or len(previous) < keep:
+        return None, None
+    chain = [entry.get("active")] + previous[:keep - 1]
+    changes = entry.get("changes") or {}
+    if any(not name or name not in changes for name in chain):
+        return None, None
+    base = previous[keep - 1]
+    try:
+        chroma_client.get_collection(base)
+    except Exception:
+        return None, None
+    return base, sorted({book for name in chain for book in changes[name]})
+
+
+def stage_shard(chroma_client, shard: str):
+    """
+    Collection to rebuild books of `shard` in, holding the same chunks as
+    the active version.
+
+    The kept version that would expire at the next publish is reused when
+    the changes since it are recorded: only those books are copied over.
+    Otherwise a new version is created with a full copy.
+
+    Returns (collection name, collection). Books are rebuilt in it and it
+    goes live with publish_shard() (or is dropped with discard_shard());
+    until then queries are unaffected.
+    """
+    shard = normalize_shard(shard)
+    with index_lock():
+        pointer = load_active_index()
+        entry = pointer["shards"].get(shard) or {}
+        entry.setdefault("active", collection_name_for_shard(shard))
+        # Left over from a run that died before publishing.
+        leftover = entry.pop("staging", None)
+        if leftover and leftover != entry["active"] and leftover not in (entry.get("previous") or []):
+            _drop_collections(chroma_client, [leftover])
+
+        name, books = _reusable_version(chroma_client, entry)
+        if name:
+            # Out of the rollback list before it is touched.
+            entry["previous"] = [n for n in entry["previous"] if n != name]
+            entry.get("changes", {}).pop(name, None)
+        else:
+            version = int(entry.get("next_version") or 1)
+            name = versioned_collection_name(shard, version)
+            entry["next_version"] = version + 1
+            _drop_collections(chroma_client, [name])
+        entry["staging"] = name
+        pointer["shards"][shard] = entry
+        save_active_index(pointer)
+
+        active = chroma_client.get_or_create_collection(entry["active"])
+        staged = chroma_client.get_or_create_collection(name)
+        if books is None:
+            copy_collection(active, staged)
+        else:
+            sync_books(active, staged, books)
+    return name, staged
+
+
+def publish_shard(chroma_client, shard: str, name: str, books=None, keep: int = KEEP_PREVIOUS_VERSIONS) -> None:
+    """
+    Make collection `name` the active version of `shard`; older versions
+    beyond `keep` are dropped. `books` lists the books rebuilt or removed
+    in it, which lets the next stage_shard() reuse an older version; pass
+    None when unknown.
+    """
+    shard = normalize_shard(shard)
+    with index_lock():
+        pointer = load_active_index()
+        entry = pointer["shards"].get(shard) or {}
+        old = entry.get("active") or collection_name_for_shard(shard)
+        previous = [n for n in [old] + list(entry.get("previous") or []) if n != name]
+
+        entry["active"] = name
+        entry["previous"] = previous[:keep]
+        # Versions abandoned by a rollback are dropped together with the
+        # expired ones, one publish later than they stopped serving.
+        expired = previous[keep:] + list(entry.get("retired") or [])
+        entry["retired"] = []
+        if entry.get("staging") == name:
+            del entry["staging"]
+
+        changes = entry.get("changes") or {}
+        if books is None:
+            changes.pop(name, None)
+        else:
+            changes[name] = sorted({os.path.basename(b) for b in books})
+        live = [name] + entry["previous"]
+        entry["changes"] = {n: changes[n] for n in live if n in changes}
+
+        pointer["shards"][shard] = entry
+        save_active_index(pointer)
+        _drop_collections(chroma_client, [n for n in expired if n != name])
+
+
+def discard_shard(chroma_client, shard: str, name: str) -> None:
+    """Drop a staged collection that will not be published."""
+    shard = normalize_shard(shard)
+    with index_lock():
+        pointer = load_active_index()
+        entry = pointer["shards"].get(shard) or {}
+        if entry.get("staging") == name:
+            del entry["staging"]
+            pointer["shards"][shard] = entry
+            save_active_index(pointer)
+        if name != entry.get("active") and name not in (entry.get("previous") or []):
+            _drop_collections(chroma_client, [name])
+
+
+def rollback_shard(shard: str, chroma_client=None):
+    """
+    Serve the previous version of `shard` again. Returns (from, to) names,
+    or None. With VECTOR_BACKEND=quantized the shard is re-exported, so the
+    memory-mapped store serves the restored version too.
+    """
+    shard = normalize_shard(shard)
+    with index_lock():
+        pointer = load_active_index()
+        entry = pointer["shards"].get(shard) or {}
+        previous = list(entry.get("previous") or [])
+        if not previous:
+            return None
+        current = entry.get("active") or collection_name_for_shard(shard)
+        entry["active"] = previous.pop(0)
+        entry["previous"] = previous
+        # Not dropped yet: app processes may still hold it until they notice
+        # the new pointer.
+        entry["retired"] = list(entry.get("retired") or []) + [current]
+        pointer["shards"][shard] = entry
+        save_active_index(pointer)
+
+        from vector_store import backend_name, rebuild_stores
+
+        if backend_name() == "quantized":
+            if chroma_client is None:
+                import chromadb
+
+                chroma_client = chromadb.PersistentClient(path=CHROMA_PATH)
+            rebuild_stores(chroma_client, shards=[shard])
+    return current, entry["active"]
+
+
+def assign_book(book: str, shard: str, path: str = SHARD_MANIFEST_FILE) -> tuple:
+    """Record `book` in `shard`. Returns (old_shard, new_shard)."""
+    manifest = load_manifest(path)
+    name = os.path.basename(book)
+    old = shard_for_book(name, manifest)
+    new = normalize_shard(shard)
+    if new == normalize_shard(manifest.get("default_shard") or MAIN_SHARD):
+        manifest["books"].pop(name, None)
+    else:
+        manifest["books"][name] = new
+    save_manifest(manifest, path)
+    return old, new
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("show", help="print shards and their books")
+    p_assign = sub.add_parser("assign", help="assign a book to a shard")
+    p_assign.add_argument("book")
+    p_assign.add_argument("shard")
+    sub.add_parser("versions", help="print the active and kept versions per shard")
+    p_rollback = sub.add_parser("rollback", help="serve the previous version of a shard")
+    p_rollback.add_argument("shard")
+    args = parser.parse_args()
+
+    if args.command == "show":
+        manifest = load_manifest()
+        for shard in list_shards(manifest):
+            books = sorted(b for b, s in manifest["books"].items() if normalize_shard(s) == shard)
+            default = " (default)" if shard == normalize_shard(manifest["default_shard"]) else ""
+            print(f"{shard}{default} -> {active_collection_name(shard)}")
+            for b in books:
+                print(f"   {b}")
+        return 0
+
+    if args.command == "versions":
+        pointer = load_active_index()
+        for shard in list_shards():
+            entry = pointer["shards"].get(shard) or {}
+            print(f"{shard}: active {active_collection_name(shard, pointer)}")
+            for name in entry.get("previous") or []:
+                print(f"   kept {name}")
+        return 0
+
+    if args.command == "rollback":
+        result = rollback_shard(args.shard)
+        if result is None:
+            print(f"No previous version of shard '{normalize_shard(args.shard)}' to roll back to.")
+            return 1
+        print(f"Shard '{normalize_shard(args.shard)}' now served from {result[1]} (was {result[0]}).")
+        return 0
+
+    old, new = assign_book(args.book, args.shard)
+    if old == new:
+        print(f"{os.path.basename(args.book)} is already in shard '{new}'.")
+        return 0
+
+    import chromadb
+
+    from index_metadata import BOOKS_DIR, book_where
+
+    # Drop the chunks from the old shard now, through a staged version like
+    # any other change; the next index run writes them to the new one.
+    chroma_client = chromadb.PersistentClient(path=CHROMA_PATH)
+    with index_lock():
+        name, staged = stage_shard(chroma_client, old)
+        staged.delete(where=book_where(os.path.join(BOOKS_DIR, os.path.basename(args.book))))
+        publish_shard(chroma_client, old, name, books=[args.book])
+
+    from vector_store import backend_name, rebuild_stores
+
+    if backend_name() == "quantized":
+        rebuild_stores(chroma_client, shards=[old, new])
+    print(f"Moved {os.path.basename(args.book)}: '{old}' -> '{new}'. Reindex the book to fill the new shard.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
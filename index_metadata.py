@@ -0,0 +1,212 @@
+"""
+Metadata stored with every indexed chunk, and `where` filters over it.
+
+Besides "source" ("books/<file name>", relative so the keys survive moving
+the deployment), each chunk carries:
+  - "book": file name, the value book filters match on,
+  - "chunk_index": ordinal of the chunk within its book,
+  - "page" (PDF, 1-based) / "chapter" (EPUB heading) where known,
+  - "language": "en", "hi", ... from the dominant script,
+  - "deities": comma-separated deities mentioned, plus one boolean
+    "deity_<name>" flag per deity so Chroma can filter on it.
+
+Books indexed before these fields existed can be updated in place,
+without new embeddings:
+    python index_metadata.py backfill
+"""
+
+import argparse
+import bisect
+import os
+import re
+import sys
+
+# Canonical deity name -> spellings and common epithets found in the books.
+DEITY_ALIASES = {
+    "shiva": ["shiva", "siva", "mahadeva", "rudra", "shankara", "bholenath"],
+    "vishnu": ["vishnu", "narayana", "hari"],
+    "krishna": ["krishna", "gopala", "govinda", "keshava", "madhava"],
+    "rama": ["rama", "raghava", "sita-rama", "sitarama"],
+    "devi": ["devi", "durga", "kali", "shakti", "parvati", "ambika", "chandi"],
+    "lakshmi": ["lakshmi", "laxmi", "sri devi"],
+    "saraswati": ["saraswati", "sarasvati"],
+    "ganesha": ["ganesha", "ganesh", "ganapati", "vinayaka"],
+    "hanuman": ["hanuman", "anjaneya", "maruti"],
+}
+
+DEITY_NAMES = sorted(DEITY_ALIASES)
+
+BOOKS_DIR = "books"
+
+_DEITY_PATTERNS = {
+    deity: re.compile(r"\b(?:" + "|".join(re.escape(a) for a in aliases) + r")\b", re.IGNORECASE)
+    for deity, aliases in DEITY_ALIASES.items()
+}
+
+# Unicode ranges of the scripts the library is likely to contain.
+_SCRIPTS = {
+    "hi": ("\u0900", "\u097f"),  # Devanagari (Hindi / Sanskrit / Marathi)
+    "bn": ("\u0980", "\u09ff"),
+    "ta": ("\u0b80", "\u0bff"),
+    "te": ("\u0c00", "\u0c7f"),
+    "kn": ("\u0c80", "\u0cff"),
+    "ml": ("\u0d00", "\u0d7f"),
+    "gu": ("\u0a80", "\u0aff"),
+}
+
+
+def deity_flag(deity: str) -> str:
+    return f"deity_{deity}"
+
+
+def detect_deities(text: str):
+    """Canonical names of the deities mentioned in `text`, sorted."""
+    return [deity for deity, pattern in sorted(_DEITY_PATTERNS.items()) if pattern.search(text or "")]
+
+
+def detect_language(text: str) -> str:
+    """Language code from the dominant script; Latin text counts as English."""
+    counts = {code: 0 for code in _SCRIPTS}
+    latin = 0
+    for ch in text or "":
+        if ch.isascii():
+            if ch.isalpha():
+                latin += 1
+            continue
+        for code, (low, high) in _SCRIPTS.items():
+            if low <= ch <= high:
+                counts[code] += 1
+                break
+    code, best = max(counts.items(), key=lambda kv: kv[1])
+    if best > latin:
+        return code
+    return "en" if latin else "unknown"
+
+
+def text_metadata(text: str) -> dict:
+    """Language and deity fields for one chunk."""
+    deities = detect_deities(text)
+    meta = {"language": detect_language(text), "deities": ",".join(deities)}
+    for deity in deities:
+        meta[deity_flag(deity)] = True
+    return meta
+
+
+def source_key(path: str) -> str:
+    """Stable "source" value for a book, whatever directory the app runs from."""
+    return f"{BOOKS_DIR}/{os.path.basename(path)}"
+
+
+def book_where(path: str) -> dict:
+    """Chroma filter matching every chunk of a book, including ones written
+    before "book" and relative source keys existed."""
+    return {"$or": [{"book": os.path.basename(path)}, {"source": os.path.abspath(path)}]}
+
+
+def chunk_metadata(path: str, chunks, segments=None, joiner: str = "\n") -> list:
+    """
+    Metadata for each chunk of one book.
+
+    chunks: list of (start_offset, text) into the joined book text.
+    segments: optional list of {"text", "page", "chapter"} the book text was
+    joined from with `joiner`; used to place each chunk on its page/chapter.
+    """
+    starts = []
+    if segments:
+        offset = 0
+        for seg in segments:
+            starts.append(offset)
+            offset += len(seg.get("text") or "") + len(joiner)
+
+    book = os.path.basename(path)
+    source = source_key(path)
+    metas = []
+    for idx, (start, text) in enumerate(chunks):
+        meta = {"source": source, "book": book, "chunk_index": idx}
+        if segments:
+            seg = segments[max(0, bisect.bisect_right(starts, start) - 1)]
+            # Chroma rejects None values, so unknown fields are left out.
+            if seg.get("page") is not None:
+                meta["page"] = int(seg["page"])
+            if seg.get("chapter"):
+                meta["chapter"] = str(seg["chapter"])[:200]
+        meta.update(text_metadata(text))
+        metas.append(meta)
+    return metas
+
+
+def build_where(books=None, deity=None, language=None):
+    """Chroma `where` filter for the given constraints, or None."""
+    clauses = []
+    if books:
+        names = sorted({os.path.basename(b) for b in books})
+        clauses.append({"book": names[0]} if len(names) == 1 else {"book": {"$in": names}})
+    if deity:
+        clauses.append({deity_flag(deity.strip().lower()): True})
+    if language:
+        clauses.append({"language": language})
+    if not clauses:
+        return None
+    if len(clauses) == 1:
+        return clauses[0]
+    return {"$and": clauses}
+
+
+def _chunk_index_from_id(chunk_id: str):
+    match = re.search(r"_chunk_(\d+)$", chunk_id or "")
+    return int(match.group(1)) if match else None
+
+
+def backfill_collection(col, page_size: int = 500) -> int:
+    """Add book / chunk_index / language / deity fields to chunks missing them."""
+    updated = 0
+    offset = 0
+    total = col.count()
+    while offset < total:
+        page = col.get(limit=page_size, offset=offset, include=["documents", "metadatas"])
+        ids = page.get("ids") or []
+        if not ids:
+            break
+        docs = page.get("documents") or []
+        metas = page.get("metadatas") or []
+
+        upd_ids, upd_metas = [], []
+        for i, chunk_id in enumerate(ids):
+            meta = dict(metas[i] or {}) if i < len(metas) else {}
+            if "book" in meta and "language" in meta:
+                continue
+            source = meta.get("source", "")
+            meta["book"] = os.path.basename(source) if source else ""
+            chunk_index = _chunk_index_from_id(chunk_id)
+            if chunk_index is not None:
+                meta["chunk_index"] = chunk_index
+            meta.update(text_metadata(docs[i] if i < len(docs) else ""))
+            upd_ids.append(chunk_id)
+            upd_metas.append(meta)
+
+        if upd_ids:
+            col.update(ids=upd_ids, metadatas=upd_metas)
+            updated += len(upd_ids)
+        offset += len(ids)
+    return updated
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("backfill", help="add the new metadata fields to already indexed chunks")
+    parser.parse_args()
+
+    import chromadb
+
+    from index_layout import CHROMA_PATH, open_collections
+
+    chroma_client = chromadb.PersistentClient(path=CHROMA_PATH)
+    for shard, col in open_collections(chroma_client).items():
+        n = backfill_collection(col)
+        print(f"{shard}: updated {n} chunks")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,6 @@
 import streamlit as st
 from ui import render_mantra_html, render_answer_html
-from database import load_approved_practices
+from database import query_approved_practices
 
 
 def render_meditation_journey(user_profile: dict):
@@ -12,8 +12,7 @@ def render_meditation_journey(user_profile: dict):
 
     age_group = user_profile.get("age_group") or user_profile.get("age_group_code")
 
-    approved = load_approved_practices()
-    meditations = approved.get("meditation", []) or []
+    meditations = query_approved_practices("meditation")
 
     if not meditations:
         st.info("No meditation practices have been approved yet.")
@@ -33,8 +32,7 @@ def render_mantra_journey(user_profile: dict):
         "Over time, we can make this more level-based and interactive."
     )
 
-    approved = load_approved_practices()
-    mantras = approved.get("mantra", []) or []
+    mantras = query_approved_practices("mantra")
 
     if not mantras:
         st.info("No mantra practices have been approved yet.")
@@ -0,0 +1,255 @@
+"""
+Web-optimised copies of the guidance media.
+
+Uploaded audio, images and video are kept as uploaded. This worker writes a
+smaller copy of each into media_derivatives/:
+  - images: WebP, longest side at most IMAGE_MAX_SIDE (animated GIFs stay
+    animated),
+  - audio: AAC in .m4a at AUDIO_BITRATE, playable in every browser,
+  - video: H.264 MP4 at most VIDEO_MAX_HEIGHT lines, with the index moved to
+    the front (faststart) so playback starts before the download ends.
+
+Copies are content-addressed (<sha256 of the original>.v<profile>.<ext>), so
+re-uploads of the same file share one copy and a changed profile never
+serves a stale one. The media_derivatives table maps each original to its
+copy; pages call serving_path() and get the copy only when it exists, the
+original has not changed since, and the copy is actually smaller.
+
+Audio and video need ffmpeg on the PATH; without it those files are
+recorded as skipped and served as uploaded.
+
+Usage:
+    python media_derivatives.py             # process new or changed files once
+    python media_derivatives.py --watch     # keep processing every SLEEP_SECONDS
+    python media_derivatives.py --status    # list originals and their copies
+"""
+
+import argparse
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+from database import (
+    GUIDANCE_AUDIO_DIR,
+    GUIDANCE_MEDIA_DIR,
+    HASH_CHUNK_BYTES,
+    get_media_derivative,
+    list_media_derivatives,
+    save_media_derivative,
+)
+
+DERIVATIVES_DIR = "media_derivatives"
+MEDIA_DIRS = [GUIDANCE_AUDIO_DIR, GUIDANCE_MEDIA_DIR]
+SLEEP_SECONDS = 300
+
+# Bump when a setting below changes so every file is converted again.
+PROFILE_VERSION = 1
+IMAGE_MAX_SIDE = 1280
+IMAGE_QUALITY = 80
+AUDIO_BITRATE = "96k"
+VIDEO_MAX_HEIGHT = 720
+VIDEO_CRF = 28
+
+_EXTENSIONS = {
+    "image": (".png", ".jpg", ".jpeg", ".gif", ".webp", ".bmp"),
+    "audio": (".mp3", ".wav", ".m4a", ".aac", ".ogg", ".flac"),
+    "video": (".mp4", ".mov", ".m4v", ".webm", ".mpeg4"),
+}
+_OUTPUT_EXT = {"image": ".webp", "audio": ".m4a", "video": ".mp4"}
+
+
+def media_kind(path: str):
+    ext = os.path.splitext(path)[1].lower()
+    for kind, exts in _EXTENSIONS.items():
+        if ext in exts:
+            return kind
+    return None
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def derivative_path(sha256: str, kind: str) -> str:
+    return os.path.join(DERIVATIVES_DIR, sha256[:2], f"{sha256}.v{PROFILE_VERSION}{_OUTPUT_EXT[kind]}")
+
+
+# ---------- CONVERTERS ----------
+# Each writes `dest` (a temp path); the caller renames it into place.
+
+def make_image(src: str, dest: str) -> None:
+    from PIL import Image, ImageOps
+
+    with Image.open(src) as img:
+        if getattr(img, "is_animated", False):
+            frames, durations = [], []
+            for i in range(img.n_frames):
+                img.seek(i)
+                frame = img.convert("RGBA")
+                frame.thumbnail((IMAGE_MAX_SIDE, IMAGE_MAX_SIDE))
+                frames.append(frame)
+                durations.append(img.info.get("duration", 100))
+            frames[0].save(
+                dest, "WEBP", save_all=True, append_images=frames[1:], duration=durations,
+                loop=img.info.get("loop", 0), quality=IMAGE_QUALITY,
+            )
+            return
+        img = ImageOps.exif_transpose(img)
+        img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+        img.thumbnail((IMAGE_MAX_SIDE, IMAGE_MAX_SIDE))
+        img.save(dest, "WEBP", quality=IMAGE_QUALITY, method=4)
+
+
+def _ffmpeg(args) -> None:
+    result = subprocess.run(
+        ["ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error", "-y"] + args,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError((result.stderr or "ffmpeg failed").strip()[-500:])
+
+
+def make_audio(src: str, dest: str) -> None:
+    _ffmpeg(["-i", src, "-vn", "-c:a", "aac", "-b:a", AUDIO_BITRATE, "-movflags", "+faststart", "-f", "mp4", dest])
+
+
+def make_video(src: str, dest: str) -> None:
+    _ffmpeg(
+        [
+            "-i", src,
+            "-vf", f"scale=-2:'min({VIDEO_MAX_HEIGHT},ih)'",
+            "-c:v", "libx264", "-preset", "veryfast", "-crf", str(VIDEO_CRF), "-pix_fmt", "yuv420p",
+            "-c:a", "aac", "-b:a", AUDIO_BITRATE,
+            "-movflags", "+faststart",
+            "-f", "mp4", dest,
+        ]
+    )
+
+
+_CONVERTERS = {"image": make_image, "audio": make_audio, "video": make_video}
+
+
+# ---------- WORKER ----------
+
+def process_file(path: str) -> str:
+    """Create (or reuse) the derivative of one file. Returns the recorded status."""
+    kind = media_kind(path)
+    if kind is None:
+        return "ignored"
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return "missing"
+
+    row = get_media_derivative(path)
+    if row and row["size"] == stat.st_size and row["mtime"] == stat.st_mtime:
+        # Failed conversions are retried only when the file changes.
+        done = row["status"] in ("error", "original_smaller")
+        done = done or (row["status"] == "ok" and row["derivative_path"] == derivative_path(row["sha256"], kind))
+        done = done or (row["status"] == "skipped" and shutil.which("ffmpeg") is None)
+        if done:
+            return "unchanged"
+
+    sha256 = _sha256(path)
+    dest = derivative_path(sha256, kind)
+    record = dict(original_path=path, size=stat.st_size, mtime=stat.st_mtime, sha256=sha256, kind=kind)
+
+    if kind in ("audio", "video") and shutil.which("ffmpeg") is None:
+        save_media_derivative(**record, status="skipped", error="ffmpeg not found")
+        return "skipped"
+
+    if not os.path.exists(dest):
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        tmp = f"{dest}.{os.getpid()}.tmp{_OUTPUT_EXT[kind]}"
+        try:
+            _CONVERTERS[kind](path, tmp)
+            os.replace(tmp, dest)
+        except Exception as e:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            save_media_derivative(**record, status="error", error=str(e)[:500])
+            return "error"
+
+    # A re-encode of an already small file can come out bigger.
+    if os.path.getsize(dest) >= stat.st_size:
+        save_media_derivative(**record, status="original_smaller")
+        return "original_smaller"
+
+    save_media_derivative(**record, derivative_path=dest, status="ok")
+    return "ok"
+
+
+def process_all(dirs=None) -> dict:
+    """Process every media file in `dirs`. Returns status -> count."""
+    counts = {}
+    for directory in dirs or MEDIA_DIRS:
+        if not os.path.isdir(directory):
+            continue
+        for name in sorted(os.listdir(directory)):
+            if name.startswith("."):
+                continue  # in-progress uploads
+            status = process_file(os.path.normpath(os.path.join(directory, name)))
+            counts[status] = counts.get(status, 0) + 1
+    return counts
+
+
+# ---------- SERVING ----------
+
+def serving_path(path: str) -> str:
+    """The web-optimised copy of an uploaded file when one is ready, else `path`."""
+    if not path:
+        return path
+    row = get_media_derivative(os.path.normpath(path))
+    if not row or row["status"] != "ok" or not row["derivative_path"]:
+        return path
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return path
+    if row["size"] != stat.st_size or row["mtime"] != stat.st_mtime:
+        return path  # replaced since; the worker will catch up
+    if not os.path.exists(row["derivative_path"]):
+        return path
+    return row["derivative_path"]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--watch", action="store_true", help=f"repeat every {SLEEP_SECONDS} seconds")
+    parser.add_argument("--status", action="store_true", help="list processed files")
+    args = parser.parse_args()
+
+    if args.status:
+        saved = 0
+        for row in list_media_derivatives():
+            line = f"{row['status']:<17}{row['original_path']}"
+            if row["derivative_path"] and os.path.exists(row["derivative_path"]):
+                small = os.path.getsize(row["derivative_path"])
+                saved += row["size"] - small
+                line += f"  {row['size'] / 1e6:.1f} MB -> {small / 1e6:.1f} MB"
+            elif row["error"]:
+                line += f"  ({row['error']})"
+            print(line)
+        print(f"\nSaved per full view of every file: {saved / 1e6:.1f} MB")
+        return 0
+
+    while True:
+        counts = process_all()
+        print("🎞 " + (", ".join(f"{k}: {v}" for k, v in sorted(counts.items())) or "no media files"))
+        if not args.watch:
+            return 0
+        time.sleep(SLEEP_SECONDS)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
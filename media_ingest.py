@@ -0,0 +1,130 @@
+"""
+Saving admin uploads (books, audio, images, video) to disk.
+
+Every uploader goes through ingest_upload():
+  - the size limit for the kind of file is checked before anything is
+    written, and again while copying,
+  - the upload is copied in fixed-size blocks to a hidden temp file next to
+    the destination, hashed (sha256) on the way,
+  - the temp file is fsync'ed and renamed into place, so readers never see
+    a half-written file and a failed upload leaves nothing behind.
+
+Kept free of Streamlit; callers report errors in the UI.
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+
+COPY_CHUNK_BYTES = 1024 * 1024
+
+MB = 1024 * 1024
+# Largest accepted upload per kind of media.
+SIZE_LIMITS = {
+    "book": 200 * MB,
+    "audio": 50 * MB,
+    "image": 15 * MB,
+    "video": 500 * MB,
+}
+
+
+class UploadTooLarge(ValueError):
+    """The upload exceeds SIZE_LIMITS for its kind."""
+
+
+def safe_file_name(name: str) -> str:
+    """Base name with spaces and path-unfriendly characters replaced."""
+    base = os.path.basename(name or "").replace(" ", "_")
+    return re.sub(r"[^\w.\-()]+", "_", base, flags=re.UNICODE) or "upload"
+
+
+def _limit_message(kind: str, limit: int) -> str:
+    return f"{kind.capitalize()} files can be at most {limit // MB} MB."
+
+
+def unique_path(path: str) -> str:
+    """`path`, or `<name>_<n><ext>` for the first n that does not exist yet."""
+    base, ext = os.path.splitext(path)
+    counter = 1
+    while os.path.exists(path):
+        path = f"{base}_{counter}{ext}"
+        counter += 1
+    return path
+
+
+def stream_to_temp(uploaded, directory: str, kind: str):
+    """
+    Copy a file-like upload into a temp file in `directory`.
+    Returns (temp path, sha256, size); the caller renames or removes it.
+    """
+    limit = SIZE_LIMITS[kind]
+    declared = getattr(uploaded, "size", None)
+    if declared is not None and declared > limit:
+        raise UploadTooLarge(_limit_message(kind, limit))
+
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".ingest-", suffix=".part", dir=directory)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        if hasattr(uploaded, "seek"):
+            uploaded.seek(0)
+        with os.fdopen(fd, "wb") as out:
+            for block in iter(lambda: uploaded.read(COPY_CHUNK_BYTES), b""):
+                size += len(block)
+                if size > limit:
+                    raise UploadTooLarge(_limit_message(kind, limit))
+                digest.update(block)
+                out.write(block)
+            out.flush()
+            os.fsync(out.fileno())
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    return tmp_path, digest.hexdigest(), size
+
+
+def _fsync_dir(directory: str) -> None:
+    # Makes the rename itself durable; not supported on every platform.
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def commit_temp(tmp_path: str, dest_path: str, overwrite: bool = False) -> str:
+    """Atomically move a temp file from stream_to_temp() into place. Returns the final path."""
+    if not overwrite:
+        dest_path = unique_path(dest_path)
+    os.replace(tmp_path, dest_path)
+    _fsync_dir(os.path.dirname(dest_path) or ".")
+    return dest_path
+
+
+def ingest_upload(uploaded, dest_dir: str, filename: str, kind: str, overwrite: bool = False) -> dict:
+    """
+    Save an upload as dest_dir/filename (suffixed _1, _2, ... if taken).
+
+    Returns {"path", "name", "sha256", "size"}. Raises UploadTooLarge when
+    the file is over the limit for `kind`, OSError on disk errors.
+    """
+    tmp_path, sha256, size = stream_to_temp(uploaded, dest_dir, kind)
+    try:
+        path = commit_temp(tmp_path, os.path.join(dest_dir, filename), overwrite)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    return {"path": path, "name": os.path.basename(path), "sha256": sha256, "size": size}
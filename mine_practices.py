@@ -0,0 +1,263 @@
+"""
+Offline practice mining over every chunk in the Chroma collection.
+
+The admin scan only looks at the nearest passages per keyword. This job
+pages through every shard collection (documents + stored embeddings), scores
+each chunk against a mantra and a meditation prototype vector and keeps the
+best `--top` chunks per kind. The ranked passages are then added to the
+practice candidates for review on the admin Practices page.
+
+Memory stays bounded: one page of embeddings plus a fixed-size heap per
+kind. Progress is saved after every page, so an interrupted run picks up
+where it stopped.
+
+Usage:
+    python mine_practices.py                   # mine both kinds, resume if possible
+    python mine_practices.py --kind mantra     # one kind only
+    python mine_practices.py --restart         # ignore saved progress
+    python mine_practices.py --dry-run         # print the ranking, write nothing
+"""
+
+import argparse
+import heapq
+import json
+import os
+import sys
+
+import chromadb
+import numpy as np
+
+from database import (
+    PRACTICE_KEYWORDS,
+    load_approved_practices,
+    load_practice_candidates,
+    practice_candidate_key,
+    practice_candidate_snippet,
+    practice_text_hash,
+    save_practice_candidates,
+)
+from index_layout import CHROMA_PATH, open_collections
+from near_duplicates import cluster_candidates
+from prepare_data import embed_texts
+
+STATE_FILE = "practice_mining_state.json"
+
+DEFAULT_PAGE_SIZE = 500
+DEFAULT_TOP_N = 300
+# Cosine similarity below this is never a candidate.
+DEFAULT_MIN_SCORE = 0.30
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def build_prototypes(kinds):
+    """One unit vector per kind: the mean of its normalized keyword embeddings."""
+    vectors = []
+    for kind in kinds:
+        emb = np.asarray(embed_texts(PRACTICE_KEYWORDS[kind]), dtype=np.float32)
+        vectors.append(_normalize_rows(emb).mean(axis=0))
+    return _normalize_rows(np.vstack(vectors))
+
+
+def _load_state(path: str):
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+
+def _save_state(path: str, state: dict) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def _new_state(kinds, counts: dict, args) -> dict:
+    return {
+        # collection name -> chunk count when the run started
+        "collection_counts": counts,
+        "kinds": list(kinds),
+        "top_n": args.top,
+        "min_score": args.min_score,
+        # collection name -> chunks already scored
+        "offsets": {name: 0 for name in counts},
+        # kind -> list of [score, chunk_id, source, snippet]; a min-heap.
+        "top": {kind: [] for kind in kinds},
+    }
+
+
+def _state_matches(state, kinds, counts: dict, args) -> bool:
+    return (
+        state.get("collection_counts") == counts
+        and state.get("kinds") == list(kinds)
+        and state.get("top_n") == args.top
+        and state.get("min_score") == args.min_score
+    )
+
+
+def score_page(embeddings: np.ndarray, prototypes: np.ndarray) -> np.ndarray:
+    """(page, dim) x (kinds, dim) -> (page, kinds) cosine similarities."""
+    return _normalize_rows(embeddings) @ prototypes.T
+
+
+def _push(heap: list, item: list, top_n: int) -> None:
+    if len(heap) < top_n:
+        heapq.heappush(heap, item)
+    elif item[0] > heap[0][0]:
+        heapq.heapreplace(heap, item)
+
+
+def mine(collections: dict, kinds, prototypes, state: dict, args, state_path: str) -> dict:
+    for name, col in collections.items():
+        _mine_collection(name, col, kinds, prototypes, state, args, state_path)
+    return state
+
+
+def _mine_collection(name: str, col, kinds, prototypes, state: dict, args, state_path: str) -> None:
+    total = state["collection_counts"][name]
+    while state["offsets"][name] < total:
+        page = col.get(
+            limit=args.page_size,
+            offset=state["offsets"][name],
+            include=["documents", "metadatas", "embeddings"],
+        )
+        ids = page.get("ids") or []
+        if not ids:
+            break
+
+        docs = page.get("documents") or []
+        metas = page.get("metadatas") or []
+        emb = page.get("embeddings")
+        if emb is None or len(emb) == 0:
+            state["offsets"][name] += len(ids)
+            continue
+
+        scores = score_page(np.asarray(emb, dtype=np.float32), prototypes)
+
+        for k, kind in enumerate(kinds):
+            heap = state["top"][kind]
+            column = scores[:, k]
+            # Only chunks that could enter the heap are turned into rows.
+            floor = args.min_score
+            if len(heap) >= args.top:
+                floor = max(floor, heap[0][0])
+            for i in np.nonzero(column > floor)[0]:
+                text = (docs[i] or "").strip() if i < len(docs) else ""
+                if not text:
+                    continue
+                source = ((metas[i] if i < len(metas) else None) or {}).get("source", "")
+                item = [float(column[i]), ids[i], source, practice_candidate_snippet(text)]
+                _push(heap, item, args.top)
+
+        state["offsets"][name] += len(ids)
+        if not args.dry_run:
+            _save_state(state_path, state)
+        print(f"   {name}: scanned {min(state['offsets'][name], total):,} / {total:,} chunks")
+
+
+def write_candidates(state: dict) -> int:
+    """Add the mined passages to the candidate list, best first. Returns how many were new."""
+    candidates = load_practice_candidates()
+    approved = load_approved_practices()
+
+    approved_hashes = {
+        practice_text_hash(item.get("text", ""))
+        for kind in ("mantra", "meditation")
+        for item in approved.get(kind, [])
+        if item.get("text")
+    }
+    seen_keys = {
+        practice_candidate_key(c.get("kind"), c.get("source"), c.get("text"))
+        for c in candidates
+    }
+
+    ranked = []
+    for kind, heap in state["top"].items():
+        for score, chunk_id, source, snippet in heap:
+            ranked.append((score, kind, chunk_id, source, snippet))
+    ranked.sort(key=lambda r: r[0], reverse=True)
+
+    added = 0
+    for score, kind, chunk_id, source, snippet in ranked:
+        key = practice_candidate_key(kind, source, snippet)
+        if key in seen_keys or practice_text_hash(snippet) in approved_hashes:
+            continue
+        candidates.append(
+            {
+                "kind": kind,
+                "source": source,
+                "text": snippet,
+                "approved": False,
+                "score": round(score, 4),
+                "chunk_id": chunk_id,
+            }
+        )
+        seen_keys.add(key)
+        added += 1
+
+    cluster_candidates(candidates)
+    save_practice_candidates(candidates)
+    return added
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--kind", choices=["mantra", "meditation"], help="mine one kind only")
+    parser.add_argument("--page-size", type=int, default=DEFAULT_PAGE_SIZE, help="chunks fetched per col.get call")
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP_N, help="candidates kept per kind")
+    parser.add_argument("--min-score", type=float, default=DEFAULT_MIN_SCORE, help="minimum cosine similarity")
+    parser.add_argument("--state-file", default=STATE_FILE)
+    parser.add_argument("--restart", action="store_true", help="discard saved progress")
+    parser.add_argument("--dry-run", action="store_true", help="print the ranking instead of saving it")
+    args = parser.parse_args()
+
+    kinds = [args.kind] if args.kind else ["mantra", "meditation"]
+
+    chroma_client = chromadb.PersistentClient(path=CHROMA_PATH)
+    collections = {col.name: col for col in open_collections(chroma_client).values()}
+    counts = {name: col.count() for name, col in collections.items()}
+    total = sum(counts.values())
+    if total == 0:
+        print("⚠ The collection is empty. Index some books first.")
+        return 0
+
+    state = None if args.restart else _load_state(args.state_file)
+    if state and not _state_matches(state, kinds, counts, args):
+        print("ℹ Saved progress is for a different collection size or settings; starting over.")
+        state = None
+    if state:
+        done = sum(state["offsets"].values())
+        print(f"↻ Resuming after {done:,} of {total:,} chunks.")
+    else:
+        state = _new_state(kinds, counts, args)
+
+    print(f"🔣 Building prototype vectors for: {', '.join(kinds)}")
+    prototypes = build_prototypes(kinds)
+
+    state = mine(collections, kinds, prototypes, state, args, args.state_file)
+
+    if args.dry_run:
+        for kind in kinds:
+            print(f"\n=== {kind} ===")
+            for score, _chunk_id, source, snippet in sorted(state["top"][kind], reverse=True)[:20]:
+                preview = snippet[:100].replace("\n", " ")
+                print(f"{score:.3f}  {os.path.basename(source)}  {preview}")
+        return 0
+
+    added = write_candidates(state)
+    if os.path.exists(args.state_file):
+        os.remove(args.state_file)
+    print(f"\n✅ Mining complete. {added} new candidates added for review.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
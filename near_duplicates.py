@@ -0,0 +1,167 @@
+"""
+Near-duplicate clustering for practice candidates.
+
+Book chunks overlap (prepare_data uses a 200-character overlap) and stored
+candidates are cut to a snippet, so the same passage is often collected
+several times with slightly different edges. Exact-key dedupe misses these.
+
+Each text is turned into a set of character shingles and summarised by a
+MinHash signature. Signatures are split into LSH bands; texts that share a
+band are compared on their estimated Jaccard similarity and joined into one
+cluster when it reaches the threshold.
+"""
+
+import re
+import zlib
+
+import numpy as np
+
+from database import practice_candidate_key
+
+SHINGLE_CHARS = 5
+NUM_PERM = 128
+# BANDS * ROWS must equal NUM_PERM. With 32 x 4 a pair at Jaccard 0.5 shares
+# a band with probability ~0.87, and pairs at 0.8 are practically always found.
+LSH_BANDS = 32
+LSH_ROWS = 4
+SIMILARITY_THRESHOLD = 0.5
+
+_MERSENNE_PRIME = (1 << 31) - 1
+_MAX_HASH = np.uint64(_MERSENNE_PRIME)
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", (text or "").lower()).strip()
+
+
+def shingles(text: str, k: int = SHINGLE_CHARS) -> set:
+    """Hashed character k-grams of the whitespace-normalized, lowercased text."""
+    norm = _normalize(text)
+    if not norm:
+        return set()
+    if len(norm) <= k:
+        return {zlib.crc32(norm.encode("utf-8"))}
+    return {zlib.crc32(norm[i: i + k].encode("utf-8")) for i in range(len(norm) - k + 1)}
+
+
+def _permutations(num_perm: int, seed: int):
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def minhash_signatures(texts, num_perm: int = NUM_PERM, seed: int = 1) -> np.ndarray:
+    """(len(texts), num_perm) array of MinHash values. Empty texts get all-max rows."""
+    a, b = _permutations(num_perm, seed)
+    sigs = np.full((len(texts), num_perm), _MAX_HASH, dtype=np.uint64)
+    for i, text in enumerate(texts):
+        sh = shingles(text)
+        if not sh:
+            continue
+        x = np.fromiter(sh, dtype=np.uint64, count=len(sh)) % _MAX_HASH
+        # (num_perm, 1) * (1, n_shingles); a, x < 2^31 so nothing overflows.
+        hashed = (a[:, None] * x[None, :] + b[:, None]) % _MAX_HASH
+        sigs[i] = hashed.min(axis=1)
+    return sigs
+
+
+def cluster_texts(
+    texts,
+    groups=None,
+    threshold: float = SIMILARITY_THRESHOLD,
+    bands: int = LSH_BANDS,
+    rows: int = LSH_ROWS,
+):
+    """
+    Return a cluster label per text (the index of the cluster's first member).
+
+    groups: optional per-text label; texts in different groups never cluster
+    together (used to keep mantra and meditation candidates apart).
+    """
+    n = len(texts)
+    if groups is None:
+        groups = [None] * n
+    sigs = minhash_signatures(texts, num_perm=bands * rows)
+    empty = [not _normalize(t) for t in texts]
+
+    parent = list(range(n))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    checked = set()
+    for band in range(bands):
+        buckets = {}
+        block = sigs[:, band * rows: (band + 1) * rows]
+        for i in range(n):
+            if empty[i]:
+                continue
+            buckets.setdefault((groups[i], block[i].tobytes()), []).append(i)
+        for members in buckets.values():
+            first = members[0]
+            for other in members[1:]:
+                ra, rb = find(first), find(other)
+                if ra == rb or (first, other) in checked:
+                    continue
+                checked.add((first, other))
+                if np.mean(sigs[first] == sigs[other]) >= threshold:
+                    parent[max(ra, rb)] = min(ra, rb)
+
+    return [find(i) for i in range(n)]
+
+
+def _representative_rank(cand: dict, index: int):
+    # Approved first, so pending copies of an approved passage drop out of
+    # review; then the best mined score, the longest text, the oldest entry.
+    return (
+        not cand.get("approved"),
+        -(cand.get("score") or 0.0),
+        -len(cand.get("text") or ""),
+        index,
+    )
+
+
+def cluster_candidates(candidates: list) -> list:
+    """
+    Label practice candidates in place with their near-duplicate cluster.
+
+    Every candidate gets:
+      - "cluster": practice_candidate_key of the cluster's representative
+      - "representative": True for exactly one candidate per cluster
+    Returns the same list.
+    """
+    if not candidates:
+        return candidates
+
+    labels = cluster_texts(
+        [c.get("text") or "" for c in candidates],
+        groups=[c.get("kind") for c in candidates],
+    )
+
+    members = {}
+    for idx, label in enumerate(labels):
+        members.setdefault(label, []).append(idx)
+
+    for idxs in members.values():
+        rep = min(idxs, key=lambda i: _representative_rank(candidates[i], i))
+        rep_cand = candidates[rep]
+        rep_key = practice_candidate_key(rep_cand.get("kind"), rep_cand.get("source"), rep_cand.get("text"))
+        for i in idxs:
+            candidates[i]["cluster"] = rep_key
+            candidates[i]["representative"] = i == rep
+
+    return candidates
+
+
+def cluster_sizes(candidates: list) -> dict:
+    """cluster key -> number of candidates in it."""
+    sizes = {}
+    for c in candidates:
+        key = c.get("cluster")
+        if key:
+            sizes[key] = sizes.get(key, 0) + 1
+    return sizes
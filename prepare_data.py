@@ -11,16 +11,18 @@ from bs4 import BeautifulSoup
 from pdf2image import convert_from_path
 import pytesseract
 
+from database import book_text_hash, record_book_text_hash
+from index_layout import CHROMA_PATH, index_lock, load_manifest, publish_shard, shard_for_book, stage_shard
+from index_metadata import book_where, chunk_metadata
+from vector_store import backend_name, rebuild_stores
+
 # ----------------- CONFIG -----------------
 
 client = OpenAI()
 
 BOOKS_DIR = "books"
-COLLECTION_NAME = "saint_books"
 UNREADABLE_FILE = "unreadable_books.json"
 
-CHROMA_PATH = "./chroma_db"
-
 # Approximate chunk size in characters per chunk
 CHUNK_SIZE_CHARS = 1500
 CHUNK_OVERLAP_CHARS = 200
@@ -48,16 +50,16 @@ def save_unreadable(data: dict) -> None:
 
 # ----------------- TEXT EXTRACTION -----------------
 
-def ocr_pdf(path: str, max_pages: int = 10) -> str:
+def ocr_pdf_pages(path: str, max_pages: int = 10) -> List[str]:
     """
-    OCR fallback for scanned PDFs.
+    OCR fallback for scanned PDFs, one string per page.
     To control cost/time, we only OCR the first `max_pages` pages.
     """
     try:
         pages = convert_from_path(path, dpi=200)
     except Exception as e:
         print(f"   ⚠ OCR failed for {path}: {e}")
-        return ""
+        return []
 
     texts: List[str] = []
     for i, page in enumerate(pages):
@@ -65,57 +67,64 @@ def ocr_pdf(path: str, max_pages: int = 10) -> str:
             break
         try:
             text = pytesseract.image_to_string(page)
-            if text.strip():
-                texts.append(text)
+            texts.append(text)
         except Exception as e:
             print(f"   ⚠ OCR page {i} failed: {e}")
+            texts.append("")
             continue
 
-    return "\n".join(texts)
+    return texts
 
 
-def extract_text_from_pdf(path: str) -> str:
+def ocr_pdf(path: str, max_pages: int = 10) -> str:
+    return "\n".join(t for t in ocr_pdf_pages(path, max_pages) if t.strip())
+
+
+def extract_segments_from_pdf(path: str) -> List[dict]:
     """
-    Extract text from a PDF. If no selectable text is found,
-    fall back to OCR.
+    Extract text from a PDF, one segment per page. If no selectable text
+    is found, fall back to OCR.
     """
     try:
         reader = pypdf.PdfReader(path)
     except Exception as e:
         print(f"   ❌ Failed to read PDF {path}: {e}")
-        return ""
+        return []
 
-    text_parts: List[str] = []
+    segments: List[dict] = []
 
     for idx, page in enumerate(reader.pages):
         try:
             t = page.extract_text()
             if t:
-                text_parts.append(t)
+                segments.append({"text": t, "page": idx + 1})
         except Exception as e:
             print(f"   ⚠ Error extracting page {idx} of {path}: {e}")
             continue
 
-    text = "\n".join(text_parts)
-
-    if not text.strip():
+    if not any(seg["text"].strip() for seg in segments):
         print("   ⚠ No selectable text in PDF, trying OCR fallback...")
-        text = ocr_pdf(path)
+        segments = [
+            {"text": t, "page": idx + 1}
+            for idx, t in enumerate(ocr_pdf_pages(path))
+            if t.strip()
+        ]
 
-    return text
+    return segments
 
 
-def extract_text_from_epub(path: str) -> str:
+def extract_segments_from_epub(path: str) -> List[dict]:
     """
-    Extract text from EPUB using ebooklib + BeautifulSoup.
+    Extract text from EPUB using ebooklib + BeautifulSoup, one segment per
+    document item, labelled with its first heading.
     """
     try:
         book = epub.read_epub(path)
     except Exception as e:
         print(f"   ❌ Failed to read EPUB {path}: {e}")
-        return ""
+        return []
 
-    texts: List[str] = []
+    segments: List[dict] = []
 
     for item in book.get_items_of_type(ITEM_DOCUMENT):
         try:
@@ -126,56 +135,82 @@ def extract_text_from_epub(path: str) -> str:
             for s in soup(["script", "style"]):
                 s.extract()
 
+            heading = soup.find(["h1", "h2", "h3"]) or soup.find("title")
+            chapter = heading.get_text(" ", strip=True) if heading else ""
+
             t = soup.get_text(separator="\n")
             t = t.strip()
             if t:
-                texts.append(t)
+                segments.append({"text": t, "chapter": chapter or None})
         except Exception as e:
             print(f"   ⚠ Error extracting from EPUB item: {e}")
             continue
 
-    return "\n\n".join(texts)
+    return segments
 
 
-def extract_text(path: str) -> str:
+def extract_segments(path: str):
+    """Return (segments, joiner): the book text is joiner.join(segment texts)."""
     ext = os.path.splitext(path)[1].lower()
     if ext == ".pdf":
-        return extract_text_from_pdf(path)
+        return extract_segments_from_pdf(path), "\n"
     elif ext == ".epub":
-        return extract_text_from_epub(path)
+        return extract_segments_from_epub(path), "\n\n"
     else:
         print(f"   ⚠ Unsupported file type for {path}")
-        return ""
+        return [], "\n"
+
+
+def extract_text_from_pdf(path: str) -> str:
+    return "\n".join(seg["text"] for seg in extract_segments_from_pdf(path))
+
+
+def extract_text_from_epub(path: str) -> str:
+    return "\n\n".join(seg["text"] for seg in extract_segments_from_epub(path))
+
+
+def extract_text(path: str) -> str:
+    segments, joiner = extract_segments(path)
+    return joiner.join(seg["text"] for seg in segments)
 
 
 # ----------------- CHUNKING -----------------
 
-def chunk_text(text: str, chunk_size: int = CHUNK_SIZE_CHARS, overlap: int = CHUNK_OVERLAP_CHARS) -> List[str]:
+def chunk_text_with_offsets(
+    text: str, chunk_size: int = CHUNK_SIZE_CHARS, overlap: int = CHUNK_OVERLAP_CHARS
+) -> List[tuple]:
     """
     Very simple character-based chunking with small overlap.
-    Keeps chunks small enough so that embedding batches stay well under token limits.
+    Returns (start offset in `text`, chunk) pairs; empty chunks are dropped.
     """
+    lead = len(text) - len(text.lstrip())
     text = text.strip()
     if not text:
         return []
 
-    chunks: List[str] = []
+    chunks: List[tuple] = []
     start = 0
     length = len(text)
 
     while start < length:
         end = start + chunk_size
         chunk = text[start:end]
-        chunks.append(chunk.strip())
+        if chunk.strip():
+            chunks.append((lead + start, chunk.strip()))
         start = end - overlap  # slight overlap
         if start < 0:
             start = 0
 
-    # Remove empty
-    chunks = [c for c in chunks if c.strip()]
     return chunks
 
 
+def chunk_text(text: str, chunk_size: int = CHUNK_SIZE_CHARS, overlap: int = CHUNK_OVERLAP_CHARS) -> List[str]:
+    """
+    Keeps chunks small enough so that embedding batches stay well under token limits.
+    """
+    return [chunk for _, chunk in chunk_text_with_offsets(text, chunk_size, overlap)]
+
+
 # ----------------- EMBEDDINGS (BATCHED) -----------------
 
 def embed_texts(chunks: List[str]) -> List[List[float]]:
@@ -215,13 +250,23 @@ def index_single_book(path: str, collection, unreadable: dict) -> None:
 
     print(f"📘 Processing: {path}")
 
-    text = extract_text(path)
+    segments, joiner = extract_segments(path)
+    text = joiner.join(seg["text"] for seg in segments)
     if not text or not text.strip():
         print("   ❌ No text extracted, marking unreadable.")
         unreadable[abs_path] = "no_text_extracted"
         return
 
-    chunks = chunk_text(text)
+    # A re-encoded or renamed copy of a book that is already indexed would
+    # only add the same passages again; skip it before paying for embeddings.
+    duplicate_of = record_book_text_hash(os.path.basename(path), book_text_hash(text))
+    if duplicate_of:
+        print(f"   ⏭ Same text as {duplicate_of}, not indexing this copy.")
+        collection.delete(where=book_where(path))
+        return
+
+    chunks_with_offsets = chunk_text_with_offsets(text)
+    chunks = [chunk for _, chunk in chunks_with_offsets]
     if not chunks:
         print("   ❌ Could not create chunks, marking unreadable.")
         unreadable[abs_path] = "chunking_failed"
@@ -231,15 +276,16 @@ def index_single_book(path: str, collection, unreadable: dict) -> None:
     if abs_path in unreadable:
         del unreadable[abs_path]
 
-    print("   🗑 Removing old chunks from collection...")
-    collection.delete(where={"source": abs_path})
-
+    # Embed first: if that fails the book keeps its old chunks.
     print(f"   🔣 Embedding {len(chunks)} chunks...")
     embeddings = embed_texts(chunks)
 
+    print("   🗑 Removing old chunks from collection...")
+    collection.delete(where=book_where(path))
+
     print("   📦 Storing in Chroma...")
     ids = [f"{file_name}_chunk_{i}" for i in range(len(chunks))]
-    metadatas = [{"source": abs_path} for _ in chunks]
+    metadatas = chunk_metadata(path, chunks_with_offsets, segments, joiner)
 
     collection.add(
         ids=ids,
@@ -260,7 +306,7 @@ def main() -> None:
 
     # Set up Chroma
     chroma_client = chromadb.PersistentClient(path=CHROMA_PATH)
-    collection = chroma_client.get_or_create_collection(COLLECTION_NAME)
+    manifest = load_manifest()
 
     # All PDF/EPUB in books/
     paths = glob.glob(os.path.join(BOOKS_DIR, "*.pdf")) + glob.glob(
@@ -271,8 +317,28 @@ def main() -> None:
         print("⚠ No PDF/EPUB files found in 'books/' folder.")
         return
 
+    # Each book lives in the shard the manifest assigns it to. Every shard
+    # is rebuilt in a staged copy that goes live only once all its books
+    # are done, so chat never sees a book missing or half indexed.
+    by_shard = {}
     for path in sorted(paths):
-        index_single_book(path, collection, unreadable)
+        by_shard.setdefault(shard_for_book(path, manifest), []).append(path)
+
+    for shard, shard_paths in by_shard.items():
+        with index_lock():
+            name, staged = stage_shard(chroma_client, shard)
+            print(f"🧱 Building {name} for shard '{shard}'...\n")
+            for path in shard_paths:
+                try:
+                    index_single_book(path, staged, unreadable)
+                except Exception as e:
+                    print(f"   ❌ Failed, keeping the previous chunks of {os.path.basename(path)}: {e}\n")
+            publish_shard(chroma_client, shard, name, books=shard_paths)
+        print(f"🔀 Shard '{shard}' now served from {name}.\n")
+
+    if backend_name() == "quantized":
+        print("📦 Re-exporting quantized stores...\n")
+        rebuild_stores(chroma_client, shards=list(by_shard))
 
     save_unreadable(unreadable)
 
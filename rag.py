@@ -1,11 +1,19 @@
+import functools
 import os
-import chromadb
 import streamlit as st
-from openai import OpenAI
 
-
-CHROMA_PATH = "./chroma_db"
-COLLECTION_NAME = "saint_books"
+from index_layout import CHROMA_PATH, active_collection_name, layout_version, list_shards, open_collections
+from retrieval_utils import fan_out_query
+from story_engine import (
+    ANSWER_MODEL,
+    CONTEXT_TOKEN_BUDGET,
+    EMBED_MODEL,
+    build_answer_messages,
+    no_passages_message,
+    search_passages,
+    vector_index_mtime,
+)
+from vector_store import backend_name, open_stores
 
 
 # ---------- OPENAI CLIENT ----------
@@ -19,25 +27,66 @@ def _get_api_key():
     return api_key
 
 
-client = OpenAI(api_key=_get_api_key())
+@functools.lru_cache(maxsize=None)
+def get_client():
+    """
+    The shared OpenAI client, created on first use so pages that never call
+    the API do not import openai or resolve secrets. lru_cache rather than
+    st.cache_resource: admin tools call it from worker threads.
+    """
+    from openai import OpenAI
+
+    return OpenAI(api_key=_get_api_key())
 
 
 # ---------- CHROMA COLLECTION ----------
 
 @st.cache_resource
-def get_collection():
+def _open_shard_collections(layout_stamp: float):
     try:
+        import chromadb
+
         chroma_client = chromadb.PersistentClient(path=CHROMA_PATH)
-        return chroma_client.get_or_create_collection(COLLECTION_NAME)
+        return list(open_collections(chroma_client).values())
     except Exception as e:
-        st.error(f"Failed to open Chroma collection: {e}")
+        st.error(f"Failed to open Chroma collections: {e}")
+        st.stop()
+
+
+@st.cache_resource
+def _open_quantized_stores(layout_stamp: float, index_stamp: float):
+    stores = open_stores([active_collection_name(s) for s in list_shards()])
+    if not stores:
+        st.error("VECTOR_BACKEND=quantized but no exported index was found. Run: python vector_store.py build")
         st.stop()
+    return stores
+
+
+def get_collections():
+    """
+    The active collection of every shard; re-opened when shard_manifest.json
+    or active_index.json changes, so a reindex goes live with one pointer flip.
+    With VECTOR_BACKEND=quantized these are the memory-mapped exports from
+    vector_store.py, which answer the same query/get calls.
+    """
+    if backend_name() == "quantized":
+        return _open_quantized_stores(layout_version(), vector_index_mtime())
+    return _open_shard_collections(layout_version())
+
+
+def count_indexed_chunks() -> int:
+    return sum(col.count() for col in get_collections())
+
+
+def query_index(query_embeddings, n_results: int, where=None):
+    """Query all shards in parallel and keep the overall top `n_results` per query."""
+    return fan_out_query(get_collections(), query_embeddings, n_results, where=where)
 
 
 def embed_query(q: str):
     try:
-        r = client.embeddings.create(
-            model="text-embedding-3-small",
+        r = get_client().embeddings.create(
+            model=EMBED_MODEL,
             input=[q],
         )
         return r.data[0].embedding
@@ -46,69 +95,45 @@ def embed_query(q: str):
         st.stop()
 
 
-def retrieve_passages(question: str, k: int = 5):
+def embed_queries(queries: list):
+    """Embed several queries with a single API call, in input order. Errors are raised to the caller."""
+    if not queries:
+        return []
+    r = get_client().embeddings.create(
+        model=EMBED_MODEL,
+        input=list(queries),
+    )
+    return [d.embedding for d in sorted(r.data, key=lambda d: d.index)]
+
+
+def retrieve_passages(
+    question: str,
+    k: int = 5,
+    books=None,
+    deity=None,
+    neighbours: int = 0,
+    token_budget: int = CONTEXT_TOKEN_BUDGET,
+):
     """
-    Search across ALL indexed books.
+    Search across ALL indexed books, or only `books` (file names) and/or
+    passages mentioning `deity` when given; the filters run inside the
+    vector query.
     Try to include passages from multiple different books if available.
+    With `neighbours` > 0 each passage is widened by that many adjacent
+    chunks on each side (fetched by id), within `token_budget`.
     Returns (docs, metas).
     """
-    col = get_collection()
-    if col.count() == 0:
+    if count_indexed_chunks() == 0:
         return [], []
 
     emb = embed_query(question)
 
     try:
-        res = col.query(
-            query_embeddings=[emb],
-            n_results=10,
-        )
+        return search_passages(get_collections(), emb, k, books, deity, neighbours, token_budget)
     except Exception as e:
         st.error(f"Chroma query failed: {e}")
         return [], []
 
-    if (
-        not res
-        or "documents" not in res
-        or not res["documents"]
-        or not res["documents"][0]
-    ):
-        return [], []
-
-    docs_all = res["documents"][0]
-    metas_all = res["metadatas"][0]
-
-    final_docs = []
-    final_metas = []
-    seen_books = set()
-
-    # First pass: at most 1 chunk per distinct book
-    for d, m in zip(docs_all, metas_all):
-        src = m.get("source", "")
-        book_name = os.path.basename(src) if src else "unknown"
-
-        if book_name in seen_books:
-            continue
-
-        final_docs.append(d)
-        final_metas.append(m)
-        seen_books.add(book_name)
-
-        if len(final_docs) >= k:
-            break
-
-    # If still fewer than k, fill up ignoring uniqueness
-    if len(final_docs) < k:
-        for d, m in zip(docs_all, metas_all):
-            if len(final_docs) >= k:
-                break
-            if d in final_docs:
-                continue
-            final_docs.append(d)
-            final_metas.append(m)
-
-    return final_docs, final_metas
-
 
 # ---------- STORY ANSWER GENERATION ----------
 
@@ -118,91 +143,21 @@ def answer_question(
     book_list: list,
     history_messages: list,
     answer_length: str = "Medium",
+    history_summary: str = "",
 ):
-    """Generate a warm, human-style answer based ONLY on the uploaded books."""
+    """
+    Generate a warm, human-style answer based ONLY on the uploaded books.
+    `history_summary` condenses turns older than `history_messages`.
+    """
     if not passages:
-        if book_list:
-            joined = ", ".join(book_list)
-            return (
-                "The uploaded texts do not clearly answer this question.\n\n"
-                "Try asking more specifically, for example:\n"
-                f"- 'Tell me a story about Krishna from these books: {joined}'\n"
-                f"- 'Give me a story about devotion from these books.'\n"
-                f"- 'Tell a story about a cow from these books.'"
-            )
-        else:
-            return (
-                "No books are indexed yet. Please add some PDF/EPUB files "
-                "to the 'books' folder and run indexing."
-            )
-
-    # Build context
-    context = ""
-    for i, p in enumerate(passages):
-        context += f"[Passage {i+1}]\n{p}\n\n"
-
-    # Short conversation history
-    convo_text_lines = []
-    for msg in history_messages[-6:]:
-        role = "User" if msg["role"] == "user" else "Assistant"
-        convo_text_lines.append(f"{role}: {msg['content']}")
-    convo_text = "\n".join(convo_text_lines)
-
-    all_books_str = ", ".join(book_list) if book_list else "Unknown"
-
-    if answer_length.lower() == "short":
-        length_hint = "Keep the answer compact: 3–7 sentences total. Focus on the core idea and one small practice."
-    elif answer_length.lower() == "detailed":
-        length_hint = "You may be more detailed and slow, but still stay focused and not repetitive."
-    else:
-        length_hint = "Keep the answer balanced in length: not too short, not too long."
-
-    system_prompt = f"""
-You are a Hindu STORYTELLER and GENTLE GUIDE for a family-friendly app.
-
-Your knowledge for this conversation comes ONLY from the passages I will give you.
-
-STYLE RULES:
-- Do NOT copy long sentences directly from the passages. Paraphrase.
-- Be clear, kind, devotional, and conversational.
-- Stay within the meaning of the passages and dharmic spirit.
-- If the passages are insufficient, say so gently.
-
-ANSWER SHAPE:
-1) Directly answer the user's question in 2–4 sentences.
-2) Add a short story-like explanation using the passages.
-3) Offer 2–4 gentle, practical suggestions for daily life.
-4) If a specific deity is central (Shiva, Krishna, Devi, etc.), include
-   simple, safe inner ways to connect (remembering qualities, silent name, etc.).
-5) End with 1–2 lines highlighting a key dharmic value (if supported by the text).
-
-ANSWER LENGTH HINT:
-{length_hint}
-"""
-
-    user_prompt = f"""
-CONVERSATION SO FAR:
-{convo_text}
-
-AVAILABLE BOOKS (for context, not for quoting directly):
-{all_books_str}
-
-USER QUESTION NOW:
-{question}
-
-PASSAGES FROM THE UPLOADED BOOKS:
-{context}
-
-Using ONLY these passages, answer in your own words following the style rules above.
-"""
+        return no_passages_message(book_list)
 
     try:
-        r = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
+        r = get_client().chat.completions.create(
+            model=ANSWER_MODEL,
+            messages=build_answer_messages(
+                question, passages, book_list, history_messages, answer_length, history_summary
+            ),
         )
         return r.choices[0].message.content
     except Exception as e:
@@ -289,7 +244,7 @@ Answer: {answer[:1200]}
 """
 
     try:
-        result = client.images.generate(
+        result = get_client().images.generate(
             model="dall-e-3",
             prompt=prompt,
             size="1024x1024",
@@ -0,0 +1,268 @@
+"""
+Helpers for querying the (possibly sharded) Chroma index.
+
+Kept free of Streamlit so the indexers, offline jobs and benchmarks can
+use the same merge and selection logic as the app.
+"""
+
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+_RESULT_FIELDS = ("ids", "documents", "metadatas", "distances")
+
+
+def _empty_result(n_queries: int) -> dict:
+    return {field: [[] for _ in range(n_queries)] for field in _RESULT_FIELDS}
+
+
+def _query_field(result: dict, field: str, q: int) -> list:
+    rows = result.get(field)
+    if rows is None or q >= len(rows) or rows[q] is None:
+        return []
+    return list(rows[q])
+
+
+def merge_query_results(results, n_results: int) -> dict:
+    """
+    Merge Chroma query results from several collections.
+
+    All results must be for the same query embeddings. For each query the
+    hits are pooled and the `n_results` with the smallest distance kept.
+    """
+    results = [r for r in results if r]
+    if not results:
+        return _empty_result(0)
+    if len(results) == 1:
+        return results[0]
+
+    n_queries = max(len(r.get("ids") or []) for r in results)
+    merged = _empty_result(n_queries)
+    for q in range(n_queries):
+        pooled = []
+        for r in results:
+            ids = _query_field(r, "ids", q)
+            docs = _query_field(r, "documents", q)
+            metas = _query_field(r, "metadatas", q)
+            dists = _query_field(r, "distances", q)
+            for i, hit_id in enumerate(ids):
+                pooled.append(
+                    (
+                        dists[i] if i < len(dists) else float("inf"),
+                        hit_id,
+                        docs[i] if i < len(docs) else None,
+                        metas[i] if i < len(metas) else None,
+                    )
+                )
+        pooled.sort(key=lambda hit: hit[0])
+        for dist, hit_id, doc, meta in pooled[:n_results]:
+            merged["ids"][q].append(hit_id)
+            merged["documents"][q].append(doc)
+            merged["metadatas"][q].append(meta)
+            merged["distances"][q].append(dist)
+    return merged
+
+
+def fan_out_query(collections, query_embeddings, n_results: int, where=None, max_workers: int = 8) -> dict:
+    """
+    Run one query against every collection and merge the top hits.
+
+    Shards are queried in parallel; with a single collection this is a plain
+    `collection.query`.
+    """
+    collections = list(collections)
+    kwargs = {"query_embeddings": query_embeddings, "n_results": n_results}
+    if where:
+        kwargs["where"] = where
+
+    if len(collections) == 1:
+        return collections[0].query(**kwargs)
+    if not collections:
+        return _empty_result(len(query_embeddings))
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(collections)))) as pool:
+        results = list(pool.map(lambda col: col.query(**kwargs), collections))
+    return merge_query_results(results, n_results)
+
+
+def select_diverse_passages(docs, metas, k: int):
+    """
+    Pick up to k passages, preferring one per distinct book.
+
+    First pass takes at most one chunk per book in rank order; if that
+    gives fewer than k, the rest is filled in rank order.
+    """
+    final_docs = []
+    final_metas = []
+    seen_books = set()
+
+    for d, m in zip(docs, metas):
+        src = (m or {}).get("source", "")
+        book_name = os.path.basename(src) if src else "unknown"
+
+        if book_name in seen_books:
+            continue
+
+        final_docs.append(d)
+        final_metas.append(m)
+        seen_books.add(book_name)
+
+        if len(final_docs) >= k:
+            break
+
+    if len(final_docs) < k:
+        for d, m in zip(docs, metas):
+            if len(final_docs) >= k:
+                break
+            if d in final_docs:
+                continue
+            final_docs.append(d)
+            final_metas.append(m)
+
+    return final_docs, final_metas
+
+
+# ---------- NEIGHBOUR EXPANSION ----------
+# Chunk ids are "<book file>_chunk_<n>", so the chunks around a hit can be
+# fetched by id with collection.get instead of another vector query.
+
+# Rough size of a token in characters, for budgeting context.
+CHARS_PER_TOKEN = 4
+
+_CHUNK_ID_RE = re.compile(r"^(?P<book>.+)_chunk_(?P<index>\d+)$")
+
+
+def parse_chunk_id(chunk_id: str):
+    """(book, index) for an indexer chunk id, or None."""
+    match = _CHUNK_ID_RE.match(chunk_id or "")
+    if not match:
+        return None
+    return match.group("book"), int(match.group("index"))
+
+
+def chunk_id(book: str, index: int) -> str:
+    return f"{book}_chunk_{index}"
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text or "") + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def fetch_by_ids(collections, ids) -> dict:
+    """id -> (document, metadata) for the ids found in any collection."""
+    ids = list(dict.fromkeys(ids))
+    found = {}
+    if not ids:
+        return found
+    for col in collections:
+        missing = [i for i in ids if i not in found]
+        if not missing:
+            break
+        res = col.get(ids=missing, include=["documents", "metadatas"])
+        for cid, doc, meta in zip(res.get("ids") or [], res.get("documents") or [], res.get("metadatas") or []):
+            found[cid] = (doc, meta)
+    return found
+
+
+def join_overlapping(first: str, second: str, max_overlap: int = 400, probe: int = 40) -> str:
+    """Concatenate two consecutive chunks, dropping the text they share."""
+    if not first:
+        return second or ""
+    if not second:
+        return first
+    head = second[: min(probe, len(second))]
+    tail_start = max(0, len(first) - max_overlap)
+    pos = first.find(head, tail_start)
+    while pos != -1:
+        shared = len(first) - pos
+        if second.startswith(first[pos:]) and shared <= len(second):
+            return first + second[shared:]
+        pos = first.find(head, pos + 1)
+    return first + "\n" + second
+
+
+def expand_with_neighbours(hits, fetch, radius: int = 1, token_budget: int = None):
+    """
+    Widen each hit to its neighbouring chunks and merge overlapping windows.
+
+    hits: list of (chunk_id, doc, meta) in rank order.
+    fetch: callable(ids) -> {id: (doc, meta)}, e.g. a bound fetch_by_ids.
+    radius: neighbours to add on each side.
+    token_budget: optional cap on the estimated tokens of all passages;
+    a widened passage that does not fit falls back to the bare hit.
+
+    Returns (docs, metas) in the rank order of each window's best hit.
+    Hits whose id is not an indexer chunk id are passed through unchanged.
+    """
+    windows = []  # dicts: book, lo, hi, rank, meta, doc (for non-chunk hits)
+    for rank, (cid, doc, meta) in enumerate(hits):
+        parsed = parse_chunk_id(cid)
+        if parsed is None or radius <= 0:
+            windows.append({"book": None, "rank": rank, "doc": doc, "meta": meta, "hit": doc})
+            continue
+        book, index = parsed
+        windows.append(
+            {"book": book, "lo": max(0, index - radius), "hi": index + radius, "rank": rank, "meta": meta, "hit": doc}
+        )
+
+    # Merge windows of the same book that overlap or touch.
+    merged = []
+    by_book = {}
+    for w in windows:
+        if w["book"] is None:
+            merged.append(w)
+            continue
+        by_book.setdefault(w["book"], []).append(w)
+    for book_windows in by_book.values():
+        book_windows.sort(key=lambda w: w["lo"])
+        current = None
+        for w in book_windows:
+            if current and w["lo"] <= current["hi"] + 1:
+                current["hi"] = max(current["hi"], w["hi"])
+                if w["rank"] < current["rank"]:
+                    current.update(rank=w["rank"], meta=w["meta"], hit=w["hit"])
+            else:
+                current = dict(w)
+                merged.append(current)
+    merged.sort(key=lambda w: w["rank"])
+
+    wanted = [
+        chunk_id(w["book"], i)
+        for w in merged
+        if w["book"] is not None
+        for i in range(w["lo"], w["hi"] + 1)
+    ]
+    chunks = fetch(wanted) if wanted else {}
+
+    docs, metas = [], []
+    used = 0
+    for w in merged:
+        if w["book"] is None:
+            text = w["doc"] or ""
+            meta = w["meta"]
+        else:
+            text = ""
+            present = []
+            for i in range(w["lo"], w["hi"] + 1):
+                piece = chunks.get(chunk_id(w["book"], i))
+                if piece and piece[0]:
+                    text = join_overlapping(text, piece[0])
+                    present.append(i)
+            if not present:
+                text = w["hit"] or ""
+            meta = dict(w["meta"] or {})
+            if present:
+                meta["chunk_range"] = f"{present[0]}-{present[-1]}"
+
+        if token_budget is not None:
+            cost = estimate_tokens(text)
+            if used + cost > token_budget:
+                text = w["hit"] or ""
+                meta = w["meta"]
+                cost = estimate_tokens(text)
+                if used + cost > token_budget:
+                    break
+            used += cost
+        docs.append(text)
+        metas.append(meta)
+    return docs, metas
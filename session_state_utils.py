@@ -4,7 +4,7 @@ import datetime
 def bootstrap_session_state(
     st,
     load_sessions,
-    save_sessions,
+    remove_session,
     load_users,
     SESSION_TTL_MINUTES,
 ):
@@ -54,8 +54,7 @@ def bootstrap_session_state(
                     except Exception:
                         expired = True
                 if expired:
-                    sessions.pop(token, None)
-                    save_sessions(sessions)
+                    remove_session(token)
                 else:
                     role_from_sess = sess.get("role")
                     username_from_sess = sess.get("username")
@@ -0,0 +1,233 @@
+"""
+Retrieval and prompt building shared by the Streamlit app (rag.py) and the
+HTTP API (api_server.py).
+
+Nothing here imports Streamlit or creates an OpenAI client: callers embed
+the question with their own (sync or async) client, pass the embedding to
+search_passages() and send build_answer_messages() to the chat model.
+"""
+
+import os
+
+from index_layout import CHROMA_PATH, active_collection_name, layout_version, list_shards, open_collections
+from index_metadata import build_where
+from retrieval_utils import expand_with_neighbours, fan_out_query, fetch_by_ids, select_diverse_passages
+from vector_store import VECTOR_INDEX_DIR, backend_name, open_stores
+
+EMBED_MODEL = "text-embedding-3-small"
+ANSWER_MODEL = "gpt-4o-mini"
+
+# Hits fetched per query before picking k passages from different books.
+POOL_SIZE = 10
+
+# Cap on the estimated tokens of passages sent to the model when
+# neighbouring chunks are added.
+CONTEXT_TOKEN_BUDGET = 3000
+
+HISTORY_TURNS = 6
+
+# Size of the summary of turns older than the recent history.
+SUMMARY_MAX_CHARS = 600
+SUMMARY_QUESTION_CHARS = 120
+
+
+def vector_index_mtime() -> float:
+    """Changes whenever a store is re-exported (0 when there is none)."""
+    latest = 0.0
+    try:
+        for name in os.listdir(VECTOR_INDEX_DIR):
+            marker = os.path.join(VECTOR_INDEX_DIR, name, "store.json")
+            if os.path.exists(marker):
+                latest = max(latest, os.path.getmtime(marker))
+    except OSError:
+        pass
+    return latest
+
+
+def index_stamp() -> tuple:
+    """Changes whenever the collections open_index() returns would change."""
+    return layout_version(), vector_index_mtime()
+
+
+def open_index():
+    """
+    The active collection of every shard: Chroma collections, or the
+    memory-mapped exports from vector_store.py with VECTOR_BACKEND=quantized.
+    Raises when the index cannot be opened.
+    """
+    if backend_name() == "quantized":
+        stores = open_stores([active_collection_name(s) for s in list_shards()])
+        if not stores:
+            raise RuntimeError("VECTOR_BACKEND=quantized but no exported index was found. Run: python vector_store.py build")
+        return stores
+
+    import chromadb
+
+    chroma_client = chromadb.PersistentClient(path=CHROMA_PATH)
+    return list(open_collections(chroma_client).values())
+
+
+def search_passages(
+    collections,
+    embedding,
+    k: int = 5,
+    books=None,
+    deity=None,
+    neighbours: int = 0,
+    token_budget: int = CONTEXT_TOKEN_BUDGET,
+):
+    """
+    Passages for one embedded question, preferring different books.
+    Same filters and neighbour expansion as rag.retrieve_passages.
+    Returns (docs, metas); the query itself raises on failure.
+    """
+    res = fan_out_query(collections, [embedding], POOL_SIZE, where=build_where(books=books, deity=deity))
+    if not res or not res.get("documents") or not res["documents"][0]:
+        return [], []
+
+    metas_all = [dict(m or {}, chunk_id=cid) for m, cid in zip(res["metadatas"][0], res["ids"][0])]
+    docs, metas = select_diverse_passages(res["documents"][0], metas_all, k)
+    if neighbours <= 0:
+        return docs, metas
+
+    try:
+        return expand_with_neighbours(
+            [(m["chunk_id"], d, m) for d, m in zip(docs, metas)],
+            lambda ids: fetch_by_ids(collections, ids),
+            radius=neighbours,
+            token_budget=token_budget,
+        )
+    except Exception:
+        # Context expansion is a nicety; fall back to the plain hits.
+        return docs, metas
+
+
+# ---------- STORY ANSWER PROMPT ----------
+
+def no_passages_message(book_list: list) -> str:
+    if book_list:
+        joined = ", ".join(book_list)
+        return (
+            "The uploaded texts do not clearly answer this question.\n\n"
+            "Try asking more specifically, for example:\n"
+            f"- 'Tell me a story about Krishna from these books: {joined}'\n"
+            f"- 'Give me a story about devotion from these books.'\n"
+            f"- 'Tell a story about a cow from these books.'"
+        )
+    return (
+        "No books are indexed yet. Please add some PDF/EPUB files "
+        "to the 'books' folder and run indexing."
+    )
+
+
+def summarize_history(turns: list, max_chars: int = SUMMARY_MAX_CHARS) -> str:
+    """
+    A short extractive summary of older chat turns: the seeker's questions,
+    newest first, and the books the answers drew on. No model call.
+    """
+    questions, books = [], []
+    for turn in reversed(turns or []):
+        if turn.get("role") == "user":
+            q = " ".join((turn.get("content") or "").split())
+            if len(q) > SUMMARY_QUESTION_CHARS:
+                q = q[:SUMMARY_QUESTION_CHARS].rsplit(" ", 1)[0] + "..."
+            if q and q not in questions:
+                questions.append(q)
+        for book in turn.get("books_used") or []:
+            if book not in books:
+                books.append(book)
+    if not questions:
+        return ""
+
+    summary = "Earlier the seeker asked: "
+    for i, q in enumerate(questions):
+        part = f'"{q}"' if i == 0 else f'; "{q}"'
+        if len(summary) + len(part) > max_chars:
+            break
+        summary += part
+    summary += "."
+    if books:
+        tail = f" Those answers drew on: {', '.join(sorted(books))}."
+        if len(summary) + len(tail) <= max_chars:
+            summary += tail
+    return summary
+
+
+def build_answer_messages(
+    question: str,
+    passages: list,
+    book_list: list,
+    history_messages: list,
+    answer_length: str = "Medium",
+    history_summary: str = "",
+) -> list:
+    """
+    System and user messages asking for an answer based ONLY on `passages`.
+    `history_summary` stands in for turns older than `history_messages`.
+    """
+    # Build context
+    context = ""
+    for i, p in enumerate(passages):
+        context += f"[Passage {i+1}]\n{p}\n\n"
+
+    # Short conversation history
+    convo_text_lines = []
+    for msg in (history_messages or [])[-HISTORY_TURNS:]:
+        role = "User" if msg["role"] == "user" else "Assistant"
+        convo_text_lines.append(f"{role}: {msg['content']}")
+    if history_summary:
+        convo_text_lines.insert(0, f"(Summary of earlier turns) {history_summary}")
+    convo_text = "\n".join(convo_text_lines)
+
+    all_books_str = ", ".join(book_list) if book_list else "Unknown"
+
+    if (answer_length or "").lower() == "short":
+        length_hint = "Keep the answer compact: 3–7 sentences total. Focus on the core idea and one small practice."
+    elif (answer_length or "").lower() == "detailed":
+        length_hint = "You may be more detailed and slow, but still stay focused and not repetitive."
+    else:
+        length_hint = "Keep the answer balanced in length: not too short, not too long."
+
+    system_prompt = f"""
+You are a Hindu STORYTELLER and GENTLE GUIDE for a family-friendly app.
+
+Your knowledge for this conversation comes ONLY from the passages I will give you.
+
+STYLE RULES:
+- Do NOT copy long sentences directly from the passages. Paraphrase.
+- Be clear, kind, devotional, and conversational.
+- Stay within the meaning of the passages and dharmic spirit.
+- If the passages are insufficient, say so gently.
+
+ANSWER SHAPE:
+1) Directly answer the user's question in 2–4 sentences.
+2) Add a short story-like explanation using the passages.
+3) Offer 2–4 gentle, practical suggestions for daily life.
+4) If a specific deity is central (Shiva, Krishna, Devi, etc.), include
+   simple, safe inner ways to connect (remembering qualities, silent name, etc.).
+5) End with 1–2 lines highlighting a key dharmic value (if supported by the text).
+
+ANSWER LENGTH HINT:
+{length_hint}
+"""
+
+    user_prompt = f"""
+CONVERSATION SO FAR:
+{convo_text}
+
+AVAILABLE BOOKS (for context, not for quoting directly):
+{all_books_str}
+
+USER QUESTION NOW:
+{question}
+
+PASSAGES FROM THE UPLOADED BOOKS:
+{context}
+
+Using ONLY these passages, answer in your own words following the style rules above.
+"""
+
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+    ]
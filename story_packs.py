@@ -0,0 +1,354 @@
+"""
+Generate story packs offline: answers to a file of questions, written to
+JSONL with the passages and books each answer was based on.
+
+Questions come from a .txt file (one per line; blank lines and lines
+starting with # are skipped) or a .jsonl file of objects with "question"
+and optionally "id", "books", "deity" and "answer_length", which override
+the command-line filters for that line.
+
+The output file is also the checkpoint: every answer is appended as soon
+as it is ready, and a rerun skips question ids already in it, so an
+interrupted or partly failed run is resumed by running it again.
+
+With --batch, retrieval runs now and the answers are requested through
+the OpenAI Batch API (half price, done within 24 hours); the batch id is
+kept in <output>.batch.json and --collect writes the answers once the
+batch has finished.
+
+Usage:
+    python story_packs.py questions.txt -o packs/shiva.jsonl --deity shiva
+    python story_packs.py questions.jsonl -o packs/diwali.jsonl --workers 8
+    python story_packs.py questions.txt -o packs/shiva.jsonl --batch
+    python story_packs.py -o packs/shiva.jsonl --collect
+"""
+
+import argparse
+import datetime
+import hashlib
+import io
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from openai import OpenAI
+
+from database import list_book_names
+from story_engine import (
+    ANSWER_MODEL,
+    EMBED_MODEL,
+    build_answer_messages,
+    no_passages_message,
+    open_index,
+    search_passages,
+)
+
+DEFAULT_WORKERS = 4
+EMBED_BATCH_SIZE = 100
+OPENAI_MAX_RETRIES = 5
+
+
+# ---------- QUESTIONS / CHECKPOINT ----------
+
+def question_id(question: str, books=None, deity=None, answer_length: str = "Medium") -> str:
+    key = json.dumps([question, sorted(books or []), deity or "", answer_length], ensure_ascii=False)
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+
+
+def load_questions(path: str, books=None, deity=None, answer_length: str = "Medium") -> list:
+    """Question dicts (id, question, books, deity, answer_length), duplicates dropped."""
+    items = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if path.endswith(".jsonl"):
+                entry = json.loads(line)
+            else:
+                entry = {"question": line}
+            q = {
+                "question": str(entry.get("question") or "").strip(),
+                "books": entry.get("books", books) or [],
+                "deity": (entry.get("deity", deity) or "").lower() or None,
+                "answer_length": entry.get("answer_length") or answer_length,
+            }
+            if not q["question"]:
+                continue
+            q["id"] = str(entry.get("id") or question_id(q["question"], q["books"], q["deity"], q["answer_length"]))
+            items.append(q)
+
+    seen = set()
+    unique = []
+    for q in items:
+        if q["id"] not in seen:
+            seen.add(q["id"])
+            unique.append(q)
+    return unique
+
+
+def done_ids(output_path: str) -> set:
+    """Ids already answered in the output file (a torn last line is ignored)."""
+    ids = set()
+    if not os.path.exists(output_path):
+        return ids
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                ids.add(json.loads(line)["id"])
+            except (ValueError, KeyError, TypeError):
+                continue
+    return ids
+
+
+class PackWriter:
+    """Appends records to the output JSONL, one complete line per write."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+        # An interrupted run may have left a torn last line; end it so the
+        # next record starts on a line of its own.
+        if self._file.tell() > 0:
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self._file.write("\n")
+                    self._file.flush()
+
+    def write(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+# ---------- GENERATION ----------
+
+def embed_all(client, questions: list) -> list:
+    embeddings = []
+    for i in range(0, len(questions), EMBED_BATCH_SIZE):
+        batch = [q["question"] for q in questions[i:i + EMBED_BATCH_SIZE]]
+        r = client.embeddings.create(model=EMBED_MODEL, input=batch)
+        embeddings.extend(d.embedding for d in sorted(r.data, key=lambda d: d.index))
+    return embeddings
+
+
+def retrieve_for(collections, q: dict, embedding, k: int, neighbours: int):
+    docs, metas = search_passages(collections, embedding, k, q["books"] or None, q["deity"], neighbours)
+    passages = [
+        {
+            "text": d,
+            "book": (m or {}).get("book") or os.path.basename((m or {}).get("source") or ""),
+            "chunk_id": (m or {}).get("chunk_id"),
+        }
+        for d, m in zip(docs, metas)
+    ]
+    return docs, passages
+
+
+def make_record(q: dict, answer: str, passages: list, model: str) -> dict:
+    return {
+        "id": q["id"],
+        "question": q["question"],
+        "deity": q["deity"],
+        "books": q["books"],
+        "answer_length": q["answer_length"],
+        "answer": answer,
+        "passages": passages,
+        "sources": sorted({p["book"] for p in passages if p["book"]}),
+        "model": model,
+        "generated_at": datetime.datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+def run_live(client, questions: list, writer: PackWriter, workers: int, k: int, neighbours: int) -> int:
+    """Answer every question with up to `workers` requests in flight. Returns the number that failed."""
+    collections = open_index()
+    book_list = list_book_names()
+    embeddings = embed_all(client, questions)
+
+    def answer_one(q, emb):
+        docs, passages = retrieve_for(collections, q, emb, k, neighbours)
+        if not docs:
+            return make_record(q, no_passages_message(book_list), passages, None)
+        r = client.chat.completions.create(
+            model=ANSWER_MODEL,
+            messages=build_answer_messages(q["question"], docs, book_list, [], q["answer_length"]),
+        )
+        return make_record(q, r.choices[0].message.content, passages, ANSWER_MODEL)
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(answer_one, q, emb): q for q, emb in zip(questions, embeddings)}
+        for n, future in enumerate(as_completed(futures), start=1):
+            q = futures[future]
+            try:
+                writer.write(future.result())
+                print(f"   ✅ [{n}/{len(questions)}] {q['question'][:70]}")
+            except Exception as e:
+                failed += 1
+                print(f"   ❌ [{n}/{len(questions)}] {q['question'][:70]}: {e}")
+    return failed
+
+
+# ---------- BATCH API ----------
+
+def batch_state_path(output_path: str) -> str:
+    return output_path + ".batch.json"
+
+
+def submit_batch(client, questions: list, writer: PackWriter, output_path: str, k: int, neighbours: int) -> str:
+    """Retrieve now, queue the answers as one batch. Returns the batch id (None if nothing to queue)."""
+    collections = open_index()
+    book_list = list_book_names()
+    embeddings = embed_all(client, questions)
+
+    pending = {}
+    requests_jsonl = io.StringIO()
+    for q, emb in zip(questions, embeddings):
+        docs, passages = retrieve_for(collections, q, emb, k, neighbours)
+        if not docs:
+            writer.write(make_record(q, no_passages_message(book_list), passages, None))
+            continue
+        pending[q["id"]] = {"question": q, "passages": passages}
+        body = {
+            "model": ANSWER_MODEL,
+            "messages": build_answer_messages(q["question"], docs, book_list, [], q["answer_length"]),
+        }
+        requests_jsonl.write(
+            json.dumps({"custom_id": q["id"], "method": "POST", "url": "/v1/chat/completions", "body": body}, ensure_ascii=False)
+            + "\n"
+        )
+    if not pending:
+        return None
+
+    upload = client.files.create(
+        file=("story_pack_requests.jsonl", requests_jsonl.getvalue().encode("utf-8")),
+        purpose="batch",
+    )
+    batch = client.batches.create(
+        input_file_id=upload.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+    state = {"batch_id": batch.id, "input_file_id": upload.id, "pending": pending}
+    tmp = batch_state_path(output_path) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp, batch_state_path(output_path))
+    return batch.id
+
+
+def collect_batch(client, writer: PackWriter, output_path: str):
+    """
+    Write the answers of a finished batch. Returns (status, written, failed),
+    with written None while the batch is still running; the state file is
+    removed once the batch is done with.
+    """
+    state_path = batch_state_path(output_path)
+    with open(state_path, "r", encoding="utf-8") as f:
+        state = json.load(f)
+
+    batch = client.batches.retrieve(state["batch_id"])
+    if batch.status not in ("completed", "failed", "expired", "cancelled"):
+        return batch.status, None, None
+
+    already = done_ids(output_path)
+    written = 0
+    if batch.output_file_id:
+        for line in client.files.content(batch.output_file_id).text.splitlines():
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            item = state["pending"].get(result.get("custom_id"))
+            response = result.get("response") or {}
+            if not item or item["question"]["id"] in already or response.get("status_code") != 200:
+                continue
+            body = response.get("body") or {}
+            answer = body["choices"][0]["message"]["content"]
+            writer.write(make_record(item["question"], answer, item["passages"], body.get("model") or ANSWER_MODEL))
+            already.add(item["question"]["id"])
+            written += 1
+
+    failed = len([qid for qid in state["pending"] if qid not in already])
+    os.remove(state_path)
+    return batch.status, written, failed
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("questions", nargs="?", help=".txt or .jsonl file of questions")
+    parser.add_argument("-o", "--output", required=True, help="JSONL file to append answers to")
+    parser.add_argument("--books", nargs="*", default=None, help="only search these book file names")
+    parser.add_argument("--deity", default=None, help="only passages mentioning this deity")
+    parser.add_argument("--answer-length", default="Medium", choices=["Short", "Medium", "Detailed"])
+    parser.add_argument("-k", type=int, default=5, help="passages per answer")
+    parser.add_argument("--neighbours", type=int, default=1, help="adjacent chunks added on each side")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="questions answered at once")
+    parser.add_argument("--batch", action="store_true", help="queue the answers with the Batch API")
+    parser.add_argument("--collect", action="store_true", help="write the answers of a queued batch")
+    args = parser.parse_args()
+
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        print("OPENAI_API_KEY is not configured.")
+        return 1
+    client = OpenAI(api_key=api_key, max_retries=OPENAI_MAX_RETRIES)
+    state_path = batch_state_path(args.output)
+
+    if args.collect:
+        if not os.path.exists(state_path):
+            print(f"No queued batch for {args.output}.")
+            return 1
+        writer = PackWriter(args.output)
+        try:
+            status, written, failed = collect_batch(client, writer, args.output)
+        finally:
+            writer.close()
+        if written is None:
+            print(f"⏳ Batch is {status}; try again later.")
+            return 0
+        print(f"📦 Batch {status}: {written} answers written, {failed} not answered.")
+        if failed:
+            print("   Run the same questions again (live or --batch) to retry them.")
+        return 1 if failed else 0
+
+    if not args.questions:
+        parser.error("a questions file is required unless --collect is given")
+    if args.batch and os.path.exists(state_path):
+        print(f"A batch is already queued for {args.output}; run with --collect first.")
+        return 1
+
+    questions = load_questions(args.questions, args.books, args.deity, args.answer_length)
+    finished = done_ids(args.output)
+    todo = [q for q in questions if q["id"] not in finished]
+    print(f"📚 {len(questions)} questions, {len(questions) - len(todo)} already answered, {len(todo)} to go.")
+    if not todo:
+        return 0
+
+    writer = PackWriter(args.output)
+    try:
+        if args.batch:
+            batch_id = submit_batch(client, todo, writer, args.output, args.k, args.neighbours)
+            if batch_id:
+                print(f"📨 Queued batch {batch_id}. Collect with: python story_packs.py -o {args.output} --collect")
+            return 0
+        failed = run_live(client, todo, writer, max(1, args.workers), args.k, args.neighbours)
+    finally:
+        writer.close()
+
+    print(f"\n✅ {len(todo) - failed} answered, ❌ {failed} failed -> {args.output}")
+    if failed:
+        print("   Run the same command again to retry the failed questions.")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
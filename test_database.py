@@ -0,0 +1,201 @@
+import importlib
+import random
+import sqlite3
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """database module pointed at a fresh SQLite file."""
+    monkeypatch.chdir(tmp_path)
+    database = importlib.import_module("database")
+    monkeypatch.setattr(database, "DB_FILE", str(tmp_path / "test.db"))
+    database.init_db()
+    return database
+
+
+def _level_rows(db_file, deity, level):
+    conn = sqlite3.connect(db_file)
+    rows = conn.execute(
+        "SELECT id, section_number, sort_order FROM mantras WHERE deity_id = ? AND level_number = ?",
+        (deity, level),
+    ).fetchall()
+    conn.close()
+    return rows
+
+
+def test_reorder_is_applied_as_a_whole(db):
+    ids = [db.add_structured_mantra("Shiva", 1, f"t{i}", "om")["id"] for i in range(5)]
+    new_order = list(reversed(ids))
+    assert db.reorder_mantras_for_level("Shiva", 1, new_order)
+    assert [m["id"] for m in db.get_mantras_for_level("Shiva", 1)] == new_order
+    assert sorted(sec for _, sec, _ in _level_rows(db.DB_FILE, "Shiva", 1)) == [1, 2, 3, 4, 5]
+
+
+def test_delete_closes_section_gap(db):
+    ids = [db.add_structured_mantra("Devi", 2, f"t{i}", "om")["id"] for i in range(4)]
+    db.delete_structured_mantra(ids[1])
+    mantras = db.get_mantras_for_level("Devi", 2)
+    assert [m["id"] for m in mantras] == [ids[0], ids[2], ids[3]]
+    assert [m["section_number"] for m in mantras] == [1, 2, 3]
+
+
+def test_parallel_adds_and_reorders_keep_sections_contiguous(db):
+    adders, adds_each, reorderers = 6, 15, 3
+    added = []
+    errors = []
+    stop = threading.Event()
+    lock = threading.Lock()
+
+    def add_worker(n):
+        for i in range(adds_each):
+            row = db.add_structured_mantra("Krishna", 1, f"w{n}-{i}", "om")
+            with lock:
+                if row is None:
+                    errors.append(f"add failed for w{n}-{i}")
+                else:
+                    added.append(row)
+
+    def reorder_worker(seed):
+        rng = random.Random(seed)
+        while not stop.is_set():
+            ids = [m["id"] for m in db.get_mantras_for_level("Krishna", 1)]
+            rng.shuffle(ids)
+            if ids and not db.reorder_mantras_for_level("Krishna", 1, ids):
+                with lock:
+                    errors.append("reorder failed")
+
+    threads = [threading.Thread(target=reorder_worker, args=(s,)) for s in range(reorderers)]
+    add_threads = [threading.Thread(target=add_worker, args=(n,)) for n in range(adders)]
+    for t in threads + add_threads:
+        t.start()
+    for t in add_threads:
+        t.join()
+    stop.set()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    assert len(added) == adders * adds_each
+    rows = _level_rows(db.DB_FILE, "Krishna", 1)
+    total = adders * adds_each
+    assert sorted(sec for _, sec, _ in rows) == list(range(1, total + 1))
+    assert all(sec == sort for _, sec, sort in rows)
+    assert db.get_level_progress_summary("nobody", "Krishna") == {1: (0, total)}
+
+
+def test_candidate_pages_and_batched_approval(db):
+    db.save_practice_candidates(
+        [{"kind": "mantra", "source": f"/books/b{i % 2}.pdf", "text": f"japa passage {i}"} for i in range(30)]
+    )
+    rows, total = db.query_practice_candidates(kind="mantra", source_names=["b0.pdf"], limit=10, offset=10)
+    assert total == 15
+    assert len(rows) == 5
+
+    assert db.approve_practice_candidates([r["id"] for r in rows] + [rows[0]["id"]]) == 5
+    assert db.count_approved_practices("mantra") == 5
+    assert db.query_practice_candidates(kind="mantra", limit=0)[1] == 25
+
+    # A scan that loaded the list before the approval must not undo it or drop rows.
+    stale = [dict(rows[0], approved=False), {"kind": "mantra", "source": "/books/b2.pdf", "text": "new passage"}]
+    db.save_practice_candidates(stale)
+    assert db.query_practice_candidates(kind="mantra", limit=0)[1] == 26
+    assert db.query_practice_candidates(kind="mantra", approved=True, limit=0)[1] == 5
+
+
+def test_book_registry_spots_identical_files_and_text(db, tmp_path):
+    books = tmp_path / "books"
+    books.mkdir()
+    (books / "gita.pdf").write_bytes(b"%PDF gita")
+    (books / "gita_scan.pdf").write_bytes(b"%PDF other bytes")
+
+    hashes = db.sync_book_registry()
+    assert db.find_book_by_sha256(hashes["gita.pdf"]) == "gita.pdf"
+    assert db.find_book_by_sha256(db.file_sha256(str(books / "gita_scan.pdf"))) == "gita_scan.pdf"
+
+    assert db.record_book_text_hash("gita.pdf", db.book_text_hash("Karmanye  vadhikaraste")) is None
+    assert db.record_book_text_hash("gita_scan.pdf", db.book_text_hash("karmanye\nvadhikaraste ")) == "gita.pdf"
+    assert db.list_duplicate_books() == {"gita_scan.pdf": "gita.pdf"}
+
+    (books / "gita.pdf").unlink()
+    db.sync_book_registry()
+    assert db.find_book_by_sha256(hashes["gita.pdf"]) is None
+    # The copy is no longer a duplicate of anything and must be indexed.
+    assert db.list_duplicate_books() == {}
+    assert db.books_to_reindex() == ["gita_scan.pdf"]
+    assert db.record_book_text_hash("gita_scan.pdf", db.book_text_hash("karmanye vadhikaraste")) is None
+    assert db.mark_book_reindexed("gita_scan.pdf")
+    assert db.books_to_reindex() == []
+
+
+def test_chat_turns_page_backwards_and_prune(db, monkeypatch):
+    security_utils = importlib.import_module("security_utils")
+    monkeypatch.setattr(security_utils, "encrypt_field", lambda v: v[::-1])
+    monkeypatch.setattr(security_utils, "decrypt_field", lambda v: v[::-1])
+    ids = [
+        db.save_chat_turn("c1", {"role": "user" if i % 2 == 0 else "assistant", "content": f"m{i}", "passages": [f"p{i}"]})
+        for i in range(7)
+    ]
+    db.save_chat_turn("c2", {"role": "user", "content": "other"}, user_id="asha")
+
+    latest = db.load_chat_turns("c1", limit=3)
+    assert [t["content"] for t in latest] == ["m4", "m5", "m6"]
+    assert latest[0]["passages"] == ["p4"]
+    assert db.count_chat_turns("c1", before_id=latest[0]["id"]) == 4
+    earlier = db.load_chat_turns("c1", before_id=latest[0]["id"], limit=3)
+    assert [t["id"] for t in earlier] == ids[1:4]
+
+    conn = sqlite3.connect(db.DB_FILE)
+    assert conn.execute("SELECT user_id, content FROM chat_turns WHERE conversation_id = 'c2'").fetchone() == (
+        "asha",
+        "rehto",
+    )
+    conn.execute("UPDATE chat_turns SET created_at = '2000-01-01T00:00:00' WHERE conversation_id = 'c2'")
+    conn.commit()
+    conn.close()
+    db.init_db()
+    assert db.count_chat_turns("c2") == 0
+    assert db.count_chat_turns("c1") == 7
+
+
+def test_failed_migration_keeps_earlier_steps(db, monkeypatch, caplog):
+    def _broken(cur):
+        cur.execute("CREATE TABLE half_done (id INTEGER)")
+        raise ValueError("boom")
+
+    latest = db.SCHEMA_MIGRATIONS[-1][0]
+    monkeypatch.setattr(db, "SCHEMA_MIGRATIONS", db.SCHEMA_MIGRATIONS + [(latest + 1, _broken)])
+    db.init_db()
+
+    conn = sqlite3.connect(db.DB_FILE)
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    conn.close()
+    assert version == latest
+    assert "half_done" not in tables
+    assert "schema migration" in caplog.text
+
+
+def test_parallel_favourite_and_session_writes_are_not_lost(db):
+    def worker(n):
+        for i in range(20):
+            db.add_favourite("asha", f"story {n}-{i}", [])
+            db.add_session("user", f"u{n}-{i}")
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(db.load_favourites()["asha"]) == 80
+    assert not db.add_favourite("asha", "story 0-0", [])
+    assert db.remove_favourite("asha", 0)
+    assert not db.remove_favourite("asha", 79)
+    sessions = db.load_sessions()
+    assert len(sessions) == 80
+    token = next(iter(sessions))
+    db.remove_session(token)
+    assert token not in db.load_sessions()
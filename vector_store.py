@@ -0,0 +1,388 @@
+"""
+Quantized, memory-mapped vector store: an alternative to querying Chroma.
+
+Each Chroma collection (shard) can be exported to a directory under
+VECTOR_INDEX_DIR holding:
+  - vectors.i8.npy   int8 vectors (unit-normalised, one scale per row),
+                     scanned for every query: 1 byte per dimension
+                     instead of 4,
+  - scales.f32.npy   per-row dequantisation scale,
+  - vectors.f32.npy  the full-precision unit vectors, read only for the
+                     few candidates that are re-scored,
+  - chunks.db        SQLite with id, document and metadata per row
+                     (lookups by id and `where` filters),
+  - store.json       row count and dimension, written last.
+
+All arrays are opened with numpy.memmap, so every Streamlit worker maps
+the same pages from the OS page cache instead of holding its own copy.
+Search is a blocked int8 matrix-vector product followed by exact cosine
+re-scoring of the best candidates.
+
+The store answers the subset of the Chroma collection API the app uses
+(count, query, get), so retrieval code works with either backend. The app
+uses it when VECTOR_BACKEND=quantized is set.
+
+Usage:
+    python vector_store.py build     # export every shard from Chroma
+    python vector_store.py info      # sizes of the exported stores
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import sys
+
+import numpy as np
+
+VECTOR_BACKEND_ENV = "VECTOR_BACKEND"
+VECTOR_INDEX_DIR = "./vector_index"
+
+# Candidates re-scored at full precision per requested result.
+RESCORE_FACTOR = 8
+MIN_RESCORE = 64
+# Rows dequantised at a time while scanning (bounds temporary memory).
+SCAN_BLOCK_ROWS = 32768
+
+
+def backend_name() -> str:
+    return (os.getenv(VECTOR_BACKEND_ENV) or "chroma").strip().lower()
+
+
+def store_path(collection_name: str, root: str = VECTOR_INDEX_DIR) -> str:
+    return os.path.join(root, collection_name)
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def quantize(vectors: np.ndarray):
+    """Unit-normalise rows and quantise to int8 with one scale per row."""
+    unit = _normalize_rows(np.asarray(vectors, dtype=np.float32))
+    scales = np.abs(unit).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    q = np.clip(np.rint(unit / scales[:, None]), -127, 127).astype(np.int8)
+    return q, scales.astype(np.float32), unit
+
+
+# ---------- BUILD ----------
+
+class _StoreWriter:
+    """Appends rows to a store being built in a temporary directory."""
+
+    def __init__(self, path: str, dim: int, capacity: int):
+        self.path = path
+        self.dim = dim
+        self.capacity = max(1, capacity)
+        self.rows = 0
+        os.makedirs(path, exist_ok=True)
+        shape = (self.capacity, dim)
+        self.q = np.lib.format.open_memmap(os.path.join(path, "vectors.i8.npy"), mode="w+", dtype=np.int8, shape=shape)
+        self.full = np.lib.format.open_memmap(
+            os.path.join(path, "vectors.f32.npy"), mode="w+", dtype=np.float32, shape=shape
+        )
+        self.scales = np.lib.format.open_memmap(
+            os.path.join(path, "scales.f32.npy"), mode="w+", dtype=np.float32, shape=(self.capacity,)
+        )
+        self.conn = sqlite3.connect(os.path.join(path, "chunks.db"))
+        self.conn.execute(
+            "CREATE TABLE chunks (row INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, document TEXT, metadata TEXT)"
+        )
+
+    def add(self, ids, embeddings, documents, metadatas):
+        """Append rows; rows beyond the capacity are dropped. Returns how many were written."""
+        n = min(len(ids), self.capacity - self.rows)
+        if n <= 0:
+            return 0
+        ids, embeddings = list(ids)[:n], embeddings[:n]
+        documents, metadatas = list(documents)[:n], list(metadatas)[:n]
+        q, scales, unit = quantize(embeddings)
+        start, end = self.rows, self.rows + len(ids)
+        self.q[start:end] = q
+        self.scales[start:end] = scales
+        self.full[start:end] = unit
+        self.conn.executemany(
+            "INSERT INTO chunks (row, id, document, metadata) VALUES (?, ?, ?, ?)",
+            [
+                (start + i, ids[i], documents[i], json.dumps(metadatas[i] or {}, ensure_ascii=False))
+                for i in range(len(ids))
+            ],
+        )
+        self.rows = end
+        return n
+
+    def close(self):
+        for arr in (self.q, self.full, self.scales):
+            arr.flush()
+        self.conn.commit()
+        self.conn.close()
+        with open(os.path.join(self.path, "store.json"), "w", encoding="utf-8") as f:
+            json.dump({"rows": self.rows, "dim": self.dim}, f)
+
+
+def build_from_chroma(col, path: str, page_size: int = 1000) -> int:
+    """
+    Export a Chroma collection to `path`, replacing any previous export
+    atomically. The arrays are sized from col.count() up front; chunks
+    added while the export runs are left for the next one.
+    """
+    total = col.count()
+    tmp = path + ".building"
+    shutil.rmtree(tmp, ignore_errors=True)
+
+    writer = None
+    offset = 0
+    while offset < total:
+        page = col.get(limit=page_size, offset=offset, include=["documents", "metadatas", "embeddings"])
+        ids = page.get("ids") or []
+        if not ids:
+            break
+        emb = np.asarray(page.get("embeddings"), dtype=np.float32)
+        if writer is None:
+            writer = _StoreWriter(tmp, emb.shape[1], total)
+        writer.add(ids, emb, page.get("documents") or [None] * len(ids), page.get("metadatas") or [{}] * len(ids))
+        offset += len(ids)
+        if writer.rows >= writer.capacity:
+            break
+
+    if writer is None:
+        writer = _StoreWriter(tmp, 1, 1)
+    writer.close()
+
+    old = path + ".old"
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(path):
+        os.replace(path, old)
+    os.replace(tmp, path)
+    shutil.rmtree(old, ignore_errors=True)
+    return writer.rows
+
+
+def build_from_arrays(path: str, ids, embeddings, documents=None, metadatas=None) -> int:
+    """Write a store directly from in-memory arrays (benchmarks, tests)."""
+    emb = np.asarray(embeddings, dtype=np.float32)
+    shutil.rmtree(path, ignore_errors=True)
+    writer = _StoreWriter(path, emb.shape[1], len(ids))
+    writer.add(list(ids), emb, documents or [None] * len(ids), metadatas or [{}] * len(ids))
+    writer.close()
+    return writer.rows
+
+
+# ---------- WHERE FILTERS ----------
+
+def _where_sql(where: dict):
+    """Translate the Chroma `where` operators the app uses into SQL over metadata JSON."""
+    clauses, params = [], []
+    for key, cond in where.items():
+        if key in ("$and", "$or"):
+            parts = [_where_sql(sub) for sub in cond]
+            joiner = " AND " if key == "$and" else " OR "
+            clauses.append("(" + joiner.join(p[0] for p in parts) + ")")
+            for p in parts:
+                params.extend(p[1])
+            continue
+        field = f"json_extract(metadata, '$.\"{key}\"')"
+        if not isinstance(cond, dict):
+            cond = {"$eq": cond}
+        for op, value in cond.items():
+            if op in ("$in", "$nin"):
+                values = list(value)
+                marks = ", ".join("?" for _ in values)
+                clauses.append(f"{field} {'IN' if op == '$in' else 'NOT IN'} ({marks})")
+                params.extend(values)
+            else:
+                sql_op = {"$eq": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}[op]
+                clauses.append(f"{field} {sql_op} ?")
+                params.append(value)
+    return " AND ".join(clauses) or "1", params
+
+
+# ---------- SEARCH ----------
+
+class QuantizedVectorStore:
+    """Read-only store with the Chroma-collection methods retrieval needs."""
+
+    def __init__(self, path: str, name: str = None):
+        self.path = path
+        self.name = name or os.path.basename(os.path.normpath(path))
+        with open(os.path.join(path, "store.json"), "r", encoding="utf-8") as f:
+            info = json.load(f)
+        self.rows = int(info["rows"])
+        self.dim = int(info["dim"])
+        self.q = np.load(os.path.join(path, "vectors.i8.npy"), mmap_mode="r")
+        self.scales = np.load(os.path.join(path, "scales.f32.npy"), mmap_mode="r")
+        self.full = np.load(os.path.join(path, "vectors.f32.npy"), mmap_mode="r")
+        # One read-only connection per call keeps the store thread-safe for
+        # the parallel shard fan-out.
+        self._db = os.path.join(path, "chunks.db")
+
+    def _connect(self):
+        return sqlite3.connect(f"file:{self._db}?mode=ro", uri=True)
+
+    def count(self) -> int:
+        return self.rows
+
+    def _allowed_rows(self, where):
+        if not where:
+            return None
+        sql, params = _where_sql(where)
+        conn = self._connect()
+        try:
+            rows = [r[0] for r in conn.execute(f"SELECT row FROM chunks WHERE {sql} ORDER BY row", params)]
+        finally:
+            conn.close()
+        return np.asarray(rows, dtype=np.int64)
+
+    def _approx_scores(self, query: np.ndarray, rows=None) -> np.ndarray:
+        n = self.rows if rows is None else len(rows)
+        out = np.empty(n, dtype=np.float32)
+        for start in range(0, n, SCAN_BLOCK_ROWS):
+            end = min(n, start + SCAN_BLOCK_ROWS)
+            if rows is None:
+                block = self.q[start:end]
+                scales = self.scales[start:end]
+            else:
+                idx = rows[start:end]
+                block = self.q[idx]
+                scales = self.scales[idx]
+            out[start:end] = (block.astype(np.float32) @ query) * scales
+        return out
+
+    def search(self, query_embedding, n_results: int, where=None):
+        """[(row, cosine similarity)] best first."""
+        if self.rows == 0:
+            return []
+        query = _normalize_rows(np.asarray(query_embedding, dtype=np.float32).reshape(1, -1))[0]
+        rows = self._allowed_rows(where)
+        if rows is not None and len(rows) == 0:
+            return []
+
+        approx = self._approx_scores(query, rows)
+        n_cand = min(len(approx), max(MIN_RESCORE, n_results * RESCORE_FACTOR))
+        cand = np.argpartition(-approx, n_cand - 1)[:n_cand] if n_cand < len(approx) else np.arange(len(approx))
+        cand_rows = cand if rows is None else rows[cand]
+        cand_rows = np.sort(cand_rows)  # sequential reads from the memmap
+
+        exact = self.full[cand_rows] @ query
+        order = np.argsort(-exact)[:n_results]
+        return [(int(cand_rows[i]), float(exact[i])) for i in order]
+
+    def _rows_to_records(self, rows):
+        if not rows:
+            return {}
+        conn = self._connect()
+        try:
+            marks = ", ".join("?" for _ in rows)
+            cur = conn.execute(f"SELECT row, id, document, metadata FROM chunks WHERE row IN ({marks})", rows)
+            return {r[0]: (r[1], r[2], json.loads(r[3]) if r[3] else {}) for r in cur}
+        finally:
+            conn.close()
+
+    def query(self, query_embeddings, n_results: int = 10, where=None, include=None):
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for emb in query_embeddings:
+            hits = self.search(emb, n_results, where=where)
+            records = self._rows_to_records([row for row, _ in hits])
+            result["ids"].append([records[row][0] for row, _ in hits])
+            result["documents"].append([records[row][1] for row, _ in hits])
+            result["metadatas"].append([records[row][2] for row, _ in hits])
+            # Cosine distance, like a Chroma collection with hnsw:space=cosine.
+            result["distances"].append([1.0 - score for _, score in hits])
+        return result
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=None):
+        if include is None:
+            include = ["documents", "metadatas"]
+        clauses, params = [], []
+        if ids is not None:
+            ids = list(ids)
+            if not ids:
+                return {"ids": [], "documents": [], "metadatas": [], "embeddings": None}
+            clauses.append(f"id IN ({', '.join('?' for _ in ids)})")
+            params.extend(ids)
+        if where:
+            sql, wparams = _where_sql(where)
+            clauses.append(sql)
+            params.extend(wparams)
+        sql = "SELECT row, id, document, metadata FROM chunks"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY row"
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params.extend([int(limit), int(offset or 0)])
+        conn = self._connect()
+        try:
+            rows = conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+        out = {
+            "ids": [r[1] for r in rows],
+            "documents": [r[2] for r in rows] if "documents" in include else None,
+            "metadatas": [json.loads(r[3]) if r[3] else {} for r in rows] if "metadatas" in include else None,
+            "embeddings": None,
+        }
+        if "embeddings" in include:
+            out["embeddings"] = np.asarray(self.full[[r[0] for r in rows]]) if rows else np.empty((0, self.dim))
+        return out
+
+
+def open_stores(collection_names, root: str = VECTOR_INDEX_DIR):
+    """QuantizedVectorStore for each exported collection name (missing ones are skipped)."""
+    stores = []
+    for name in collection_names:
+        path = store_path(name, root)
+        if os.path.exists(os.path.join(path, "store.json")):
+            stores.append(QuantizedVectorStore(path, name=name))
+    return stores
+
+
+def rebuild_stores(chroma_client, shards=None, root: str = VECTOR_INDEX_DIR) -> dict:
+    """Re-export the given shards (all when None). Returns collection name -> rows."""
+    from index_layout import active_collection_name, list_shards
+
+    os.makedirs(root, exist_ok=True)
+    built = {}
+    for shard in shards or list_shards():
+        name = active_collection_name(shard)
+        col = chroma_client.get_or_create_collection(name)
+        built[name] = build_from_chroma(col, store_path(name, root))
+
+    # Exports of versions that no longer serve queries.
+    live = {active_collection_name(shard) for shard in list_shards()}
+    for entry in os.listdir(root):
+        if entry not in live and not entry.endswith(".building"):
+            shutil.rmtree(os.path.join(root, entry), ignore_errors=True)
+    return built
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("build", help="export all shards from Chroma")
+    sub.add_parser("info", help="show exported stores")
+    args = parser.parse_args()
+
+    from index_layout import CHROMA_PATH, active_collection_name, list_shards
+
+    if args.command == "build":
+        import chromadb
+
+        chroma_client = chromadb.PersistentClient(path=CHROMA_PATH)
+        for name, rows in rebuild_stores(chroma_client).items():
+            print(f"{name}: {rows:,} vectors exported")
+        return 0
+
+    for store in open_stores([active_collection_name(s) for s in list_shards()]):
+        scanned_mb = store.q.nbytes / 1e6
+        full_mb = store.full.nbytes / 1e6
+        print(f"{store.name}: {store.rows:,} x {store.dim} (int8 scan {scanned_mb:.1f} MB, float32 {full_mb:.1f} MB)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())